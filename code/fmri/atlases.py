@@ -0,0 +1,331 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2023 The Axon Lab <theaxonlab@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Python module for a local registry of atlases.
+
+Each registered atlas is stored in a folder of the cache with its maps as an
+uncompressed (memory-mappable) NIfTI file, its labels (including the network
+assignments) as a TSV file, and the center of mass of its regions (in world
+coordinates) and the distances between them as NPY files.
+Once registered, loading an atlas only reads the labels and never calls the dataset
+fetchers of nilearn, so the registry can be populated in advance (see main) for the
+compute nodes without network access.
+"""
+
+import argparse
+import json
+import logging
+import os
+import os.path as op
+import shutil
+from typing import TYPE_CHECKING, Callable, Optional
+from uuid import uuid4
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+
+from caching import file_fingerprint, get_cache_dir, hash_key
+
+if TYPE_CHECKING:
+    from sklearn.utils import Bunch
+
+MANIFEST_FILENAME: str = "atlas.json"
+MAPS_FILENAME: str = "maps.nii"
+LABELS_FILENAME: str = "labels.tsv"
+CENTROIDS_FILENAME: str = "centroids-world.npy"
+DISTANCES_FILENAME: str = "distances.npy"
+DIFUMO_DIMENSIONS: tuple = (64, 128, 256, 512, 1024)
+
+
+def get_atlas_name(atlas_name: str, dimension: int, resolution_mm: int = 2) -> str:
+    """Return the name of an atlas entry of the registry (e.g., "DiFuMo64-2mm")."""
+    return f"{atlas_name}{dimension:d}-{resolution_mm:d}mm"
+
+
+def compute_centroids(maps_img: nib.Nifti1Image) -> np.ndarray:
+    """Compute the center of mass (in world coordinates) of each map of a 4D atlas.
+
+    The weighted sums of the voxel coordinates of all the maps are accumulated in a
+    single pass over the (memory-mapped) data, one slice at a time.
+    """
+    shape = maps_img.shape
+    n_regions = shape[3]
+    # Voxel coordinates (i, j) of one slice
+    grid = np.stack(
+        np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), indexing="ij"), axis=-1
+    ).reshape(-1, 2)
+
+    masses = np.zeros(n_regions)
+    moments = np.zeros((3, n_regions))
+    for k in range(shape[2]):
+        weights = np.asarray(maps_img.dataobj[:, :, k, :], dtype=np.float64).reshape(
+            -1, n_regions
+        )
+        slice_masses = weights.sum(axis=0)
+        masses += slice_masses
+        moments[:2] += grid.T @ weights
+        moments[2] += k * slice_masses
+
+    centroids = (moments / masses).T
+    return nib.affines.apply_affine(maps_img.affine, centroids)
+
+
+def compute_distances(centroids: np.ndarray) -> np.ndarray:
+    """Compute the euclidean distances between the centroids of the regions, as the
+    upper triangle (without the diagonal) of the distance matrix."""
+    from scipy.spatial.distance import pdist
+
+    # Same order as the upper triangle indices of numpy (np.triu_indices(n, k=1))
+    return pdist(np.asarray(centroids))
+
+
+def register_atlas(
+    name: str,
+    maps_filename: str,
+    labels: pd.DataFrame,
+    cache_dir: Optional[str] = None,
+) -> str:
+    """Add an atlas to the registry.
+
+    Parameters
+    ----------
+    name : str
+        Name of the atlas entry (see get_atlas_name)
+    maps_filename : str
+        Path to the 4D NIfTI file of the atlas maps
+    labels : pd.DataFrame
+        Labels of the atlas regions (one row per map)
+    cache_dir : Optional[str], optional
+        Root of the cache, by default None (see caching.get_cache_dir)
+
+    Returns
+    -------
+    str
+        Path to the atlas entry.
+    """
+    registry_dir = get_cache_dir(cache_dir, "atlases")
+    entry = op.join(registry_dir, name)
+    logging.info(f"Registering the atlas {name} in {registry_dir} ...")
+
+    maps_img = nib.load(maps_filename)
+    # Write to a temporary folder first so that concurrent jobs never read a
+    # partially written entry
+    tmp_entry = op.join(registry_dir, f".tmp-{uuid4()}")
+    os.makedirs(tmp_entry)
+    maps_img = nib.Nifti1Image(
+        np.asarray(maps_img.dataobj, dtype=np.float32), maps_img.affine
+    )
+    maps_img.to_filename(op.join(tmp_entry, MAPS_FILENAME))
+    labels.to_csv(op.join(tmp_entry, LABELS_FILENAME), sep="\t", index=False)
+    centroids = compute_centroids(maps_img)
+    np.save(op.join(tmp_entry, CENTROIDS_FILENAME), centroids)
+    np.save(op.join(tmp_entry, DISTANCES_FILENAME), compute_distances(centroids))
+    with open(op.join(tmp_entry, MANIFEST_FILENAME), "w") as f:
+        json.dump(
+            {
+                "Name": name,
+                "Source": op.abspath(maps_filename),
+                "Shape": [int(dim) for dim in maps_img.shape],
+            },
+            f,
+        )
+
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # Registered concurrently by another job
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+    return entry
+
+
+def load_atlas(name: str, cache_dir: Optional[str] = None) -> Optional["Bunch"]:
+    """Load an atlas from the registry.
+
+    Parameters
+    ----------
+    name : str
+        Name of the atlas entry (see get_atlas_name)
+    cache_dir : Optional[str], optional
+        Root of the cache, by default None (see caching.get_cache_dir)
+
+    Returns
+    -------
+    Optional[Bunch]
+        Atlas with the fields "maps" (path to the maps), "labels" (dataframe) and
+        "centroids" (memory-mapped array, see get_atlas_centroids), None if the atlas
+        is not registered.
+    """
+    from sklearn.utils import Bunch
+
+    entry = op.join(get_cache_dir(cache_dir, "atlases"), name)
+    if not op.exists(op.join(entry, MANIFEST_FILENAME)):
+        return None
+
+    return Bunch(
+        maps=op.join(entry, MAPS_FILENAME),
+        labels=pd.read_csv(op.join(entry, LABELS_FILENAME), sep="\t"),
+        centroids=get_atlas_centroids(op.join(entry, MAPS_FILENAME)),
+    )
+
+
+def _get_derived_dir(maps_filename: str, cache_dir: Optional[str] = None) -> str:
+    """Return the folder of the centroids and distances of atlas maps: their registry
+    entry, or a cache folder keyed on the maps file for the other files."""
+    entry = op.dirname(op.abspath(maps_filename))
+    if op.basename(maps_filename) == MAPS_FILENAME and op.exists(
+        op.join(entry, MANIFEST_FILENAME)
+    ):
+        return entry
+    return get_cache_dir(
+        cache_dir, op.join("centroids", hash_key(file_fingerprint(maps_filename)))
+    )
+
+
+def _load_or_compute(path: str, compute: Callable[[], np.ndarray]) -> np.ndarray:
+    try:
+        return np.load(path, mmap_mode="r")
+    except (OSError, ValueError):
+        pass
+
+    array = compute()
+    # Write to a temporary file first so that concurrent jobs never read a partially
+    # written array
+    tmp_path = op.join(op.dirname(path), f".tmp-{uuid4()}.npy")
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+    return array
+
+
+def get_atlas_centroids(
+    maps_filename: str, cache_dir: Optional[str] = None
+) -> np.ndarray:
+    """Return the centroids (in world coordinates) of atlas maps, computed once and
+    then read from the registry entry or from the cache.
+
+    Parameters
+    ----------
+    maps_filename : str
+        Path to the 4D NIfTI file of the atlas maps
+    cache_dir : Optional[str], optional
+        Root of the cache of the maps outside of the registry, by default None (see
+        caching.get_cache_dir)
+
+    Returns
+    -------
+    np.ndarray
+        Center of mass of each region (regions x 3).
+    """
+    return _load_or_compute(
+        op.join(_get_derived_dir(maps_filename, cache_dir), CENTROIDS_FILENAME),
+        lambda: compute_centroids(nib.load(maps_filename, mmap=True)),
+    )
+
+
+def get_atlas_distances(
+    maps_filename: str, cache_dir: Optional[str] = None
+) -> np.ndarray:
+    """Return the euclidean distances between the centroids of atlas maps, as the
+    upper triangle of the distance matrix, computed once and then read from the
+    registry entry or from the cache.
+
+    Parameters
+    ----------
+    maps_filename : str
+        Path to the 4D NIfTI file of the atlas maps
+    cache_dir : Optional[str], optional
+        Root of the cache of the maps outside of the registry, by default None (see
+        caching.get_cache_dir)
+
+    Returns
+    -------
+    np.ndarray
+        Distance between each pair of regions, in the order of the upper triangle
+        indices (np.triu_indices(n_regions, k=1)).
+    """
+    return _load_or_compute(
+        op.join(_get_derived_dir(maps_filename, cache_dir), DISTANCES_FILENAME),
+        lambda: compute_distances(get_atlas_centroids(maps_filename, cache_dir)),
+    )
+
+
+def get_arguments() -> argparse.Namespace:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="""Fetch and register the DiFuMo atlases, to run the functional
+        connectivity pipeline without network access.""",
+    )
+    parser.add_argument(
+        "--dimension",
+        default=[64, 128, 512],
+        action="store",
+        nargs="+",
+        type=int,
+        choices=DIFUMO_DIMENSIONS,
+        help="a space delimited list of DiFuMo dimension(s)",
+    )
+    parser.add_argument(
+        "--resolution-mm",
+        default=2,
+        action="store",
+        type=int,
+        choices=[2, 3],
+        help="resolution (in mm) of the DiFuMo maps",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        action="store",
+        help="""directory of the atlas registry (defaults to $HCPH_FUNCONN_CACHE or
+        ~/.cache/hcph-funconn)""",
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=None,
+        action="store",
+        help="nilearn data directory where the atlases are (or will be) downloaded",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    from nilearn.datasets import fetch_atlas_difumo
+
+    args = get_arguments()
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+
+    for dimension in args.dimension:
+        name = get_atlas_name("DiFuMo", dimension, args.resolution_mm)
+        if load_atlas(name, cache_dir=args.cache_dir) is not None:
+            logging.info(f"The atlas {name} is already registered.")
+            continue
+        atlas = fetch_atlas_difumo(
+            dimension=dimension,
+            resolution_mm=args.resolution_mm,
+            data_dir=args.data_dir,
+            legacy_format=False,
+        )
+        register_atlas(name, atlas.maps, atlas.labels, cache_dir=args.cache_dir)
+
+
+if __name__ == "__main__":
+    main()
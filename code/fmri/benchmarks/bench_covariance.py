@@ -0,0 +1,118 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2023 The Axon Lab <theaxonlab@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Benchmark the shared-grid and group-level sparse inverse covariance modes against
+the per-run GraphicalLassoCV used by default.
+
+Run as:
+
+    python benchmarks/bench_covariance.py --n-sessions 10 --n-regions 64 128 --n-jobs 4
+"""
+
+import argparse
+import os.path as op
+import sys
+import warnings
+from time import perf_counter
+
+import numpy as np
+from sklearn.exceptions import ConvergenceWarning
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+
+from funconn import compute_connectivity, get_fc_strategy  # noqa: E402
+
+
+def get_arguments() -> argparse.Namespace:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="""Benchmark the estimation of sparse inverse covariance
+                    matrices.""",
+    )
+    parser.add_argument("--n-sessions", default=10, type=int, help="number of sessions")
+    parser.add_argument(
+        "--n-regions",
+        default=[64, 128],
+        nargs="+",
+        type=int,
+        help="a space delimited list of number of regions",
+    )
+    parser.add_argument(
+        "--n-timepoints", default=400, type=int, help="number of volumes per session"
+    )
+    parser.add_argument(
+        "--n-jobs", default=1, type=int, help="number of folds fitted in parallel"
+    )
+    return parser.parse_args()
+
+
+def simulate_sessions(
+    n_sessions: int, n_regions: int, n_timepoints: int, rng: np.random.Generator
+) -> list[np.ndarray]:
+    """Simulate z-scored sessions of a subject sharing a sparse precision matrix."""
+    precision = np.eye(n_regions)
+    edges = np.triu(rng.random((n_regions, n_regions)) < 3 / n_regions, k=1)
+    precision[edges] = rng.uniform(-0.3, 0.3, edges.sum())
+    precision = precision + precision.T - np.eye(n_regions)
+    # Make the precision positive definite
+    precision += np.eye(n_regions) * max(0, 0.1 - np.linalg.eigvalsh(precision)[0])
+    covariance = np.linalg.inv(precision)
+
+    sessions = []
+    for _ in range(n_sessions):
+        ts = rng.multivariate_normal(np.zeros(n_regions), covariance, n_timepoints)
+        sessions.append((ts - ts.mean(axis=0)) / ts.std(axis=0, ddof=1))
+    return sessions
+
+
+def main():
+    args = get_arguments()
+    rng = np.random.default_rng(seed=42)
+    warnings.simplefilter("ignore", ConvergenceWarning)
+
+    print(f"{'regions':>8} {'mode':>7} {'runs/s':>8} {'speedup':>8} {'max diff':>9}")
+    for n_regions in args.n_regions:
+        time_series = simulate_sessions(
+            args.n_sessions, n_regions, args.n_timepoints, rng
+        )
+
+        expected, reference_time = None, None
+        for sparse_mode in ["cv", "shared", "group"]:
+            estimator, kind, _ = get_fc_strategy(
+                sparse_mode=sparse_mode, n_jobs=args.n_jobs
+            )
+            start = perf_counter()
+            fc_matrices = compute_connectivity(
+                time_series, estimator=estimator, connectivity_kind=kind
+            )
+            elapsed = perf_counter() - start
+
+            if expected is None:
+                expected, reference_time = fc_matrices, elapsed
+            max_diff = np.abs(fc_matrices - expected).max()
+            print(
+                f"{n_regions:>8} {sparse_mode:>7} {args.n_sessions / elapsed:>8.2f} "
+                f"{reference_time / elapsed:>8.1f} {max_diff:>9.1e}"
+            )
+
+
+if __name__ == "__main__":
+    main()
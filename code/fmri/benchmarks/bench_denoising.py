@@ -0,0 +1,131 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2023 The Axon Lab <theaxonlab@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Benchmark the batched interpolation and denoising of the --no-censor path
+against the per-run NiLearn implementation.
+
+Run as:
+
+    python benchmarks/bench_denoising.py --n-runs 50 --n-regions 64 128 512
+"""
+
+import argparse
+import os.path as op
+import sys
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+
+from denoising import interpolate_and_clean  # noqa: E402
+from nilearn.signal import _handle_scrubbed_volumes, clean  # noqa: E402
+
+T_R: float = 1.6
+LOW_PASS: float = 0.15
+
+
+def get_arguments() -> argparse.Namespace:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="""Benchmark the batched interpolation and denoising of
+                    regional timeseries.""",
+    )
+    parser.add_argument("--n-runs", default=50, type=int, help="number of runs")
+    parser.add_argument(
+        "--n-regions",
+        default=[64, 128, 512],
+        nargs="+",
+        type=int,
+        help="a space delimited list of number of regions",
+    )
+    parser.add_argument(
+        "--n-timepoints", default=400, type=int, help="number of volumes per run"
+    )
+    parser.add_argument(
+        "--n-confounds", default=36, type=int, help="number of confounds per run"
+    )
+    return parser.parse_args()
+
+
+def legacy_interpolate_and_clean(signals, confounds, sample_mask) -> list:
+    denoised = []
+    for sig, conf, sm in zip(signals, confounds, sample_mask):
+        inter_sig, inter_conf = _handle_scrubbed_volumes(
+            signals=sig.copy(),
+            confounds=conf.copy(),
+            sample_mask=sm,
+            filter_type="butterworth",
+            t_r=T_R,
+        )
+        denoised.append(
+            clean(
+                inter_sig,
+                standardize="zscore_sample",
+                confounds=inter_conf,
+                low_pass=LOW_PASS,
+                t_r=T_R,
+            )
+        )
+    return denoised
+
+
+def main():
+    args = get_arguments()
+    rng = np.random.default_rng(seed=42)
+
+    print(
+        f"{'regions':>8} {'legacy (runs/s)':>16} {'batched (runs/s)':>17} {'max diff':>9}"
+    )
+    for n_regions in args.n_regions:
+        signals = [
+            rng.standard_normal((args.n_timepoints, n_regions))
+            for _ in range(args.n_runs)
+        ]
+        confounds = [
+            rng.standard_normal((args.n_timepoints, args.n_confounds))
+            for _ in range(args.n_runs)
+        ]
+        sample_mask = []
+        for _ in range(args.n_runs):
+            mask = rng.random(args.n_timepoints) > 0.05
+            mask[[0, -1]] = True
+            sample_mask.append(mask)
+
+        start = perf_counter()
+        expected = legacy_interpolate_and_clean(signals, confounds, sample_mask)
+        legacy_time = perf_counter() - start
+
+        start = perf_counter()
+        denoised, _, _ = interpolate_and_clean(
+            signals, confounds, sample_mask, T_R, low_pass=LOW_PASS
+        )
+        batched_time = perf_counter() - start
+
+        max_diff = max(np.abs(a - b).max() for a, b in zip(denoised, expected))
+        print(
+            f"{n_regions:>8} {args.n_runs / legacy_time:>16.1f} "
+            f"{args.n_runs / batched_time:>17.1f} {max_diff:>9.1e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
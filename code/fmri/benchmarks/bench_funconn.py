@@ -0,0 +1,303 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2023 The Axon Lab <theaxonlab@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Time and memory-profile each stage of funconn.py on synthetic fMRIPrep derivatives.
+
+The stages are the discovery of the functional files, the loading of the confounds,
+the extraction of the regional timeseries, their denoising, the estimation of the
+functional connectivity, the saving of the outputs and the rendering of the visual
+reports. Every combination of the requested number of runs, regions and timepoints
+is benchmarked on a freshly generated dataset, fully offline.
+
+Run as:
+
+    python benchmarks/bench_funconn.py --n-runs 4 16 --n-regions 64 128 512
+"""
+
+import argparse
+import os.path as op
+import sys
+import tempfile
+import tracemalloc
+from itertools import chain, product
+from time import perf_counter
+from typing import Callable
+
+import pandas as pd
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+
+from funconn import (  # noqa: E402
+    compute_connectivity,
+    fit_transform_patched,
+    get_fc_strategy,
+    get_report_tasks,
+    load_run_confounds,
+)
+from load_save import (  # noqa: E402
+    FC_FILLS,
+    FC_PATTERN,
+    STORAGE_EXTENSIONS,
+    TIMESERIES_FILLS,
+    TIMESERIES_PATTERN,
+    get_func_filenames_bids,
+    get_storage_fills,
+    save_output,
+)
+from nilearn.signal import clean  # noqa: E402
+from reports import REPORT_MODES, render_reports  # noqa: E402
+from synthetic import make_synthetic_dataset  # noqa: E402
+
+# Default denoising parameters of funconn.py
+DENOISING_PARAMETERS: dict = {
+    "denoising_strategy": ("high_pass", "motion", "scrub"),
+    "motion": "basic",
+    "fd_threshold": 0.4,
+    "std_dvars_threshold": 5,
+    "scrub": 5,
+}
+
+
+def get_arguments() -> argparse.Namespace:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="""Benchmark the stages of the functional connectivity pipeline
+                    on synthetic data.""",
+    )
+    parser.add_argument(
+        "--n-runs",
+        default=[4],
+        nargs="+",
+        type=int,
+        help="a space delimited list of number of runs",
+    )
+    parser.add_argument(
+        "--n-regions",
+        default=[64, 128, 512],
+        nargs="+",
+        type=int,
+        help="a space delimited list of number of regions",
+    )
+    parser.add_argument(
+        "--n-timepoints",
+        default=[200],
+        nargs="+",
+        type=int,
+        help="a space delimited list of number of volumes per run",
+    )
+    parser.add_argument(
+        "--shape",
+        default=[20, 24, 20],
+        nargs=3,
+        type=int,
+        help="spatial shape of the BOLD images",
+    )
+    parser.add_argument(
+        "--extraction-engine",
+        default="masker",
+        choices=["masker", "chunked"],
+        help="engine extracting the regional timeseries",
+    )
+    parser.add_argument(
+        "--fc-estimator",
+        default="correlation",
+        choices=["correlation", "covariance", "sparse", "sparse inverse covariance"],
+        help="type of connectivity to compute",
+    )
+    parser.add_argument(
+        "--storage",
+        default="tsv",
+        choices=list(STORAGE_EXTENSIONS),
+        help="file format of the outputs",
+    )
+    parser.add_argument(
+        "--reports",
+        default="thumbnails",
+        choices=list(REPORT_MODES),
+        help="visual reports of the individual runs",
+    )
+    parser.add_argument(
+        "--n-procs", default=1, type=int, help="number of workers for the reports"
+    )
+    parser.add_argument(
+        "--no-memory",
+        default=False,
+        action="store_true",
+        help="""do not trace the memory, whose overhead slows down the stages running
+        Python loops (e.g., saving as TSV)""",
+    )
+    parser.add_argument(
+        "--output-csv", default=None, help="path to save the results as a CSV file"
+    )
+    return parser.parse_args()
+
+
+def profile(func: Callable, *args, trace_memory: bool = True, **kwargs) -> tuple:
+    """Run a function and measure its duration and peak of traced memory (in MB, NaN
+    if the memory is not traced)."""
+    if trace_memory:
+        tracemalloc.start()
+    start = perf_counter()
+    result = func(*args, **kwargs)
+    duration = perf_counter() - start
+
+    peak_mb = float("nan")
+    if trace_memory:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024**2
+        tracemalloc.stop()
+    return result, duration, peak_mb
+
+
+def denoise(time_series: list, confounds: list, sample_masks: list, t_r: float):
+    """Denoise the extracted timeseries as NiLearn's maskers do."""
+    return [
+        clean(
+            ts,
+            confounds=conf,
+            sample_mask=mask,
+            t_r=t_r,
+            standardize="zscore_sample",
+        )
+        for ts, conf, mask in zip(time_series, confounds, sample_masks)
+    ]
+
+
+def benchmark_pipeline(dataset, output: str, args: argparse.Namespace) -> list[dict]:
+    """Run and profile the stages of the pipeline on a synthetic dataset."""
+    stages = []
+
+    def run_stage(name: str, func: Callable, *func_args, **kwargs):
+        result, duration, peak_mb = profile(
+            func, *func_args, trace_memory=not args.no_memory, **kwargs
+        )
+        stages.append({"stage": name, "time_s": duration, "peak_mb": peak_mb})
+        return result
+
+    func_filenames, t_r_list = run_stage(
+        "discovery", get_func_filenames_bids, dataset.fmriprep
+    )
+    all_filenames = list(chain.from_iterable(func_filenames))
+    t_r = t_r_list[0]
+
+    confounds, sample_masks = run_stage(
+        "confounds", load_run_confounds, all_filenames, **DENOISING_PARAMETERS
+    )
+    time_series = run_stage(
+        "extraction",
+        fit_transform_patched,
+        all_filenames,
+        dataset.atlas.maps,
+        standardize="zscore_sample",
+        t_r=t_r,
+        engine=args.extraction_engine,
+    )
+    time_series = run_stage(
+        "denoising", denoise, time_series, confounds, sample_masks, t_r
+    )
+
+    estimator, kind, fc_label = get_fc_strategy(args.fc_estimator)
+    fc_matrices = run_stage(
+        "connectivity",
+        compute_connectivity,
+        time_series,
+        estimator=estimator,
+        connectivity_kind=kind,
+    )
+
+    timeseries_fills = get_storage_fills(TIMESERIES_FILLS, args.storage)
+    fc_fills = get_storage_fills(FC_FILLS, args.storage)
+
+    def save_outputs():
+        save_output(
+            time_series,
+            all_filenames,
+            output,
+            patterns=TIMESERIES_PATTERN,
+            **timeseries_fills,
+        )
+        save_output(
+            fc_matrices,
+            all_filenames,
+            output,
+            patterns=FC_PATTERN,
+            meas=fc_label,
+            **fc_fills,
+        )
+
+    run_stage("saving", save_outputs)
+
+    report_tasks = get_report_tasks(
+        all_filenames,
+        all_filenames,
+        output,
+        confounds=confounds,
+        timeseries_fills=timeseries_fills,
+        fc_fills=fc_fills,
+        meas=fc_label,
+        labels=dataset.atlas.labels["difumo_names"],
+        networks=dataset.atlas.labels["yeo_networks7"],
+    )
+    run_stage(
+        "reports", render_reports, report_tasks, mode=args.reports, n_jobs=args.n_procs
+    )
+
+    return stages
+
+
+def main():
+    args = get_arguments()
+
+    results = []
+    for n_runs, n_regions, n_timepoints in product(
+        args.n_runs, args.n_regions, args.n_timepoints
+    ):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dataset = make_synthetic_dataset(
+                op.join(tmp_dir, "data"),
+                n_runs=n_runs,
+                n_timepoints=n_timepoints,
+                n_regions=n_regions,
+                shape=tuple(args.shape),
+            )
+            stages = benchmark_pipeline(dataset, op.join(tmp_dir, "output"), args)
+
+        for stage in stages:
+            results.append(
+                {
+                    "n_runs": n_runs,
+                    "n_regions": n_regions,
+                    "n_timepoints": n_timepoints,
+                    **stage,
+                }
+            )
+        print(
+            pd.DataFrame(results[-len(stages) :]).to_string(
+                index=False, float_format="{:.2f}".format
+            ),
+            flush=True,
+        )
+
+    if args.output_csv is not None:
+        pd.DataFrame(results).to_csv(args.output_csv, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2023 The Axon Lab <theaxonlab@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Generate synthetic fMRIPrep-style derivatives to benchmark and test the functional
+connectivity pipeline offline.
+
+The dataset contains, for each run, a preprocessed 4D BOLD image with its JSON
+sidecar (RepetitionTime) and the confounds TSV/JSON files. A small probabilistic
+atlas stands in for DiFuMo, and a MRIQC group table provides the motion IQMs.
+
+Run as:
+
+    python benchmarks/synthetic.py /tmp/synthetic --n-runs 8 --n-regions 64
+"""
+
+import argparse
+import json
+import os
+import os.path as op
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+from sklearn.utils import Bunch
+
+BOLD_ENTITIES: str = "space-MNI152NLin2009cAsym_desc-preproc_bold"
+MOTION_PARAMETERS: list = ["trans_x", "trans_y", "trans_z", "rot_x", "rot_y", "rot_z"]
+TISSUE_SIGNALS: list = ["global_signal", "csf", "white_matter"]
+N_COSINES: int = 4
+N_COMPCOR: int = 6
+N_NETWORKS: int = 7
+
+
+def get_arguments() -> argparse.Namespace:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="""Generate a synthetic fMRIPrep derivatives dataset with a local
+                    atlas stand-in.""",
+    )
+    parser.add_argument("root", help="path to the synthetic dataset")
+    parser.add_argument("--n-runs", default=8, type=int, help="number of runs")
+    parser.add_argument(
+        "--n-sessions", default=2, type=int, help="number of sessions per subject"
+    )
+    parser.add_argument(
+        "--n-timepoints", default=200, type=int, help="number of volumes per run"
+    )
+    parser.add_argument(
+        "--n-regions", default=64, type=int, help="number of atlas regions"
+    )
+    parser.add_argument(
+        "--shape",
+        default=[20, 24, 20],
+        nargs=3,
+        type=int,
+        help="spatial shape of the BOLD images",
+    )
+    parser.add_argument(
+        "--t-r", default=2.0, type=float, help="repetition time (in seconds)"
+    )
+    return parser.parse_args()
+
+
+def make_confounds(
+    n_timepoints: int, rng: np.random.Generator
+) -> tuple[pd.DataFrame, dict]:
+    """Simulate fMRIPrep confounds with a few high-motion volumes."""
+    confounds = {}
+    for name in MOTION_PARAMETERS + TISSUE_SIGNALS:
+        signal = np.cumsum(rng.standard_normal(n_timepoints)) * 0.01
+        derivative = np.r_[np.nan, np.diff(signal)]
+        confounds[name] = signal
+        confounds[f"{name}_derivative1"] = derivative
+        confounds[f"{name}_power2"] = signal**2
+        confounds[f"{name}_derivative1_power2"] = derivative**2
+
+    framewise_displacement = np.abs(rng.standard_normal(n_timepoints)) * 0.1
+    high_motion = rng.choice(n_timepoints, size=max(1, n_timepoints // 50))
+    framewise_displacement[high_motion] = 1.0
+    framewise_displacement[0] = np.nan
+    confounds["framewise_displacement"] = framewise_displacement
+    confounds["std_dvars"] = np.r_[
+        np.nan, np.abs(rng.standard_normal(n_timepoints - 1))
+    ]
+    confounds["dvars"] = confounds["std_dvars"] * 10
+
+    frame_times = np.arange(n_timepoints) + 0.5
+    for i in range(N_COSINES):
+        confounds[f"cosine{i:02d}"] = np.cos(
+            np.pi * (i + 1) * frame_times / n_timepoints
+        )
+
+    metadata = {}
+    for i in range(N_COMPCOR):
+        confounds[f"a_comp_cor_{i:02d}"] = rng.standard_normal(n_timepoints)
+        metadata[f"a_comp_cor_{i:02d}"] = {
+            "Method": "aCompCor",
+            "Mask": "combined",
+            "Retained": True,
+            "CumulativeVarianceExplained": 0.1 * (i + 1),
+        }
+
+    return pd.DataFrame(confounds), metadata
+
+
+def make_atlas(
+    root: str, n_regions: int, shape: tuple, affine: np.ndarray, rng
+) -> Bunch:
+    """Save a sparse probabilistic atlas and its labels, as a DiFuMo stand-in."""
+    centers = rng.random((n_regions, 3)) * np.array(shape)
+    grid = np.stack(np.meshgrid(*[np.arange(n) for n in shape], indexing="ij"), -1)
+    width = max(1.0, np.prod(shape) ** (1 / 3) / n_regions ** (1 / 3))
+    distances = np.linalg.norm(grid[..., None, :] - centers, axis=-1)
+    maps = np.exp(-(distances**2) / (2 * width**2))
+    maps[maps < 0.05] = 0
+
+    maps_filename = op.join(root, f"atlas-synthetic{n_regions}_probseg.nii.gz")
+    nib.Nifti1Image(maps.astype(np.float32), affine).to_filename(maps_filename)
+
+    labels = pd.DataFrame(
+        {
+            "component": np.arange(1, n_regions + 1),
+            "difumo_names": [f"Region {i + 1}" for i in range(n_regions)],
+            "yeo_networks7": [
+                f"Network {i % N_NETWORKS + 1}" for i in range(n_regions)
+            ],
+        }
+    )
+    labels.to_csv(op.join(root, f"atlas-synthetic{n_regions}_labels.csv"), index=False)
+    return Bunch(maps=maps_filename, labels=labels)
+
+
+def make_synthetic_dataset(
+    root: str,
+    n_runs: int = 8,
+    n_sessions: int = 2,
+    n_timepoints: int = 200,
+    n_regions: int = 64,
+    shape: tuple = (20, 24, 20),
+    t_r: float = 2.0,
+    seed: int = 42,
+) -> Bunch:
+    """Generate a synthetic fMRIPrep derivatives dataset.
+
+    Parameters
+    ----------
+    root : str
+        Path to the synthetic dataset
+    n_runs : int, optional
+        Number of runs, spread over subjects with n_sessions sessions each,
+        by default 8
+    n_sessions : int, optional
+        Number of sessions per subject, by default 2
+    n_timepoints : int, optional
+        Number of volumes per run, by default 200
+    n_regions : int, optional
+        Number of regions of the atlas stand-in, by default 64
+    shape : tuple, optional
+        Spatial shape of the BOLD images, by default (20, 24, 20)
+    t_r : float, optional
+        Repetition time (in seconds), by default 2.0
+    seed : int, optional
+        Seed of the random generator, by default 42
+
+    Returns
+    -------
+    Bunch
+        Paths to the fMRIPrep derivatives ("fmriprep"), the MRIQC derivatives
+        ("mriqc"), the functional files ("func_filenames") and the atlas stand-in
+        ("atlas", with the same fields as load_save.get_atlas_data).
+    """
+    rng = np.random.default_rng(seed=seed)
+    affine = np.diag([3.0, 3.0, 3.0, 1.0])
+    affine[:3, 3] = -1.5 * np.array(shape)
+
+    fmriprep_dir = op.join(root, "derivatives", "fmriprep")
+    mriqc_dir = op.join(root, "derivatives", "mriqc")
+    os.makedirs(fmriprep_dir, exist_ok=True)
+    os.makedirs(mriqc_dir, exist_ok=True)
+    with open(op.join(fmriprep_dir, "dataset_description.json"), "w") as f:
+        json.dump(
+            {
+                "Name": "Synthetic fMRIPrep derivatives",
+                "BIDSVersion": "1.8.0",
+                "DatasetType": "derivative",
+                "GeneratedBy": [{"Name": "fMRIPrep", "Version": "23.1.4"}],
+            },
+            f,
+        )
+
+    atlas = make_atlas(root, n_regions, shape, affine, rng)
+    maps = nib.load(atlas.maps).get_fdata().reshape(-1, n_regions)
+
+    func_filenames, iqms = [], []
+    for run in range(n_runs):
+        subject = f"{run // n_sessions + 1:03d}"
+        session = f"{run % n_sessions + 1:03d}"
+        func_dir = op.join(fmriprep_dir, f"sub-{subject}", f"ses-{session}", "func")
+        os.makedirs(func_dir, exist_ok=True)
+        prefix = op.join(func_dir, f"sub-{subject}_ses-{session}_task-rest")
+
+        # Regional signals with a shared correlation structure, plus voxel noise
+        mixing = rng.standard_normal((n_regions, n_regions)) / np.sqrt(n_regions)
+        signals = rng.standard_normal((n_timepoints, n_regions)) @ (
+            np.eye(n_regions) + mixing
+        )
+        bold = maps @ signals.T + rng.standard_normal((maps.shape[0], n_timepoints))
+        bold = 100 + 5 * bold.reshape(tuple(shape) + (n_timepoints,))
+        func_filename = f"{prefix}_{BOLD_ENTITIES}.nii.gz"
+        nib.Nifti1Image(bold.astype(np.float32), affine).to_filename(func_filename)
+        with open(f"{prefix}_{BOLD_ENTITIES}.json", "w") as f:
+            json.dump({"RepetitionTime": t_r, "TaskName": "rest"}, f)
+
+        confounds, metadata = make_confounds(n_timepoints, rng)
+        confounds.to_csv(
+            f"{prefix}_desc-confounds_timeseries.tsv",
+            sep="\t",
+            index=False,
+            na_rep="n/a",
+        )
+        with open(f"{prefix}_desc-confounds_timeseries.json", "w") as f:
+            json.dump(metadata, f)
+
+        framewise_displacement = confounds["framewise_displacement"]
+        iqms.append(
+            {
+                "bids_name": f"sub-{subject}_ses-{session}_task-rest_bold",
+                "fd_mean": np.nanmean(framewise_displacement),
+                "fd_num": int((framewise_displacement > 0.2).sum()),
+                "fd_perc": 100 * np.mean(framewise_displacement > 0.2),
+            }
+        )
+        func_filenames.append(func_filename)
+
+    pd.DataFrame(iqms).to_csv(
+        op.join(mriqc_dir, "group_bold.tsv"), sep="\t", index=False
+    )
+
+    return Bunch(
+        fmriprep=fmriprep_dir,
+        mriqc=mriqc_dir,
+        func_filenames=func_filenames,
+        atlas=atlas,
+    )
+
+
+def main():
+    args = get_arguments()
+    dataset = make_synthetic_dataset(
+        args.root,
+        n_runs=args.n_runs,
+        n_sessions=args.n_sessions,
+        n_timepoints=args.n_timepoints,
+        n_regions=args.n_regions,
+        shape=tuple(args.shape),
+        t_r=args.t_r,
+    )
+    print(f"Synthetic fMRIPrep derivatives: {dataset.fmriprep}")
+    print(f"Atlas stand-in: {dataset.atlas.maps}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2023 The Axon Lab <theaxonlab@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Python module for a persistent index of BIDS functional files.
+
+Building a ``BIDSLayout`` parses every file of the dataset. Instead, the index stores
+the listing of each directory together with its modification time, and only the
+directories modified since the last run are listed and parsed again. The index is
+saved as a JSON file at the root of the derivatives, and shared by all the datasets
+(e.g., fMRIPrep derivatives and the derivatives folder itself) found below it.
+The NIfTI headers of the indexed files are stored in the same index, so that only
+the new or modified files are opened again.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import os.path as op
+from typing import Optional
+from uuid import uuid4
+
+from nibabel import Nifti1Header, Nifti2Header
+from nibabel.openers import ImageOpener
+from nibabel.spatialimages import HeaderDataError
+
+from caching import get_cache_dir, hash_key
+
+INDEX_FILENAME: str = ".funconn_bids_index.json"
+INDEX_VERSION: int = 1
+# Folders of the scanned dataset that are not indexed, as in BIDSLayout
+IGNORED_FOLDERS: tuple = ("code", "derivatives", "models", "sourcedata", "stimuli")
+INDEXED_EXTENSIONS: tuple = (".nii.gz", ".nii", ".json")
+
+
+def get_index_filename(base_dir: str) -> str:
+    """Return the path to the index of a directory, in the directory itself if it is
+    writable or in the cache otherwise.
+
+    Parameters
+    ----------
+    base_dir : str
+        Directory whose content is indexed (usually the derivatives folder)
+
+    Returns
+    -------
+    str
+        Path to the index file.
+    """
+    if os.access(base_dir, os.W_OK):
+        return op.join(base_dir, INDEX_FILENAME)
+    cache_dir = get_cache_dir(subfolder="bids_index")
+    return op.join(cache_dir, f"{hash_key(op.abspath(base_dir))}.json")
+
+
+def load_index(index_filename: str) -> dict:
+    """Load an index, or return an empty one if it is missing or outdated."""
+    try:
+        with open(index_filename) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {"version": INDEX_VERSION, "directories": {}}
+
+    if index.get("version") != INDEX_VERSION:
+        return {"version": INDEX_VERSION, "directories": {}}
+    return index
+
+
+def save_index(index: dict, index_filename: str) -> None:
+    """Save an index atomically, so that concurrent runs never read a partial file."""
+    tmp_filename = f"{index_filename}.tmp-{uuid4().hex}"
+    try:
+        with open(tmp_filename, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_filename, index_filename)
+    except OSError as msg:
+        logging.warning(f"The BIDS index could not be saved: {msg}")
+        if op.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def _serialize_entities(entities: dict) -> dict:
+    """Convert the entities parsed by PyBIDS to JSON values (e.g., run numbers)."""
+    return {
+        key: value if isinstance(value, str) else int(value)
+        for key, value in entities.items()
+    }
+
+
+def _scan_directory(path: str, entry: Optional[dict]) -> tuple[dict, bool]:
+    """Return the listing of a directory, from the index if it was not modified."""
+    mtime_ns = os.stat(path).st_mtime_ns
+    if entry is not None and entry["mtime_ns"] == mtime_ns:
+        return entry, False
+
+    from bids.layout import parse_file_entities
+
+    # The files still present keep their entry (headers and sidecars are validated
+    # by their own fingerprint)
+    previous_files = entry["files"] if entry is not None else {}
+    dirs, files = [], {}
+    with os.scandir(path) as it:
+        for dir_entry in it:
+            if dir_entry.name.startswith("."):
+                continue
+            if dir_entry.is_dir():
+                dirs.append(dir_entry.name)
+            elif dir_entry.name in previous_files:
+                files[dir_entry.name] = previous_files[dir_entry.name]
+            elif dir_entry.name.endswith(INDEXED_EXTENSIONS):
+                files[dir_entry.name] = {
+                    "entities": _serialize_entities(parse_file_entities(dir_entry.path))
+                }
+    return {"mtime_ns": mtime_ns, "dirs": sorted(dirs), "files": files}, True
+
+
+def _fingerprint(path: str) -> list:
+    """Return the size and modification time of a file."""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _read_sidecar(path: str, file_entry: dict) -> tuple[dict, bool]:
+    """Return the metadata of a JSON sidecar, from the index if it was not modified."""
+    fingerprint = _fingerprint(path)
+    if file_entry.get("fingerprint") == fingerprint:
+        return file_entry["metadata"], False
+
+    with open(path) as f:
+        file_entry["metadata"] = json.load(f)
+    file_entry["fingerprint"] = fingerprint
+    return file_entry["metadata"], True
+
+
+def _match_filters(entities: dict, filters: dict) -> bool:
+    """Check that entities match all the filters (values are compared as strings,
+    and runs as numbers)."""
+    for key, values in filters.items():
+        if not values:
+            continue
+        if key == "run":
+            if entities.get(key) not in [int(value) for value in values]:
+                return False
+        elif str(entities.get(key)) not in [str(value) for value in values]:
+            return False
+    return True
+
+
+def _is_inherited(sidecar_entities: dict, entities: dict) -> bool:
+    """Check if a JSON sidecar applies to a file (inheritance principle)."""
+    return all(
+        entities.get(key) == value
+        for key, value in sidecar_entities.items()
+        if key not in ["extension", "datatype"]
+    )
+
+
+def find_func_files(
+    root: str,
+    suffix: str = "bold",
+    base_dir: Optional[str] = None,
+    reindex: bool = False,
+    **filters,
+) -> list[tuple[str, dict]]:
+    """Find the functional files of a BIDS dataset (or derivatives) with their
+    metadata, using the persistent index.
+
+    Parameters
+    ----------
+    root : str
+        Path to the BIDS (usually derivatives) directory
+    suffix : str, optional
+        Suffix of the files to find, by default "bold"
+    base_dir : Optional[str], optional
+        Directory where the index is stored, which must contain the root,
+        by default the root itself
+    reindex : bool, optional
+        Condition to rebuild the index from scratch, by default False
+    **filters
+        Lists of accepted values of BIDS entities (e.g., task=["rest"]). Empty
+        lists accept any value.
+
+    Returns
+    -------
+    list[tuple[str, dict]]
+        Sorted paths to the NIfTI files, each with its metadata (merged from the
+        JSON sidecars, following the BIDS inheritance principle).
+    """
+    root = op.abspath(root)
+    base_dir = op.abspath(base_dir or root)
+    if op.commonpath([root, base_dir]) != base_dir:
+        raise ValueError(f"The dataset {root} is not contained in {base_dir}.")
+
+    index_filename = get_index_filename(base_dir)
+    index = load_index(index_filename)
+    if reindex:
+        index["directories"] = {}
+    directories = index["directories"]
+
+    modified = False
+    func_files = []
+    # Stack of (path of the directory, sidecars applying to its files)
+    stack = [(root, [])]
+    while stack:
+        path, sidecars = stack.pop()
+        key = op.relpath(path, base_dir)
+        entry, rescanned = _scan_directory(path, directories.get(key))
+        directories[key] = entry
+        modified |= rescanned
+
+        sidecars = sidecars + [
+            (op.join(path, name), file_entry)
+            for name, file_entry in entry["files"].items()
+            if name.endswith(".json") and file_entry["entities"].get("suffix") == suffix
+        ]
+        for name, file_entry in entry["files"].items():
+            entities = file_entry["entities"]
+            if name.endswith(".json") or entities.get("suffix") != suffix:
+                continue
+            if not _match_filters(entities, filters):
+                continue
+
+            metadata = {}
+            # Sidecars from upper folders, then less specific ones, are applied first
+            for sidecar_path, sidecar_entry in sorted(
+                sidecars,
+                key=lambda item: (item[0].count(os.sep), len(item[1]["entities"])),
+            ):
+                if _is_inherited(sidecar_entry["entities"], entities):
+                    sidecar_metadata, reread = _read_sidecar(
+                        sidecar_path, sidecar_entry
+                    )
+                    metadata.update(sidecar_metadata)
+                    modified |= reread
+            func_files.append((op.join(path, name), metadata))
+
+        for name in entry["dirs"]:
+            if path == root and name in IGNORED_FOLDERS:
+                continue
+            stack.append((op.join(path, name), sidecars))
+
+    # Forget the directories that were removed
+    for key in list(directories):
+        if not op.isdir(op.join(base_dir, key)):
+            del directories[key]
+            modified = True
+
+    if modified:
+        save_index(index, index_filename)
+
+    return sorted(func_files)
+
+
+def read_nifti_header(path: str) -> dict:
+    """Read the header of a NIfTI file, without loading (nor decompressing) its data.
+
+    Parameters
+    ----------
+    path : str
+        Path to the NIfTI (possibly gzipped) file
+
+    Returns
+    -------
+    dict
+        Dictionary with keys "affine" (4x4 nested list), "shape", "zooms" (lists) and
+        "dtype" (string).
+    """
+    with ImageOpener(path) as fileobj:
+        try:
+            header = Nifti1Header.from_fileobj(fileobj)
+        except HeaderDataError:
+            fileobj.seek(0)
+            header = Nifti2Header.from_fileobj(fileobj)
+
+    return {
+        "affine": header.get_best_affine().tolist(),
+        "shape": [int(dim) for dim in header.get_data_shape()],
+        "zooms": [float(zoom) for zoom in header.get_zooms()],
+        "dtype": str(header.get_data_dtype()),
+    }
+
+
+def scan_headers(
+    filenames: list[str],
+    base_dir: Optional[str] = None,
+    n_jobs: int = 1,
+) -> dict[str, dict]:
+    """Return the NIfTI headers of files, reading only the new or modified ones in a
+    pool of threads.
+
+    The headers are cached in the index (see find_func_files) by size and modification
+    time of the file. Files absent from the index are read but not cached.
+
+    Parameters
+    ----------
+    filenames : list[str]
+        Paths to the NIfTI files
+    base_dir : Optional[str], optional
+        Directory where the index is stored, by default the common directory of the
+        files
+    n_jobs : int, optional
+        Number of threads reading the headers, by default 1
+
+    Returns
+    -------
+    dict[str, dict]
+        Header of each file, as returned by read_nifti_header.
+    """
+    if not filenames:
+        return {}
+    filenames = [op.abspath(filename) for filename in filenames]
+    base_dir = op.abspath(
+        base_dir or op.commonpath([op.dirname(filename) for filename in filenames])
+    )
+
+    index_filename = get_index_filename(base_dir)
+    index = load_index(index_filename)
+    directories = index["directories"]
+
+    headers, to_read = {}, []
+    for filename in filenames:
+        key = op.relpath(op.dirname(filename), base_dir)
+        file_entry = (
+            directories.get(key, {}).get("files", {}).get(op.basename(filename))
+        )
+        fingerprint = _fingerprint(filename)
+        if file_entry is not None and file_entry.get("fingerprint") == fingerprint:
+            headers[filename] = file_entry["header"]
+        else:
+            to_read.append((filename, file_entry, fingerprint))
+
+    if not to_read:
+        return headers
+
+    logging.debug(f"Reading the NIfTI header of {len(to_read)} file(s)...")
+    with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+        read_headers = executor.map(
+            read_nifti_header, [filename for filename, _, _ in to_read]
+        )
+        for (filename, file_entry, fingerprint), header in zip(to_read, read_headers):
+            headers[filename] = header
+            if file_entry is not None:
+                file_entry["fingerprint"] = fingerprint
+                file_entry["header"] = header
+
+    if any(file_entry is not None for _, file_entry, _ in to_read):
+        save_index(index, index_filename)
+
+    return headers
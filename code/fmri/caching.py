@@ -0,0 +1,122 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2023 The Axon Lab <theaxonlab@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Python module with the helpers shared by the on-disk caches"""
+
+import hashlib
+import logging
+import os
+import os.path as op
+import shutil
+from typing import Optional
+
+CACHE_ENV_VARIABLE: str = "HCPH_FUNCONN_CACHE"
+DEFAULT_CACHE_DIR: str = op.join("~", ".cache", "hcph-funconn")
+DEFAULT_CACHE_MAX_GB: float = 20.0
+
+
+def get_cache_dir(cache_dir: Optional[str] = None, subfolder: str = "") -> str:
+    """Return (and create) the cache directory.
+
+    Parameters
+    ----------
+    cache_dir : Optional[str], optional
+        Root of the cache, by default the value of the environment variable
+        HCPH_FUNCONN_CACHE or "~/.cache/hcph-funconn"
+    subfolder : str, optional
+        Subfolder of the cache root, by default ""
+
+    Returns
+    -------
+    str
+        Absolute path to the cache directory.
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get(CACHE_ENV_VARIABLE, DEFAULT_CACHE_DIR)
+
+    cache_dir = op.abspath(op.expanduser(op.join(cache_dir, subfolder)))
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def hash_key(*items) -> str:
+    """Return a stable hexadecimal digest of the representation of the items."""
+    return hashlib.sha1(repr(items).encode()).hexdigest()
+
+
+def file_digest(path: str, chunk_size: int = 2**20) -> str:
+    """Return the SHA-1 digest of the content of a file."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path: str) -> list:
+    """Return the absolute path, size and modification time of a file (size and
+    modification time are None if it does not exist)."""
+    path = op.abspath(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return [path, None, None]
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+
+def _entry_size(path: str) -> int:
+    if not op.isdir(path):
+        return op.getsize(path)
+    return sum(
+        op.getsize(op.join(root, name))
+        for root, _, files in os.walk(path)
+        for name in files
+    )
+
+
+def evict_cache(cache_dir: str, max_gb: float = DEFAULT_CACHE_MAX_GB) -> None:
+    """Remove the least recently used entries of a cache directory until its size
+    falls under the limit.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Path to the cache directory, each file or folder being one entry
+    max_gb : float, optional
+        Maximum size of the cache in GB, by default DEFAULT_CACHE_MAX_GB
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.startswith("."):
+            continue
+        entries.append((entry.stat().st_mtime, _entry_size(entry.path), entry.path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_gb * 1024**3:
+            break
+        logging.debug(f"Evicting cache entry {path}")
+        if op.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+        total_size -= size
@@ -0,0 +1,301 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2023 The Axon Lab <theaxonlab@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Python module for the fast estimation of sparse inverse covariance matrices.
+
+Scikit-Learn's ``GraphicalLassoCV`` selects the regularization of every run
+independently, with several refinements of its alpha grid. Here, all the runs share
+one alpha grid, the cross-validation folds are computed in parallel and each fit is
+warm-started from the covariance estimated for the previous run (usually another
+session of the same subject). Optionally, a single group-level alpha is selected and
+every run is then fitted once.
+"""
+
+import logging
+import warnings
+from typing import Optional, Union
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import BaseEstimator, clone
+from sklearn.covariance import empirical_covariance
+from sklearn.covariance._graph_lasso import (
+    _graphical_lasso,
+    alpha_max,
+    graphical_lasso_path,
+)
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.model_selection import KFold
+
+DEFAULT_N_ALPHAS: int = 8
+
+
+def get_alpha_grid(
+    time_series: list[np.ndarray], n_alphas: int = DEFAULT_N_ALPHAS
+) -> np.ndarray:
+    """Compute an alpha grid covering the regularization range of all the runs.
+
+    Parameters
+    ----------
+    time_series : list[np.ndarray]
+        List of timeseries (time x regions)
+    n_alphas : int, optional
+        Number of alphas in the grid, by default 8
+
+    Returns
+    -------
+    np.ndarray
+        Decreasing alphas, log-spaced from the largest useful alpha of all the runs
+        down to a hundredth of the smallest one.
+    """
+    alphas_max = [alpha_max(empirical_covariance(ts)) for ts in time_series]
+    return np.logspace(
+        np.log10(1e-2 * min(alphas_max)), np.log10(max(alphas_max)), n_alphas
+    )[::-1]
+
+
+def _graphical_lasso_path(*args, **kwargs) -> tuple:
+    """Compute a graphical lasso path without convergence warnings, which are
+    expected on the smallest alphas of the cross-validation grid."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", ConvergenceWarning)
+        return graphical_lasso_path(*args, **kwargs)
+
+
+def _path_scores(
+    time_series: np.ndarray, alphas: np.ndarray, cv: int, **kwargs
+) -> list[tuple]:
+    """List the tasks scoring the alpha grid on each fold of a run."""
+    return [
+        delayed(_graphical_lasso_path)(
+            time_series[train], alphas=alphas, X_test=time_series[test], **kwargs
+        )
+        for train, test in KFold(n_splits=cv).split(time_series)
+    ]
+
+
+def _best_alpha(alphas: np.ndarray, scores: np.ndarray) -> float:
+    """Select the alpha of maximum mean score (the smallest one in case of ties)."""
+    mean_scores = np.mean(scores, axis=0)
+    mean_scores[~np.isfinite(mean_scores)] = -np.inf
+    return alphas[len(alphas) - 1 - np.argmax(mean_scores[::-1])]
+
+
+def select_group_alpha(
+    time_series: list[np.ndarray],
+    alphas: np.ndarray,
+    cv: int = 5,
+    max_iter: int = 100,
+    n_jobs: Optional[int] = None,
+    **kwargs,
+) -> float:
+    """Select one alpha for all the runs by cross-validation.
+
+    Parameters
+    ----------
+    time_series : list[np.ndarray]
+        List of timeseries (time x regions)
+    alphas : np.ndarray
+        Decreasing alphas to evaluate
+    cv : int, optional
+        Number of cross-validation folds per run, by default 5
+    max_iter : int, optional
+        Maximum number of iterations of each fit, by default 100
+    n_jobs : Optional[int], optional
+        Number of folds evaluated in parallel, by default None
+
+    Returns
+    -------
+    float
+        Alpha maximizing the test log-likelihood averaged over all folds and runs.
+    """
+    tasks = [
+        task
+        for ts in time_series
+        for task in _path_scores(ts, alphas, cv, max_iter=max_iter, **kwargs)
+    ]
+    paths = Parallel(n_jobs=n_jobs)(tasks)
+
+    group_alpha = _best_alpha(alphas, np.array([path[2] for path in paths]))
+    logging.info(
+        f"Group-level alpha of the sparse inverse covariance: {group_alpha:.3g}"
+    )
+    return group_alpha
+
+
+class SharedGraphicalLassoCV(BaseEstimator):
+    """Sparse inverse covariance with cross-validated alpha, meant to be fitted on
+    several runs in a row.
+
+    Parameters
+    ----------
+    alphas : Union[int, np.ndarray], optional
+        Alpha grid, or number of alphas of the grid computed from the data of each
+        run, by default 8
+    group_alpha : bool, optional
+        Condition to select one alpha for all the runs (see prepare_estimator),
+        by default False
+    cv : int, optional
+        Number of cross-validation folds, by default 5
+    max_iter : int, optional
+        Maximum number of iterations of the final fit (the cross-validation uses a
+        tenth of it, as GraphicalLassoCV), by default 1000
+    tol : float, optional
+        Tolerance of the graphical lasso, by default 1e-4
+    enet_tol : float, optional
+        Tolerance of the elastic net solver, by default 1e-4
+    mode : str, optional
+        Solver of the graphical lasso ("cd" or "lars"), by default "cd"
+    warm_start : bool, optional
+        Condition to initialize each fit with the covariance of the previous run,
+        by default True
+    n_jobs : Optional[int], optional
+        Number of cross-validation folds computed in parallel, by default None
+    """
+
+    def __init__(
+        self,
+        alphas: Union[int, np.ndarray] = DEFAULT_N_ALPHAS,
+        group_alpha: bool = False,
+        cv: int = 5,
+        max_iter: int = 1000,
+        tol: float = 1e-4,
+        enet_tol: float = 1e-4,
+        mode: str = "cd",
+        warm_start: bool = True,
+        n_jobs: Optional[int] = None,
+    ):
+        self.alphas = alphas
+        self.group_alpha = group_alpha
+        self.cv = cv
+        self.max_iter = max_iter
+        self.tol = tol
+        self.enet_tol = enet_tol
+        self.mode = mode
+        self.warm_start = warm_start
+        self.n_jobs = n_jobs
+
+    def fit(self, X: np.ndarray, y=None) -> "SharedGraphicalLassoCV":
+        """Fit the sparse inverse covariance of one run.
+
+        Parameters
+        ----------
+        X : np.ndarray
+            Timeseries of the run (time x regions)
+
+        Returns
+        -------
+        SharedGraphicalLassoCV
+            The fitted estimator.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        emp_cov = empirical_covariance(X)
+        self.location_ = X.mean(axis=0)
+
+        cov_init = getattr(self, "covariance_", None) if self.warm_start else None
+        if cov_init is not None and cov_init.shape != emp_cov.shape:
+            cov_init = None
+
+        alphas = self.alphas
+        if np.isscalar(alphas):
+            alphas = get_alpha_grid([X], n_alphas=alphas)
+        alphas = np.sort(np.asarray(alphas, dtype=np.float64))[::-1]
+        solver_kwargs = {"mode": self.mode, "tol": self.tol, "enet_tol": self.enet_tol}
+
+        if len(alphas) > 1:
+            paths = Parallel(n_jobs=self.n_jobs)(
+                _path_scores(
+                    X,
+                    alphas,
+                    self.cv,
+                    cov_init=cov_init,
+                    max_iter=max(1, int(0.1 * self.max_iter)),
+                    **solver_kwargs,
+                )
+            )
+            scores = np.array([path[2] for path in paths])
+            self.cv_results_ = {
+                "alphas": alphas,
+                "mean_test_score": np.mean(scores, axis=0),
+            }
+            self.alpha_ = _best_alpha(alphas, scores)
+        else:
+            self.alpha_ = alphas[0]
+
+        try:
+            fitted = _graphical_lasso(
+                emp_cov,
+                alpha=self.alpha_,
+                cov_init=cov_init,
+                max_iter=self.max_iter,
+                **solver_kwargs,
+            )
+        except FloatingPointError:
+            if cov_init is None:
+                raise
+            # The covariance of the previous run can be a poor starting point
+            fitted = _graphical_lasso(
+                emp_cov, alpha=self.alpha_, max_iter=self.max_iter, **solver_kwargs
+            )
+        self.covariance_, self.precision_, self.costs_, self.n_iter_ = fitted
+        return self
+
+
+def prepare_estimator(estimator, time_series: list[np.ndarray]):
+    """Set the alphas shared by all the runs of a SharedGraphicalLassoCV estimator.
+
+    Parameters
+    ----------
+    estimator : BaseEstimator
+        Covariance estimator, returned unchanged if it is not a
+        SharedGraphicalLassoCV
+    time_series : list[np.ndarray]
+        List of all the timeseries (time x regions) to be fitted
+
+    Returns
+    -------
+    BaseEstimator
+        Copy of the estimator with the shared alpha grid, or a single group-level
+        alpha if group_alpha is True.
+    """
+    if not isinstance(estimator, SharedGraphicalLassoCV) or not len(time_series):
+        return estimator
+
+    alphas = estimator.alphas
+    if np.isscalar(alphas):
+        alphas = get_alpha_grid(time_series, n_alphas=alphas)
+
+    if estimator.group_alpha:
+        alphas = [
+            select_group_alpha(
+                time_series,
+                alphas,
+                cv=estimator.cv,
+                max_iter=max(1, int(0.1 * estimator.max_iter)),
+                n_jobs=estimator.n_jobs,
+                mode=estimator.mode,
+                tol=estimator.tol,
+                enet_tol=estimator.enet_tol,
+            )
+        ]
+
+    return clone(estimator).set_params(alphas=np.asarray(alphas))
@@ -0,0 +1,241 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2023 The Axon Lab <theaxonlab@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Python module for the batched denoising of regional timeseries.
+
+The functions reproduce NiLearn's ``signal.clean`` (linear detrending, Butterworth
+filtering, confound regression and standardization), but process all the runs
+sharing a repetition time together: detrending and filtering are applied once to
+the stacked runs, and only the confound regression is solved run by run.
+"""
+
+from collections import defaultdict
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+from scipy import linalg
+from scipy.interpolate import CubicSpline
+
+from nilearn.signal import _detrend, butterworth
+
+
+def get_boolean_mask(sample_mask: np.ndarray, n_timepoints: int) -> np.ndarray:
+    """Convert a sample mask (indices or booleans) into a boolean mask.
+
+    Parameters
+    ----------
+    sample_mask : np.ndarray
+        Indices or boolean mask of the volumes kept after censoring
+    n_timepoints : int
+        Number of volumes of the run
+
+    Returns
+    -------
+    np.ndarray
+        Boolean mask of the volumes kept after censoring.
+    """
+    sample_mask = np.asarray(sample_mask)
+    if sample_mask.dtype == bool:
+        return sample_mask
+
+    boolean_mask = np.zeros(n_timepoints, dtype=bool)
+    boolean_mask[sample_mask] = True
+    return boolean_mask
+
+
+def _confounds_array(
+    confounds: Optional[Union[np.ndarray, pd.DataFrame]],
+) -> Optional[np.ndarray]:
+    """Convert the confounds of one run into a 2D float array (time x confounds)."""
+    if confounds is None:
+        return None
+    confounds = np.asarray(confounds, dtype=np.float64)
+    return confounds.reshape(confounds.shape[0], -1)
+
+
+def interpolate_volumes(
+    volumes: np.ndarray, sample_mask: np.ndarray, t_r: float
+) -> np.ndarray:
+    """Interpolate the censored volumes of all the columns at once with a cubic
+    spline fitted on the kept volumes.
+
+    Parameters
+    ----------
+    volumes : np.ndarray
+        Signals to interpolate (time x columns)
+    sample_mask : np.ndarray
+        Indices or boolean mask of the volumes kept after censoring
+    t_r : float
+        Repetition time of the MRI acquisition
+
+    Returns
+    -------
+    np.ndarray
+        Copy of the signals whose censored volumes are interpolated.
+    """
+    volumes = volumes.copy()
+    kept = get_boolean_mask(sample_mask, volumes.shape[0])
+    if kept.all():
+        return volumes
+
+    frame_times = np.arange(volumes.shape[0]) * t_r
+    spline = CubicSpline(frame_times[kept], volumes[kept])
+    volumes[~kept] = spline(frame_times[~kept])
+    return volumes
+
+
+def _standardize_columns(signals: np.ndarray, ddof: int = 1) -> np.ndarray:
+    """Z-score centered signals column-wise, as NiLearn does."""
+    std = signals.std(axis=0, ddof=ddof)
+    std[std < np.finfo(np.float64).eps] = 1.0
+    return signals / std
+
+
+def _detrend_and_filter(
+    signals: list[np.ndarray],
+    t_r: float,
+    low_pass: Optional[float] = None,
+    high_pass: Optional[float] = None,
+) -> list[np.ndarray]:
+    """Detrend and filter a list of runs of equal length in one pass."""
+    widths = np.cumsum([sig.shape[1] for sig in signals])[:-1]
+    stacked = _detrend(np.hstack(signals))
+
+    if low_pass is not None or high_pass is not None:
+        # With copy=True, the filter is applied to all the columns in one call
+        stacked = butterworth(
+            stacked,
+            sampling_rate=1.0 / t_r,
+            low_pass=low_pass,
+            high_pass=high_pass,
+            copy=True,
+        )
+    return np.split(stacked, widths, axis=1)
+
+
+def interpolate_and_clean(
+    signals: list[np.ndarray],
+    confounds: list[Optional[Union[np.ndarray, pd.DataFrame]]],
+    sample_mask: list[Optional[np.ndarray]],
+    t_r: float,
+    low_pass: Optional[float] = None,
+    high_pass: Optional[float] = None,
+    standardize: Union[bool, str] = "zscore_sample",
+) -> tuple[list[np.ndarray], list[np.ndarray], list[Optional[np.ndarray]]]:
+    """Interpolate the censored volumes and denoise a batch of runs sharing the same
+    repetition time.
+
+    This is equivalent to calling, for each run, NiLearn's
+    ``signal._handle_scrubbed_volumes`` with a Butterworth filter and then
+    ``signal.clean(signals, confounds=confounds, standardize=standardize,
+    low_pass=low_pass, high_pass=high_pass, t_r=t_r)``.
+
+    Parameters
+    ----------
+    signals : list[np.ndarray]
+        Regional timeseries of each run (time x regions)
+    confounds : list[Optional[Union[np.ndarray, pd.DataFrame]]]
+        Confounds of each run (time x confounds)
+    sample_mask : list[Optional[np.ndarray]]
+        Indices or boolean mask of the volumes kept after censoring of each run
+    t_r : float
+        Repetition time of the MRI acquisition
+    low_pass : Optional[float], optional
+        Low-pass filtering cutoff frequency, by default None
+    high_pass : Optional[float], optional
+        High-pass filtering cutoff frequency, by default None
+    standardize : Union[bool, str], optional
+        Standardization strategy of the denoised signals (see NiLearn's
+        ``signal.clean``), by default "zscore_sample"
+
+    Returns
+    -------
+    tuple[list[np.ndarray], list[np.ndarray], list[Optional[np.ndarray]]]
+        Three lists, with the denoised timeseries, the interpolated timeseries and
+        the interpolated confounds of each run.
+    """
+    interpolated_signals = []
+    interpolated_confounds = []
+    for sig, conf, sm in zip(signals, confounds, sample_mask):
+        sig = np.asarray(sig)
+        if sig.dtype.kind != "f":
+            sig = sig.astype(np.float64)
+        conf = _confounds_array(conf)
+
+        if sm is not None:
+            sig = interpolate_volumes(sig, sm, t_r)
+            if conf is not None:
+                conf = interpolate_volumes(conf, sm, t_r)
+        interpolated_signals.append(sig)
+        interpolated_confounds.append(conf)
+
+    # Runs of equal length are detrended and filtered together
+    runs_by_length = defaultdict(list)
+    for i, sig in enumerate(interpolated_signals):
+        runs_by_length[sig.shape[0]].append(i)
+
+    denoised_signals = [None] * len(signals)
+    for run_indices in runs_by_length.values():
+        filtered_signals = _detrend_and_filter(
+            [interpolated_signals[i] for i in run_indices],
+            t_r,
+            low_pass=low_pass,
+            high_pass=high_pass,
+        )
+
+        with_confounds = [
+            i for i in run_indices if interpolated_confounds[i] is not None
+        ]
+        filtered_confounds = {}
+        if with_confounds:
+            filtered_confounds = dict(
+                zip(
+                    with_confounds,
+                    _detrend_and_filter(
+                        [interpolated_confounds[i] for i in with_confounds],
+                        t_r,
+                        low_pass=low_pass,
+                        high_pass=high_pass,
+                    ),
+                )
+            )
+
+        for i, sig in zip(run_indices, filtered_signals):
+            if i in filtered_confounds:
+                # Confounds are standardized with the population std, as in NiLearn
+                conf = filtered_confounds[i]
+                conf = _standardize_columns(conf - conf.mean(axis=0), ddof=0)
+
+                q, r, _ = linalg.qr(conf, mode="economic", pivoting=True)
+                q = q[:, np.abs(np.diag(r)) > np.finfo(np.float64).eps * 100.0]
+                sig = sig - q @ (q.T @ sig)
+
+            if standardize == "zscore_sample":
+                sig = _standardize_columns(sig - sig.mean(axis=0), ddof=1)
+            elif standardize in ["zscore", True]:
+                sig = _standardize_columns(sig - sig.mean(axis=0), ddof=0)
+            elif standardize:
+                raise ValueError(f"{standardize} is not a supported strategy.")
+            denoised_signals[i] = sig
+
+    return denoised_signals, interpolated_signals, interpolated_confounds
@@ -0,0 +1,860 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2023 The Axon Lab <theaxonlab@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Python module for memory-bounded extraction of regional timeseries.
+
+The region signals of a probabilistic atlas are the least-squares solution of
+``maps @ signals.T = data``. As this projection is linear, it can be applied to
+the BOLD series one chunk of volumes at a time with a precomputed operator,
+instead of materializing the full voxel x time array as NiLearn's maskers do.
+
+The maps can also be pruned of their low weights and stored as sparse matrices, as
+most of the weights of the DiFuMo components are close to zero.
+"""
+
+import logging
+import os
+import os.path as op
+import shutil
+from typing import Iterator, Optional, Union
+from uuid import uuid4
+
+import nibabel as nib
+import numpy as np
+from nibabel.openers import ImageOpener
+from nibabel.volumeutils import apply_read_scaling
+from joblib import Parallel, delayed
+from scipy import linalg, sparse
+
+from nilearn.image import resample_img
+from nilearn.signal import clean
+
+from caching import DEFAULT_CACHE_MAX_GB, evict_cache, get_cache_dir, hash_key
+from options import DEFAULT_MEM_GB
+
+OPERATOR_ARRAYS: tuple = ("voxel_mask", "maps", "gram_pinv")
+
+
+def get_projection_operator(
+    maps_img: nib.Nifti1Image,
+    target_affine: np.ndarray,
+    target_shape: tuple,
+    sparse_threshold: Optional[float] = None,
+    func_filename: Optional[str] = None,
+) -> tuple[np.ndarray, Union[np.ndarray, sparse.csr_matrix], np.ndarray]:
+    """Resample the atlas maps to the target grid and precompute the operator
+    projecting voxel signals onto the maps.
+
+    Parameters
+    ----------
+    maps_img : nib.Nifti1Image
+        4D image of the atlas maps
+    target_affine : np.ndarray
+        Affine of the functional images
+    target_shape : tuple
+        Spatial shape of the functional images
+    sparse_threshold : Optional[float], optional
+        Relative threshold pruning the maps (see get_sparse_operator), by default
+        None (dense maps)
+    func_filename : Optional[str], optional
+        Functional image on the target grid, whose first chunk of volumes measures
+        the error of the sparse region signals, by default None (only the error of
+        the operator is reported)
+
+    Returns
+    -------
+    tuple[np.ndarray, Union[np.ndarray, sparse.csr_matrix], np.ndarray]
+        The 3D boolean mask of the voxels covered by at least one map, the maps
+        restricted to those voxels (voxels x regions) and the pseudo-inverse of
+        their Gram matrix (regions x regions).
+    """
+    target_shape = tuple(target_shape[:3])
+    if not (
+        maps_img.shape[:3] == target_shape
+        and np.allclose(maps_img.affine, target_affine)
+    ):
+        logging.debug("Resampling atlas maps to the functional grid ...")
+        maps_img = resample_img(
+            maps_img,
+            interpolation="continuous",
+            target_shape=target_shape,
+            target_affine=target_affine,
+        )
+
+    maps_data = np.asarray(maps_img.dataobj, dtype=np.float64)
+    maps_data[~np.isfinite(maps_data)] = 0
+
+    # Voxels outside every map do not weigh on the least-squares solution
+    voxel_mask = np.any(maps_data != 0, axis=-1)
+    maps = maps_data[voxel_mask]
+    gram_pinv = linalg.pinvh(maps.T @ maps)
+
+    if sparse_threshold is None:
+        return voxel_mask, maps, gram_pinv
+
+    dense_operator = (voxel_mask, maps, gram_pinv)
+    sparse_operator = get_sparse_operator(maps_data, sparse_threshold)
+    error = get_sparse_projection_error(dense_operator, sparse_operator)
+    logging.info(
+        f"The sparse atlas maps keep {sparse_operator[1].nnz / maps.size:.1%} of the "
+        f"weights, with a relative error of the projection operator of {error:.2e}."
+    )
+    if func_filename is not None:
+        signal_error = get_sparse_signal_error(
+            func_filename, dense_operator, sparse_operator
+        )
+        logging.info(
+            f"Relative error of the sparse region signals of the first volumes of "
+            f"{func_filename}: {signal_error:.2e}."
+        )
+    return sparse_operator
+
+
+def get_sparse_operator(
+    maps_data: np.ndarray, sparse_threshold: float
+) -> tuple[np.ndarray, sparse.csr_matrix, np.ndarray]:
+    """Prune the low weights of each map and return the sparse projection operator.
+
+    Parameters
+    ----------
+    maps_data : np.ndarray
+        4D array of the atlas maps on the functional grid (modified in place)
+    sparse_threshold : float
+        Weights lower (in absolute value) than this fraction of the peak of their
+        map are set to zero
+
+    Returns
+    -------
+    tuple[np.ndarray, sparse.csr_matrix, np.ndarray]
+        The voxel mask of the pruned maps, the pruned maps restricted to it as a
+        sparse matrix and the pseudo-inverse of their Gram matrix (see
+        get_projection_operator).
+    """
+    peaks = np.abs(maps_data).max(axis=(0, 1, 2))
+    maps_data[np.abs(maps_data) < sparse_threshold * peaks] = 0
+
+    voxel_mask = np.any(maps_data != 0, axis=-1)
+    maps = sparse.csr_matrix(maps_data[voxel_mask])
+    gram_pinv = linalg.pinvh((maps.T @ maps).toarray())
+
+    return voxel_mask, maps, gram_pinv
+
+
+def get_sparse_projection_error(
+    dense_operator: tuple[np.ndarray, np.ndarray, np.ndarray],
+    sparse_operator: tuple[np.ndarray, sparse.csr_matrix, np.ndarray],
+) -> float:
+    """Return the relative error (Frobenius norm) of the sparse projection operator.
+
+    The region signals are the product of the voxel signals with the operator
+    ``maps @ gram_pinv``. The error of the operator bounds the absolute error of the
+    region signals (relative to the norm of the voxel signals), not their relative
+    error, which get_sparse_signal_error measures on actual data.
+
+    Parameters
+    ----------
+    dense_operator : tuple[np.ndarray, np.ndarray, np.ndarray]
+        Projection operator of the full maps (see get_projection_operator)
+    sparse_operator : tuple[np.ndarray, sparse.csr_matrix, np.ndarray]
+        Projection operator of the pruned maps (see get_sparse_operator)
+
+    Returns
+    -------
+    float
+        Relative error of the sparse projection operator.
+    """
+    dense_mask, dense_maps, dense_gram_pinv = dense_operator
+    sparse_mask, sparse_maps, sparse_gram_pinv = sparse_operator
+
+    dense_projector = dense_maps @ dense_gram_pinv
+    # Pruning only removes voxels from the support of the maps
+    sparse_projector = np.zeros_like(dense_projector)
+    sparse_projector[sparse_mask[dense_mask]] = sparse_maps @ sparse_gram_pinv
+
+    return float(
+        linalg.norm(sparse_projector - dense_projector) / linalg.norm(dense_projector)
+    )
+
+
+def get_operator_nbytes(
+    operator: tuple[np.ndarray, Union[np.ndarray, sparse.csr_matrix], np.ndarray],
+) -> int:
+    """Return the size in bytes of a projection operator.
+
+    Parameters
+    ----------
+    operator : tuple[np.ndarray, Union[np.ndarray, sparse.csr_matrix], np.ndarray]
+        Projection operator (see get_projection_operator)
+
+    Returns
+    -------
+    int
+        Number of bytes of its (possibly memory-mapped or sparse) arrays.
+    """
+    nbytes = 0
+    for array in operator:
+        if sparse.issparse(array):
+            nbytes += array.data.nbytes + array.indices.nbytes + array.indptr.nbytes
+        else:
+            nbytes += array.nbytes
+    return nbytes
+
+
+def _load_operator_array(entry: str, name: str) -> Union[np.ndarray, sparse.csr_matrix]:
+    if op.exists(op.join(entry, f"{name}.npz")):
+        return sparse.load_npz(op.join(entry, f"{name}.npz"))
+    return np.load(op.join(entry, f"{name}.npy"), mmap_mode="r")
+
+
+def get_sparse_signal_error(
+    func_filename: str,
+    dense_operator: tuple[np.ndarray, np.ndarray, np.ndarray],
+    sparse_operator: tuple[np.ndarray, sparse.csr_matrix, np.ndarray],
+    mem_gb: float = DEFAULT_MEM_GB,
+) -> float:
+    """Return the relative error (Frobenius norm) of the region signals of the first
+    chunk of volumes of a functional image projected with the sparse operator.
+
+    Parameters
+    ----------
+    func_filename : str
+        Path to the 4D functional image, on the grid of the operators
+    dense_operator : tuple[np.ndarray, np.ndarray, np.ndarray]
+        Projection operator of the full maps (see get_projection_operator)
+    sparse_operator : tuple[np.ndarray, sparse.csr_matrix, np.ndarray]
+        Projection operator of the pruned maps (see get_sparse_operator)
+    mem_gb : float, optional
+        Memory ceiling in GB bounding the size of the chunk, by default
+        DEFAULT_MEM_GB
+
+    Returns
+    -------
+    float
+        Relative error of the sparse region signals of the first chunk.
+    """
+    voxel_mask, dense_maps, dense_gram_pinv = dense_operator
+    sparse_mask, sparse_maps, sparse_gram_pinv = sparse_operator
+    img = nib.load(func_filename)
+    chunk_length = get_chunk_length(
+        voxel_mask.size,
+        int(voxel_mask.sum()),
+        dense_maps.shape[1],
+        mem_gb=mem_gb,
+        itemsize=_get_read_itemsize(img),
+    )
+    chunks = iter_volume_chunks(img, chunk_length, voxel_mask=voxel_mask)
+    _, _, chunk = next(chunks)
+    chunks.close()
+
+    chunk = np.array(chunk, dtype=np.float64)
+    chunk[~np.isfinite(chunk)] = 0
+    dense_signals = (dense_maps.T @ chunk).T @ dense_gram_pinv
+    # Pruning only removes voxels from the support of the maps
+    sparse_chunk = chunk[sparse_mask[voxel_mask]]
+    sparse_signals = (sparse_maps.T @ sparse_chunk).T @ sparse_gram_pinv
+    return float(
+        np.linalg.norm(sparse_signals - dense_signals) / np.linalg.norm(dense_signals)
+    )
+
+
+def load_projection_operator(
+    maps_img: nib.Nifti1Image,
+    target_affine: np.ndarray,
+    target_shape: tuple,
+    atlas_name: str,
+    cache_dir: Optional[str] = None,
+    cache_max_gb: float = DEFAULT_CACHE_MAX_GB,
+    sparse_threshold: Optional[float] = None,
+    func_filename: Optional[str] = None,
+) -> tuple[np.ndarray, Union[np.ndarray, sparse.csr_matrix], np.ndarray]:
+    """Return the projection operator of the atlas on the target grid, reading it
+    from the on-disk cache when it was already computed.
+
+    The cache entries are keyed on the atlas name, the number of maps, the target
+    grid and the pruning threshold, and the dense arrays are memory-mapped when read
+    back.
+
+    Parameters
+    ----------
+    maps_img : nib.Nifti1Image
+        4D image of the atlas maps
+    target_affine : np.ndarray
+        Affine of the functional images
+    target_shape : tuple
+        Spatial shape of the functional images
+    atlas_name : str
+        Name identifying the atlas maps (e.g. "DiFuMo")
+    cache_dir : Optional[str], optional
+        Root of the cache, by default None (see caching.get_cache_dir)
+    cache_max_gb : float, optional
+        Size above which the least recently used operators are evicted,
+        by default DEFAULT_CACHE_MAX_GB
+    sparse_threshold : Optional[float], optional
+        Relative threshold pruning the maps (see get_sparse_operator), by default
+        None (dense maps)
+    func_filename : Optional[str], optional
+        Functional image measuring the error of the sparse region signals when the
+        operator is computed (see get_projection_operator), by default None
+
+    Returns
+    -------
+    tuple[np.ndarray, Union[np.ndarray, sparse.csr_matrix], np.ndarray]
+        The voxel mask, the maps restricted to it and the pseudo-inverse of their
+        Gram matrix (see get_projection_operator).
+    """
+    operator_dir = get_cache_dir(cache_dir, "operators")
+    key = hash_key(
+        atlas_name,
+        maps_img.shape[-1],
+        np.round(np.asarray(target_affine, dtype=float), 6).tolist(),
+        tuple(int(dim) for dim in target_shape[:3]),
+        sparse_threshold,
+    )
+    entry = op.join(operator_dir, key)
+
+    if op.isdir(entry):
+        logging.debug(f"Loading cached projection operator from {entry}")
+        try:
+            operator = tuple(
+                _load_operator_array(entry, name) for name in OPERATOR_ARRAYS
+            )
+            os.utime(entry)
+            return operator
+        except (OSError, ValueError):
+            logging.warning(f"Corrupted cache entry {entry}, recomputing it.")
+            shutil.rmtree(entry, ignore_errors=True)
+
+    operator = get_projection_operator(
+        maps_img,
+        target_affine,
+        target_shape,
+        sparse_threshold=sparse_threshold,
+        func_filename=func_filename,
+    )
+
+    # Write to a temporary folder first so that concurrent jobs never read a
+    # partially written entry
+    tmp_entry = op.join(operator_dir, f".tmp-{uuid4()}")
+    os.makedirs(tmp_entry)
+    for name, array in zip(OPERATOR_ARRAYS, operator):
+        if sparse.issparse(array):
+            sparse.save_npz(op.join(tmp_entry, f"{name}.npz"), array)
+        else:
+            np.save(op.join(tmp_entry, f"{name}.npy"), array)
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    evict_cache(operator_dir, max_gb=cache_max_gb)
+    return operator
+
+
+def get_resampled_maps_img(
+    atlas_filename: str,
+    func_filename: str,
+    atlas_name: str,
+    cache_dir: Optional[str] = None,
+    cache_max_gb: float = DEFAULT_CACHE_MAX_GB,
+) -> nib.Nifti1Image:
+    """Return the atlas maps resampled to the grid of a functional image, from the
+    cache of projection operators.
+
+    Parameters
+    ----------
+    atlas_filename : str
+        Path to the atlas file
+    func_filename : str
+        Path to the functional image defining the target grid
+    atlas_name : str
+        Name identifying the atlas maps (e.g. "DiFuMo")
+    cache_dir : Optional[str], optional
+        Root of the cache, by default None (see caching.get_cache_dir)
+    cache_max_gb : float, optional
+        Maximum size of the cache of operators, by default DEFAULT_CACHE_MAX_GB
+
+    Returns
+    -------
+    nib.Nifti1Image
+        4D image of the resampled atlas maps.
+    """
+    header_img = nib.load(func_filename)
+    voxel_mask, maps, _ = load_projection_operator(
+        nib.load(atlas_filename),
+        header_img.affine,
+        header_img.shape[:3],
+        atlas_name,
+        cache_dir=cache_dir,
+        cache_max_gb=cache_max_gb,
+    )
+
+    maps_data = np.zeros(voxel_mask.shape + (maps.shape[1],), dtype=np.float32)
+    maps_data[voxel_mask] = maps
+    return nib.Nifti1Image(maps_data, header_img.affine)
+
+
+def get_chunk_length(
+    n_voxels: int,
+    n_support: int,
+    n_regions: int,
+    mem_gb: float = DEFAULT_MEM_GB,
+    itemsize: int = 8,
+) -> int:
+    """Return the number of volumes that can be projected at once without exceeding
+    the memory ceiling.
+
+    Parameters
+    ----------
+    n_voxels : int
+        Number of voxels in one functional volume
+    n_support : int
+        Number of voxels covered by the atlas maps
+    n_regions : int
+        Number of atlas regions
+    mem_gb : float, optional
+        Memory ceiling in GB, by default DEFAULT_MEM_GB
+    itemsize : int, optional
+        Number of bytes per voxel of the volumes as read from disk (see
+        iter_volume_chunks), by default 8
+
+    Returns
+    -------
+    int
+        Number of volumes per chunk (at least one).
+    """
+    operator_bytes = 8 * (n_support * n_regions + n_regions**2)
+    # Each volume is read in full, restricted to the support of the maps, then
+    # scaled, converted to float64 and copied for the atlases not covering the
+    # whole support
+    volume_bytes = itemsize * (n_voxels + n_support) + 24 * n_support + 8 * n_regions
+    available = mem_gb * 1024**3 - operator_bytes
+
+    if available < volume_bytes:
+        logging.warning(
+            f"The memory ceiling of {mem_gb} GB is too low to hold the atlas "
+            "operator and one volume: projecting one volume at a time."
+        )
+        return 1
+
+    return int(available // volume_bytes)
+
+
+def project_timeseries(
+    func_filename: str,
+    voxel_mask: np.ndarray,
+    maps: np.ndarray,
+    gram_pinv: np.ndarray,
+    mem_gb: float = DEFAULT_MEM_GB,
+) -> np.ndarray:
+    """Project a 4D functional image onto the atlas maps, one chunk of volumes at a
+    time.
+
+    Parameters
+    ----------
+    func_filename : str
+        Path to the 4D functional image
+    voxel_mask : np.ndarray
+        3D boolean mask of the voxels covered by the atlas maps
+    maps : np.ndarray
+        Atlas maps restricted to the voxel mask (voxels x regions)
+    gram_pinv : np.ndarray
+        Pseudo-inverse of the Gram matrix of the maps (regions x regions)
+    mem_gb : float, optional
+        Memory ceiling in GB, by default DEFAULT_MEM_GB
+
+    Returns
+    -------
+    np.ndarray
+        Raw (not denoised) region signals (time x regions).
+    """
+    return project_timeseries_atlases(
+        func_filename, [(voxel_mask, maps, gram_pinv)], mem_gb=mem_gb
+    )[0]
+
+
+def _reads_sequentially(img: nib.Nifti1Image) -> bool:
+    proxy = img.dataobj
+    return (
+        nib.is_proxy(proxy)
+        and getattr(proxy, "order", None) == "F"
+        and img.get_filename() is not None
+    )
+
+
+def _get_read_itemsize(img: nib.Nifti1Image) -> int:
+    # Slicing the data object returns the scaled data, at most in float64
+    return img.dataobj.dtype.itemsize if _reads_sequentially(img) else 8
+
+
+def iter_volume_chunks(
+    img: nib.Nifti1Image,
+    chunk_length: int,
+    voxel_mask: Optional[np.ndarray] = None,
+) -> Iterator[tuple[int, int, np.ndarray]]:
+    """Read a 4D image one chunk of consecutive volumes at a time.
+
+    The volumes of an uncompressed or gzipped NIfTI file are contiguous on disk, so
+    the chunks are read in order from a single open stream. Slicing the data object
+    instead would reopen a gzipped file and decompress it again from its start for
+    every chunk.
+
+    Parameters
+    ----------
+    img : nib.Nifti1Image
+        4D image loaded from disk
+    chunk_length : int
+        Number of volumes per chunk
+    voxel_mask : Optional[np.ndarray], optional
+        3D boolean mask of the voxels to keep, applied before scaling the data,
+        by default None (all the voxels)
+
+    Yields
+    ------
+    tuple[int, int, np.ndarray]
+        Index of the first volume of the chunk, index after its last volume and the
+        (scaled) data of the chunk (x, y, z, volumes), or (voxels, volumes) with a
+        voxel mask.
+    """
+    n_timepoints = img.shape[3] if len(img.shape) > 3 else 1
+    proxy = img.dataobj
+    if not _reads_sequentially(img):
+        for start in range(0, n_timepoints, chunk_length):
+            stop = min(start + chunk_length, n_timepoints)
+            data = proxy[..., start:stop] if len(img.shape) > 3 else proxy[...]
+            data = np.asarray(data).reshape(img.shape[:3] + (-1,))
+            yield start, stop, data if voxel_mask is None else data[voxel_mask]
+        return
+
+    volume_shape = img.shape[:3]
+    volume_size = int(np.prod(volume_shape))
+    with ImageOpener(img.get_filename(), "rb") as fobj:
+        fobj.seek(proxy.offset)
+        for start in range(0, n_timepoints, chunk_length):
+            stop = min(start + chunk_length, n_timepoints)
+            n_values = (stop - start) * volume_size
+            buffer = fobj.read(n_values * proxy.dtype.itemsize)
+            chunk = np.frombuffer(buffer, dtype=proxy.dtype, count=n_values)
+            chunk = chunk.reshape(volume_shape + (stop - start,), order="F")
+            if voxel_mask is not None:
+                chunk = chunk[voxel_mask]
+            yield start, stop, apply_read_scaling(chunk, proxy.slope, proxy.inter)
+            # Release the chunk before reading the next one
+            del buffer, chunk
+
+
+def project_timeseries_atlases(
+    func_filename: str,
+    operators: list[tuple[np.ndarray, np.ndarray, np.ndarray]],
+    mem_gb: float = DEFAULT_MEM_GB,
+) -> list[np.ndarray]:
+    """Project a 4D functional image onto several atlases in a single pass, one
+    chunk of volumes at a time.
+
+    Each chunk is read once and restricted to the voxels covered by any atlas
+    before being converted to float64, then projected with the operator of every
+    atlas.
+
+    Parameters
+    ----------
+    func_filename : str
+        Path to the 4D functional image
+    operators : list[tuple[np.ndarray, np.ndarray, np.ndarray]]
+        Projection operator of each atlas on the grid of the image (see
+        get_projection_operator)
+    mem_gb : float, optional
+        Memory ceiling in GB, by default DEFAULT_MEM_GB
+
+    Returns
+    -------
+    list[np.ndarray]
+        Raw (not denoised) region signals (time x regions) of each atlas.
+    """
+    img = nib.load(func_filename, mmap=True)
+    n_timepoints = img.shape[3] if len(img.shape) > 3 else 1
+
+    union_mask = np.logical_or.reduce([voxel_mask for voxel_mask, _, _ in operators])
+    # Position of the voxels of each atlas among the voxels covered by any atlas
+    support_indices = [
+        np.flatnonzero(voxel_mask[union_mask]) for voxel_mask, _, _ in operators
+    ]
+    n_regions = [maps.shape[1] for _, maps, _ in operators]
+    chunk_length = get_chunk_length(
+        union_mask.size,
+        int(union_mask.sum()),
+        sum(n_regions),
+        mem_gb=mem_gb,
+        itemsize=_get_read_itemsize(img),
+    )
+    logging.debug(
+        f"Projecting {func_filename} onto {len(operators)} atlas(es) in chunks of "
+        f"{chunk_length} volumes ..."
+    )
+
+    region_signals = [np.empty((n_timepoints, n)) for n in n_regions]
+    chunks = iter_volume_chunks(img, chunk_length, voxel_mask=union_mask)
+    for start, stop, chunk in chunks:
+        chunk = np.asarray(chunk, dtype=np.float64)
+        chunk[~np.isfinite(chunk)] = 0
+
+        for signals, indices, (_, maps, gram_pinv) in zip(
+            region_signals, support_indices, operators
+        ):
+            atlas_chunk = chunk if indices.size == chunk.shape[0] else chunk[indices]
+            # Written as maps.T @ chunk for sparse maps to compute a sparse product
+            signals[start:stop] = (maps.T @ atlas_chunk).T @ gram_pinv
+
+    return region_signals
+
+
+def get_file_operators(
+    func_filename: list[str],
+    atlas_filename: str,
+    atlas_name: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    cache_max_gb: float = DEFAULT_CACHE_MAX_GB,
+    sparse_threshold: Optional[float] = None,
+) -> list[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Return the projection operator of the atlas on the grid of each functional
+    image (files sharing a grid share the operator).
+
+    Parameters
+    ----------
+    func_filename : list[str]
+        List of BIDS functional filenames
+    atlas_filename : str
+        Path to the atlas file
+    atlas_name : Optional[str], optional
+        Name identifying the atlas maps. If provided, the projection operators are
+        read from and written to the on-disk cache, by default None
+    cache_dir : Optional[str], optional
+        Root of the cache, by default None (see caching.get_cache_dir)
+    cache_max_gb : float, optional
+        Maximum size of the cache of operators, by default DEFAULT_CACHE_MAX_GB
+    sparse_threshold : Optional[float], optional
+        Relative threshold pruning the maps into sparse matrices (see
+        get_sparse_operator), by default None (dense maps)
+
+    Returns
+    -------
+    list[tuple[np.ndarray, np.ndarray, np.ndarray]]
+        Projection operator of each file (see get_projection_operator).
+    """
+    maps_img = nib.load(atlas_filename)
+
+    operators = {}
+    file_operators = []
+    for filename in func_filename:
+        header_img = nib.load(filename)
+        grid_key = (header_img.affine.tobytes(), header_img.shape[:3])
+        if grid_key not in operators and atlas_name is not None:
+            operators[grid_key] = load_projection_operator(
+                maps_img,
+                header_img.affine,
+                header_img.shape[:3],
+                atlas_name,
+                cache_dir=cache_dir,
+                cache_max_gb=cache_max_gb,
+                sparse_threshold=sparse_threshold,
+                func_filename=filename,
+            )
+        elif grid_key not in operators:
+            operators[grid_key] = get_projection_operator(
+                maps_img,
+                header_img.affine,
+                header_img.shape[:3],
+                sparse_threshold=sparse_threshold,
+                func_filename=filename,
+            )
+        file_operators.append(operators[grid_key])
+
+    return file_operators
+
+
+def _transform_single_chunked(
+    func_filename: str,
+    operator: tuple[np.ndarray, np.ndarray, np.ndarray],
+    confounds=None,
+    sample_mask=None,
+    mem_gb: float = DEFAULT_MEM_GB,
+    **kwargs,
+) -> np.ndarray:
+    region_signals = project_timeseries(func_filename, *operator, mem_gb=mem_gb)
+    return clean(region_signals, confounds=confounds, sample_mask=sample_mask, **kwargs)
+
+
+def fit_transform_chunked(
+    func_filename: list[str],
+    atlas_filename: str,
+    confounds: Optional[list] = None,
+    sample_mask: Optional[list] = None,
+    mem_gb: float = DEFAULT_MEM_GB,
+    atlas_name: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    cache_max_gb: float = DEFAULT_CACHE_MAX_GB,
+    sparse_threshold: Optional[float] = None,
+    standardize=False,
+    standardize_confounds: bool = True,
+    detrend: bool = False,
+    low_pass: Optional[float] = None,
+    high_pass: Optional[float] = None,
+    t_r: Optional[float] = None,
+    n_jobs: int = 1,
+    verbose: int = 0,
+) -> list[np.ndarray]:
+    """Extract and denoise the regional timeseries of a list of functional images
+    under a memory ceiling.
+
+    The denoising parameters have the same meaning and defaults as in NiLearn's
+    MultiNiftiMapsMasker, so that both engines produce the same region signals.
+
+    Parameters
+    ----------
+    func_filename : list[str]
+        List of BIDS functional filenames
+    atlas_filename : str
+        Path to the atlas file
+    confounds : Optional[list], optional
+        List of confounds (usually from nilearn.interface.fmriprep.load_confounds),
+        by default None
+    sample_mask : Optional[list], optional
+        List of sample masks (usually from nilearn.interface.fmriprep.load_confounds),
+        by default None
+    mem_gb : float, optional
+        Memory ceiling of each worker in GB, by default DEFAULT_MEM_GB
+    atlas_name : Optional[str], optional
+        Name identifying the atlas maps. If provided, the projection operators are
+        read from and written to the on-disk cache, by default None
+    cache_dir : Optional[str], optional
+        Root of the cache, by default None (see caching.get_cache_dir)
+    cache_max_gb : float, optional
+        Maximum size of the cache of operators, by default DEFAULT_CACHE_MAX_GB
+    sparse_threshold : Optional[float], optional
+        Relative threshold pruning the maps into sparse matrices (see
+        get_sparse_operator), by default None (dense maps)
+    n_jobs : int, optional
+        Number of parallel workers, by default 1
+    verbose : int, optional
+        Amount of verbosity of joblib, by default 0
+
+    Returns
+    -------
+    list[np.ndarray]
+        List of extracted and denoised timeseries
+    """
+    if confounds is None:
+        confounds = [None] * len(func_filename)
+    if sample_mask is None:
+        sample_mask = [None] * len(func_filename)
+
+    file_operators = get_file_operators(
+        func_filename,
+        atlas_filename,
+        atlas_name=atlas_name,
+        cache_dir=cache_dir,
+        cache_max_gb=cache_max_gb,
+        sparse_threshold=sparse_threshold,
+    )
+
+    return Parallel(n_jobs=n_jobs, verbose=verbose)(
+        delayed(_transform_single_chunked)(
+            filename,
+            operator,
+            confounds=conf,
+            sample_mask=sm,
+            mem_gb=mem_gb,
+            standardize=standardize,
+            standardize_confounds=standardize_confounds,
+            detrend=detrend,
+            low_pass=low_pass,
+            high_pass=high_pass,
+            t_r=t_r,
+        )
+        for filename, operator, conf, sm in zip(
+            func_filename, file_operators, confounds, sample_mask
+        )
+    )
+
+
+def fit_transform_atlases(
+    func_filename: list[str],
+    atlas_filenames: list[str],
+    atlas_names: Optional[list[str]] = None,
+    mem_gb: float = DEFAULT_MEM_GB,
+    cache_dir: Optional[str] = None,
+    cache_max_gb: float = DEFAULT_CACHE_MAX_GB,
+    sparse_threshold: Optional[float] = None,
+    n_jobs: int = 1,
+    verbose: int = 0,
+) -> list[list[np.ndarray]]:
+    """Extract the raw regional timeseries of several atlases, reading each
+    functional image once (see project_timeseries_atlases).
+
+    Parameters
+    ----------
+    func_filename : list[str]
+        List of BIDS functional filenames
+    atlas_filenames : list[str]
+        Paths to the atlas files
+    atlas_names : Optional[list[str]], optional
+        Names identifying the atlas maps, to cache their projection operators,
+        by default None (not cached)
+    mem_gb : float, optional
+        Memory ceiling of each worker in GB, by default DEFAULT_MEM_GB
+    cache_dir : Optional[str], optional
+        Root of the cache, by default None (see caching.get_cache_dir)
+    cache_max_gb : float, optional
+        Maximum size of the cache of operators, by default DEFAULT_CACHE_MAX_GB
+    sparse_threshold : Optional[float], optional
+        Relative threshold pruning the maps into sparse matrices (see
+        get_sparse_operator), by default None (dense maps)
+    n_jobs : int, optional
+        Number of parallel workers, by default 1
+    verbose : int, optional
+        Amount of verbosity of joblib, by default 0
+
+    Returns
+    -------
+    list[list[np.ndarray]]
+        For each atlas, the list of raw (not denoised) timeseries of the files.
+    """
+    if not len(func_filename):
+        return [[] for _ in atlas_filenames]
+    if atlas_names is None:
+        atlas_names = [None] * len(atlas_filenames)
+
+    atlas_operators = [
+        get_file_operators(
+            func_filename,
+            atlas_filename,
+            atlas_name=atlas_name,
+            cache_dir=cache_dir,
+            cache_max_gb=cache_max_gb,
+            sparse_threshold=sparse_threshold,
+        )
+        for atlas_filename, atlas_name in zip(atlas_filenames, atlas_names)
+    ]
+
+    file_signals = Parallel(n_jobs=n_jobs, verbose=verbose)(
+        delayed(project_timeseries_atlases)(filename, list(operators), mem_gb=mem_gb)
+        for filename, operators in zip(func_filename, zip(*atlas_operators))
+    )
+    return [list(signals) for signals in zip(*file_signals)]
@@ -0,0 +1,203 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2023 The Axon Lab <theaxonlab@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Python module for the vectorized density estimation of FC distributions.
+
+The upper triangles of all the functional connectivity matrices are stacked (one row
+per session) and binned on a common grid with np.bincount, one batch of sessions at
+a time. The kernel density estimates are then obtained by convolving the histograms
+with a Gaussian kernel, whose width follows Scott's rule for each session, as a
+product in the Fourier domain.
+"""
+
+from typing import Iterator, Optional
+
+import numpy as np
+
+# Number of bins of the grid of the densities
+N_BINS: int = 512
+DEFAULT_MEM_GB: float = 0.5
+
+
+def get_upper_triangles(
+    fc_matrices: list[np.ndarray], dtype: type = np.float64
+) -> np.ndarray:
+    """Stack the upper triangles (without the diagonal) of square matrices.
+
+    Parameters
+    ----------
+    fc_matrices : list[np.ndarray]
+        List of functional connectivity matrices
+    dtype : type, optional
+        Type of the stacked edges, by default np.float64
+
+    Returns
+    -------
+    np.ndarray
+        Edges of each matrix (matrices x edges), in the order of the upper triangle
+        indices (np.triu_indices(n_regions, k=1)).
+    """
+    upper_triangle_indices = np.triu_indices(np.shape(fc_matrices[0])[0], k=1)
+    edges = np.empty((len(fc_matrices), len(upper_triangle_indices[0])), dtype=dtype)
+    for i, fc_matrix in enumerate(fc_matrices):
+        edges[i] = np.asarray(fc_matrix)[upper_triangle_indices]
+    return edges
+
+
+def _batches(n_rows: int, n_columns: int, mem_gb: float) -> Iterator[slice]:
+    # The temporaries of a batch take about 16 bytes per element
+    batch_size = max(1, int(mem_gb * 1024**3 // (16 * max(1, n_columns))))
+    for start in range(0, n_rows, batch_size):
+        yield slice(start, min(start + batch_size, n_rows))
+
+
+def scott_bandwidth(edges: np.ndarray, mem_gb: float = DEFAULT_MEM_GB) -> np.ndarray:
+    """Return the bandwidth of the Gaussian kernel of each row following Scott's rule
+    (as scipy.stats.gaussian_kde), ignoring the non-finite values."""
+    bandwidths = np.zeros(len(edges))
+    for rows in _batches(*edges.shape, mem_gb):
+        block = np.where(np.isfinite(edges[rows]), edges[rows], np.nan)
+        n_values = np.sum(~np.isnan(block), axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            bandwidths[rows] = np.nanstd(block, axis=1, ddof=1) * n_values ** (-1 / 5)
+    # Rows with less than two values are not smoothed
+    return np.nan_to_num(bandwidths, nan=0.0, posinf=0.0)
+
+
+def get_bin_edges(
+    edges: np.ndarray,
+    bandwidths: Optional[np.ndarray] = None,
+    n_bins: int = N_BINS,
+) -> np.ndarray:
+    """Return a grid of bins covering all the values, padded by three times the
+    largest bandwidth so that the tails of the densities are not cut."""
+    finite = edges[np.isfinite(edges)]
+    if not finite.size:
+        raise ValueError("The functional connectivity matrices have no finite edges.")
+
+    pad = 0.0 if bandwidths is None else 3 * np.max(bandwidths, initial=0.0)
+    low, high = float(finite.min()) - pad, float(finite.max()) + pad
+    if high <= low:
+        low, high = low - 0.5, high + 0.5
+    return np.linspace(low, high, n_bins + 1)
+
+
+def histogram_rows(
+    edges: np.ndarray,
+    bin_edges: np.ndarray,
+    mem_gb: float = DEFAULT_MEM_GB,
+) -> np.ndarray:
+    """Histogram each row on regularly spaced bins.
+
+    Parameters
+    ----------
+    edges : np.ndarray
+        Values of each row (rows x values)
+    bin_edges : np.ndarray
+        Regularly spaced edges of the bins
+    mem_gb : float, optional
+        Memory ceiling (in GB) of the temporaries of a batch of rows, by default
+        DEFAULT_MEM_GB
+
+    Returns
+    -------
+    np.ndarray
+        Number of values of each row in each bin (rows x bins). The non-finite values
+        and the values outside the bins are not counted.
+    """
+    n_bins = len(bin_edges) - 1
+    width = (bin_edges[-1] - bin_edges[0]) / n_bins
+    counts = np.zeros((len(edges), n_bins))
+    for rows in _batches(*edges.shape, mem_gb):
+        block = edges[rows]
+        indices = np.floor((block - bin_edges[0]) / width)
+        indices[block == bin_edges[-1]] = n_bins - 1
+        # The values that do not fall into a bin are sent to an extra bin per row
+        indices[~((indices >= 0) & (indices < n_bins))] = n_bins
+        indices = indices.astype(np.intp)
+        indices += (n_bins + 1) * np.arange(len(block))[:, np.newaxis]
+        block_counts = np.bincount(indices.ravel(), minlength=len(block) * (n_bins + 1))
+        counts[rows] = block_counts.reshape(len(block), n_bins + 1)[:, :n_bins]
+    return counts
+
+
+def smooth_histograms(
+    counts: np.ndarray, bin_width: float, bandwidths: np.ndarray
+) -> np.ndarray:
+    """Convolve each histogram with a Gaussian kernel of its own bandwidth.
+
+    The histograms are zero-padded to twice their length, so that the circular
+    convolution computed with the FFT does not wrap the tails around the grid.
+    """
+    n_bins = counts.shape[-1]
+    n_fft = 2 * n_bins
+    frequencies = np.fft.rfftfreq(n_fft, d=bin_width)
+    # Fourier transform of the Gaussian kernels (one per row)
+    transfer = np.exp(
+        -2 * (np.pi * np.asarray(bandwidths)[:, np.newaxis] * frequencies) ** 2
+    )
+    smoothed = np.fft.irfft(
+        np.fft.rfft(counts, n=n_fft, axis=-1) * transfer, n=n_fft, axis=-1
+    )[:, :n_bins]
+    # Remove the round-off errors of the FFT
+    return np.clip(smoothed, 0, None)
+
+
+def get_fc_densities(
+    edges: np.ndarray,
+    kde: bool = True,
+    n_bins: int = N_BINS,
+    mem_gb: float = DEFAULT_MEM_GB,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Estimate the density of the edges of each session on a common grid.
+
+    Parameters
+    ----------
+    edges : np.ndarray
+        Edges of each session (sessions x edges), see get_upper_triangles
+    kde : bool, optional
+        Whether to compute kernel density estimates (Gaussian kernels, Scott's rule)
+        rather than normalized histograms, by default True
+    n_bins : int, optional
+        Number of bins of the grid, by default N_BINS
+    mem_gb : float, optional
+        Memory ceiling (in GB) of the temporaries of a batch of sessions, by default
+        DEFAULT_MEM_GB
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Centers of the bins, and density of each session at the centers (sessions x
+        bins).
+    """
+    bandwidths = scott_bandwidth(edges, mem_gb=mem_gb) if kde else None
+    bin_edges = get_bin_edges(edges, bandwidths, n_bins=n_bins)
+    bin_width = bin_edges[1] - bin_edges[0]
+
+    counts = histogram_rows(edges, bin_edges, mem_gb=mem_gb)
+    n_values = counts.sum(axis=1, keepdims=True)
+    if kde:
+        counts = smooth_histograms(counts, bin_width, bandwidths)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        densities = counts / (n_values * bin_width)
+    return (bin_edges[1:] + bin_edges[:-1]) / 2, densities
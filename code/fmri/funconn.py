@@ -32,40 +32,69 @@ In the context of HCPh (pilot), it would be:
     python funconn.py /data/datasets/hcph-pilot/derivatives/fmriprep-23.1.4/
 """
 
+from __future__ import annotations
+
 import argparse
 import csv
+import json
 import logging
 import os
 import os.path as op
 from itertools import chain
-from typing import Optional, Union
+from typing import TYPE_CHECKING, Iterator, Optional, Union
 
+import nibabel as nib
 import numpy as np
-from nilearn_patcher import MultiNiftiMapsMasker as MultiNiftiMapsMasker_patched
-from sklearn.covariance import GraphicalLassoCV, LedoitWolf
+import pandas as pd
+from joblib import Parallel, delayed
+
+# nilearn, scikit-learn and the plotting libraries are imported where they are used,
+# so that the command line is parsed (and --dry-run planned) without them
+if TYPE_CHECKING:
+    from sklearn.covariance import GraphicalLassoCV, LedoitWolf
 
-from nilearn._utils import stringify_path
-from nilearn.connectome import ConnectivityMeasure, vec_to_sym_matrix
-from nilearn.interfaces.fmriprep import load_confounds
-from nilearn.maskers import MultiNiftiMapsMasker
-from nilearn.signal import _handle_scrubbed_volumes, _sanitize_confounds, clean
+    from covariance import SharedGraphicalLassoCV
 
-from reports import plot_interpolation, visual_report_timeserie, visual_report_fc
+from bids_index import scan_headers
+from caching import DEFAULT_CACHE_MAX_GB, evict_cache, get_cache_dir, hash_key
+from options import DEFAULT_MEM_GB, REPORT_MODES, SPARSE_MODES
 from load_save import (
+    get_bids_savename,
     find_derivative,
     check_existing_output,
+    index_output,
     get_atlas_data,
     get_confounds_manually,
+    get_confounds_cache_filename,
+    read_cached_confounds,
+    write_cached_confounds,
+    get_raw_signals_cache_filename,
+    read_cached_raw_signals,
+    write_cached_raw_signals,
+    get_bids_index_dir,
     get_func_filenames_bids,
     save_output,
     load_timeseries,
+    get_output_key,
     FC_FILLS,
     FC_PATTERN,
     TIMESERIES_FILLS,
     TIMESERIES_PATTERN,
+    STORAGE_EXTENSIONS,
+    get_storage_fills,
 )
 
 NETWORK_MAPPING: str = "yeo_networks7"  # Also yeo_networks17
+# Options of the command line that a denoising configuration can override
+DENOISING_OPTIONS: tuple = (
+    "low_pass",
+    "denoising_strategy",
+    "motion",
+    "FD_thresh",
+    "SDVARS_thresh",
+    "n_scrub_frames",
+    "no_censor",
+)
 
 
 def get_arguments() -> argparse.Namespace:
@@ -121,9 +150,66 @@ def get_arguments() -> argparse.Namespace:
     # fMRI and denoising specific options
     parser.add_argument(
         "--atlas-dimension",
-        default=64,
+        default=[64],
+        nargs="+",
+        type=int,
+        help="""a space delimited list of dimension(s) of the atlas (usually 64, 128 or
+        512), all extracted in a single pass over each functional image; several
+        dimensions are always extracted with the 'chunked' engine""",
+    )
+    parser.add_argument(
+        "--extraction-engine",
+        default="masker",
+        action="store",
+        choices=["masker", "chunked"],
+        type=str,
+        help="""engine extracting the regional timeseries: NiLearn's masker or a
+        memory-bounded projection of the data in chunks of volumes""",
+    )
+    parser.add_argument(
+        "--extraction-mem-gb",
+        default=DEFAULT_MEM_GB,
+        action="store",
+        type=float,
+        help="memory ceiling (in GB) of each worker of the 'chunked' extraction engine",
+    )
+    parser.add_argument(
+        "--projection-threshold",
+        default=None,
+        action="store",
+        type=float,
+        help="""prune the atlas maps of the 'chunked' engine into sparse matrices by
+        dropping the weights below this fraction of the peak of each map (e.g., 0.05);
+        the relative errors of the projection operator and of the signals of the
+        first volumes are logged""",
+    )
+    parser.add_argument(
+        "--n-procs",
+        default=8,
+        action="store",
         type=int,
-        help="dimension of the atlas (usually 64, 128 or 512)",
+        help="maximum number of parallel workers",
+    )
+    parser.add_argument(
+        "--mem-gb",
+        default=None,
+        action="store",
+        type=float,
+        help="memory budget (in GB) shared by all the parallel workers",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        action="store",
+        help="""directory caching the resampled atlas maps and the confounds
+        (defaults to $HCPH_FUNCONN_CACHE or ~/.cache/hcph-funconn)""",
+    )
+    parser.add_argument(
+        "--cache-max-gb",
+        default=DEFAULT_CACHE_MAX_GB,
+        action="store",
+        type=float,
+        help="size (in GB) above which the least recently used cache entries are evicted",
     )
     parser.add_argument(
         "--low-pass",
@@ -180,6 +266,16 @@ def get_arguments() -> argparse.Namespace:
         type=int,
         help="minimum segment length after volume censoring",
     )
+    parser.add_argument(
+        "--denoising-configs",
+        default=None,
+        action="store",
+        help="""JSON file listing denoising configurations, each an object overriding
+        some of the options low_pass, denoising_strategy, motion, FD_thresh,
+        SDVARS_thresh, n_scrub_frames and no_censor, with an optional "name". The
+        timeseries are extracted once and each configuration is saved in its own
+        derivatives folder (named after it)""",
+    )
     parser.add_argument(
         "--fc-estimator",
         default="sparse inverse covariance",
@@ -189,12 +285,66 @@ def get_arguments() -> argparse.Namespace:
         help="""type of connectivity to compute (can be 'correlation', 'covariance' or
         'sparse')""",
     )
+    parser.add_argument(
+        "--sparse-mode",
+        default="cv",
+        action="store",
+        choices=list(SPARSE_MODES),
+        help="""alpha selection of the sparse inverse covariance: 'cv' cross-validates
+        each run independently, 'shared' shares one alpha grid across runs and
+        warm-starts each fit from the previous run, 'group' selects one alpha for all
+        the runs and fits each run once""",
+    )
     parser.add_argument(
         "--no-censor",
         default=False,
         action="store_true",
         help="interpolate volumes with high motion without censoring",
     )
+    parser.add_argument(
+        "--reports",
+        default="full",
+        action="store",
+        choices=list(REPORT_MODES),
+        help="""visual reports of the individual runs: 'none' skips them, 'thumbnails'
+        renders figures of bounded pixel size and 'full' renders them at full size""",
+    )
+    parser.add_argument(
+        "--dry-run",
+        default=False,
+        action="store_true",
+        help="""print the work plan (runs per FoV/TR group, missing and up-to-date
+        outputs, estimated memory) and exit""",
+    )
+    parser.add_argument(
+        "--reports-only",
+        default=False,
+        action="store_true",
+        help="""only render the visual reports of the timeseries and connectivity
+        matrices already computed with the same parameters""",
+    )
+    parser.add_argument(
+        "--storage",
+        default="tsv",
+        action="store",
+        choices=list(STORAGE_EXTENSIONS),
+        help="""file format of the timeseries and connectivity matrices (the binary
+        formats 'npy', 'hdf5' and 'zarr' are faster to reload than the text TSV)""",
+    )
+    parser.add_argument(
+        "--storage-dtype",
+        default="float64",
+        action="store",
+        choices=["float64", "float32"],
+        help="data type of the saved timeseries and connectivity matrices",
+    )
+    parser.add_argument(
+        "--reindex",
+        default=False,
+        action="store_true",
+        help="""rebuild the index of the BIDS files from scratch instead of refreshing
+        only the folders modified since the previous run""",
+    )
 
     parser.add_argument(
         "-v",
@@ -215,10 +365,14 @@ def fit_transform_patched(
     atlas_filename: str,
     confounds: Optional[list] = None,
     sample_mask: Optional[list] = None,
+    engine: str = "masker",
+    engine_kwargs: Optional[dict] = None,
     **kwargs,
 ) -> list[np.ndarray]:
     """Attempt to use NiLearn's MultiNiftiMapsMaskers, if it fails it will use the
     patched version of the maskers (to be implemented into NiLearn in the future).
+    With the "chunked" engine, the timeseries are instead extracted by projecting
+    the data onto the atlas a few volumes at a time.
 
     Parameters
     ----------
@@ -232,12 +386,48 @@ def fit_transform_patched(
     sample_mask : Optional[list], optional
         List of sample masks (usually from nilearn.interface.fmriprep.load_confounds),
         by default None
+    engine : str, optional
+        Extraction engine, either "masker" or "chunked", by default "masker"
+    engine_kwargs : Optional[dict], optional
+        Options of the extraction engine ("mem_gb" for the memory ceiling of the
+        chunked engine, "atlas_name", "cache_dir" and "cache_max_gb" to cache the
+        resampled atlas maps), by default None
 
     Returns
     -------
     list[np.ndarray]
         List of extracted and denoised timeseries
     """
+    from nilearn.maskers import MultiNiftiMapsMasker
+    from nilearn_patcher import MultiNiftiMapsMasker as MultiNiftiMapsMasker_patched
+
+    from extraction import fit_transform_chunked, get_resampled_maps_img
+
+    engine_kwargs = engine_kwargs or {}
+
+    if engine == "chunked":
+        # Masker reports are not generated by the chunked engine
+        kwargs.pop("reports", None)
+        return fit_transform_chunked(
+            func_filename,
+            atlas_filename,
+            confounds=confounds,
+            sample_mask=sample_mask,
+            **engine_kwargs,
+            **kwargs,
+        )
+
+    if engine_kwargs.get("atlas_name") is not None and len(func_filename):
+        # Files are grouped by FoV, the maps resampled to the first file's grid are
+        # thus valid for the whole group
+        atlas_filename = get_resampled_maps_img(
+            atlas_filename,
+            func_filename[0],
+            engine_kwargs["atlas_name"],
+            cache_dir=engine_kwargs.get("cache_dir"),
+            cache_max_gb=engine_kwargs.get("cache_max_gb", DEFAULT_CACHE_MAX_GB),
+        )
+
     masker = MultiNiftiMapsMasker(maps_img=atlas_filename, **kwargs)
 
     try:
@@ -258,17 +448,21 @@ def fit_transform_patched(
     return time_series
 
 
-def interpolate_and_denoise_timeseries(
+def extract_raw_timeseries(
     func_filename: list[str],
     atlas_filename: str,
-    confounds: list,
-    sample_mask: list,
-    t_r: Optional[float] = None,
-    low_pass: Optional[float] = None,
-    output: Optional[str] = None,
     verbose: int = 2,
-) -> tuple[list[np.ndarray], list]:
-    """Interpolate and denoise the timeseries without censoring high motion volumes.
+    n_jobs: int = 1,
+    engine: str = "masker",
+    engine_kwargs: Optional[dict] = None,
+    other_atlases: Optional[list[tuple[str, str]]] = None,
+    cache_signals: bool = True,
+) -> list[np.ndarray]:
+    """Extract the raw (neither denoised nor standardized) regional timeseries.
+
+    The projection onto the atlas is linear, so the raw signals of each run can be
+    cached on disk (see load_save.get_raw_signals_cache_filename) and denoised with
+    any strategy without reading the functional image again.
 
     Parameters
     ----------
@@ -276,6 +470,112 @@ def interpolate_and_denoise_timeseries(
         List of BIDS functional filenames
     atlas_filename : str
         Path to the atlas filename
+    verbose : int, optional
+        Amount of verbosity, by default 2
+    n_jobs : int, optional
+        Number of parallel workers extracting the uncached timeseries, by default 1
+    engine : str, optional
+        Extraction engine, either "masker" or "chunked", by default "masker"
+    engine_kwargs : Optional[dict], optional
+        Options of the extraction engine (see fit_transform_patched), by default None.
+        Its "cache_dir" and "cache_max_gb" also apply to the signals cache.
+    other_atlases : Optional[list[tuple[str, str]]], optional
+        Name and maps filename of other atlases, by default None. The functional
+        images read to extract the timeseries are then projected onto all the atlases
+        in a single pass, and the signals of the other atlases are cached too.
+    cache_signals : bool, optional
+        Whether the extracted signals of the atlas are written to the cache (e.g.,
+        to be denoised with other strategies), by default True. The cache is
+        read in any case.
+
+    Returns
+    -------
+    list[np.ndarray]
+        List of raw regional timeseries
+    """
+    engine_kwargs = engine_kwargs or {}
+    cache_paths = [
+        get_raw_signals_cache_filename(
+            filename,
+            atlas_filename,
+            cache_dir=engine_kwargs.get("cache_dir"),
+            sparse_threshold=engine_kwargs.get("sparse_threshold"),
+        )
+        for filename in func_filename
+    ]
+    time_series = [read_cached_raw_signals(path) for path in cache_paths]
+
+    missing = [i for i, ts in enumerate(time_series) if ts is None]
+    if missing and other_atlases:
+        from extraction import fit_transform_atlases
+
+        logging.debug(
+            f"Extracting the raw timeseries of {len(missing)} file(s) for "
+            f"{len(other_atlases) + 1} atlases ..."
+        )
+        missing_files = [func_filename[i] for i in missing]
+        atlas_filenames = [atlas_filename] + [maps for _, maps in other_atlases]
+        all_extracted = fit_transform_atlases(
+            missing_files,
+            atlas_filenames,
+            atlas_names=[engine_kwargs.get("atlas_name")]
+            + [name for name, _ in other_atlases],
+            mem_gb=engine_kwargs.get("mem_gb", DEFAULT_MEM_GB),
+            cache_dir=engine_kwargs.get("cache_dir"),
+            cache_max_gb=engine_kwargs.get("cache_max_gb", DEFAULT_CACHE_MAX_GB),
+            sparse_threshold=engine_kwargs.get("sparse_threshold"),
+            n_jobs=n_jobs,
+            verbose=verbose,
+        )
+        for other_filename, other_signals in zip(
+            atlas_filenames[1:], all_extracted[1:]
+        ):
+            for filename, ts in zip(missing_files, other_signals):
+                write_cached_raw_signals(
+                    get_raw_signals_cache_filename(
+                        filename,
+                        other_filename,
+                        cache_dir=engine_kwargs.get("cache_dir"),
+                        sparse_threshold=engine_kwargs.get("sparse_threshold"),
+                    ),
+                    ts,
+                )
+        extracted = all_extracted[0]
+    elif missing:
+        logging.debug(f"Extracting the raw timeseries of {len(missing)} file(s) ...")
+        extracted = fit_transform_patched(
+            [func_filename[i] for i in missing],
+            atlas_filename,
+            standardize=False,
+            verbose=verbose,
+            n_jobs=n_jobs,
+            engine=engine,
+            engine_kwargs=engine_kwargs,
+        )
+
+    if missing:
+        for i, ts in zip(missing, extracted):
+            time_series[i] = ts
+            if cache_signals:
+                write_cached_raw_signals(cache_paths[i], ts)
+
+    return time_series
+
+
+def denoise_raw_timeseries(
+    time_series: list[np.ndarray],
+    confounds: list,
+    sample_mask: list,
+    t_r: Optional[float] = None,
+    low_pass: Optional[float] = None,
+) -> list[np.ndarray]:
+    """Censor and denoise raw regional timeseries the way NiLearn's maskers clean
+    the signals they extract.
+
+    Parameters
+    ----------
+    time_series : list[np.ndarray]
+        List of raw timeseries (see extract_raw_timeseries)
     confounds : list
         List of confounds (usually from nilearn.interface.fmriprep.load_confounds).
     sample_mask : list
@@ -284,119 +584,118 @@ def interpolate_and_denoise_timeseries(
         Repetition time of the MRI acquisition, by default None
     low_pass : Optional[float], optional
         Low-pass filtering cutoff frequency, by default None
-    output : Optional[str], optional
-        Path to the output directory, by default None
-    verbose : int, optional
-        Amount of verbosity, by default 2
 
     Returns
     -------
-    tuple[list[np.ndarray], list]
-        Two lists, one with the denoised timeseries and one with the corresponding
-        confounds.
+    list[np.ndarray]
+        List of denoised timeseries
     """
-    logging.info("Interpolating signal (no censoring) ...")
-    # Extract the regional signals
-    extracted_time_series = fit_transform_patched(
-        func_filename,
-        atlas_filename,
-        standardize="zscore_sample",
-        verbose=verbose,
-        n_jobs=8,
-    )
-
-    interpolated_signals = []
-    interpolated_confounds = []
-    denoised_signals = []
-    for ts, conf, sm, fn in zip(
-        extracted_time_series, confounds, sample_mask, func_filename
-    ):
-        logging.debug(
-            f"Timeserie has length {ts.shape[0]} and sample mask has "
-            f"length {len(sm)}"
-        )
-
-        # This is required as we are manually doing some internal Nilearn machinery
-        conf = _sanitize_confounds(ts.shape[0], n_runs=1, confounds=conf)
-        conf = stringify_path(conf)
+    from nilearn.signal import clean
 
-        ts_to_interpolate = ts.copy()
-
-        inter_sig, inter_conf = _handle_scrubbed_volumes(
-            signals=ts_to_interpolate,
+    return [
+        clean(
+            ts,
             confounds=conf,
             sample_mask=sm,
-            filter_type="butterworth",
             t_r=t_r,
-        )
-
-        if output is not None:
-            plot_interpolation(ts, inter_sig, fn, output)
-
-        # Denoise the signals
-        denoised_sig = clean(
-            inter_sig,
-            standardize="zscore_sample",
-            confounds=inter_conf,
             low_pass=low_pass,
-            t_r=t_r,
+            detrend=False,
+            standardize="zscore_sample",
+            standardize_confounds=True,
         )
-
-        interpolated_signals.append(inter_sig)
-        interpolated_confounds.append(inter_conf)
-        denoised_signals.append(denoised_sig)
-
-    return denoised_signals, interpolated_confounds
+        for ts, conf, sm in zip(time_series, confounds, sample_mask)
+    ]
 
 
-def extract_and_denoise_timeseries(
+def denoise_interpolated_timeseries(
+    time_series: list[np.ndarray],
+    confounds: list,
+    sample_mask: list,
     func_filename: list[str],
-    atlas_filename: str,
-    verbose: int = 2,
-    interpolate: bool = False,
-    low_pass: Optional[float] = None,
-    denoising_strategy: Optional[tuple] = (),
-    motion: Optional[str] = None,
     t_r: Optional[float] = None,
+    low_pass: Optional[float] = None,
     output: Optional[str] = None,
-    **kwargs,
-) -> tuple[list[np.ndarray], list, list[np.ndarray]]:
-    """Extract and denoise regional timeseries for a given atlas.
+    report_tasks: Optional[list] = None,
+) -> tuple[list[np.ndarray], list]:
+    """Interpolate the high motion volumes and denoise the timeseries of runs sharing
+    the same repetition time in a single batch.
 
     Parameters
     ----------
+    time_series : list[np.ndarray]
+        List of extracted (not denoised) timeseries
+    confounds : list
+        List of confounds (usually from nilearn.interface.fmriprep.load_confounds).
+    sample_mask : list
+        List of sample_masks (usually from nilearn.interface.fmriprep.load_confounds).
     func_filename : list[str]
-        List of BIDS functional filenames
-    atlas_filename : str
-        Path to the atlas filename
-    verbose : int, optional
-        Amount of verbosity, by default 2
-    interpolate : bool, optional
-        Condition to ONLY interpolate the timeseries (without censoring),
-        by default False
+        List of the corresponding BIDS functional filenames
+    t_r : Optional[float], optional
+        Repetition time of the MRI acquisition, by default None
     low_pass : Optional[float], optional
         Low-pass filtering cutoff frequency, by default None
-    denoising_strategy = Optional[tuple], optional,
-        the type of noise regressors to include.
-    motion: Optional[str], optional,
-        type of confounds extracted from head motion estimates
-    t_r : Optional[float], optional
-        Repetition time of the MRI, by default None
     output : Optional[str], optional
         Path to the output directory, by default None
+    report_tasks : Optional[list], optional
+        List to which the interpolation visual reports are queued (see
+        reports.render_reports), by default None (the reports are rendered directly)
 
     Returns
     -------
     tuple[list[np.ndarray], list]
-        Two lists, one with the extracted and denoised timeseries and one with the
-        corresponding confounds.
+        Two lists, one with the denoised timeseries and one with the corresponding
+        interpolated confounds.
     """
-    if not len(func_filename):
-        return [], [], []
+    from denoising import interpolate_and_clean
+    from reports import plot_interpolation, render_reports
 
-    logging.info(f"Extracting and denoising timeseries for {len(func_filename)} files.")
-    logging.debug(f"Denoising strategy includes : {' '.join(denoising_strategy)}")
-    logging.debug(f"Denoising parameters are: {kwargs}")
+    denoised_signals, interpolated_signals, interpolated_confounds = (
+        interpolate_and_clean(
+            time_series,
+            confounds,
+            sample_mask,
+            t_r=t_r,
+            low_pass=low_pass,
+            standardize="zscore_sample",
+        )
+    )
+
+    for i, (ts, inter_sig, conf, fn) in enumerate(
+        zip(time_series, interpolated_signals, confounds, func_filename)
+    ):
+        # Keep the confounds names for the design matrix visual report
+        if isinstance(conf, pd.DataFrame):
+            interpolated_confounds[i] = pd.DataFrame(
+                interpolated_confounds[i], columns=conf.columns, index=conf.index
+            )
+
+        if output is not None:
+            report_task = (
+                plot_interpolation,
+                {
+                    "ts": ts,
+                    "interpolated_ts": inter_sig,
+                    "filename": fn,
+                    "output": output,
+                },
+            )
+            if report_tasks is None:
+                render_reports([report_task])
+            else:
+                report_tasks.append(report_task)
+
+    return denoised_signals, interpolated_confounds
+
+
+def _load_confounds_files(
+    func_filename: list[str],
+    denoising_strategy: Optional[tuple] = (),
+    motion: Optional[str] = None,
+    **kwargs,
+) -> tuple[list, list]:
+    """Load the fMRIPrep confounds and sample masks of functional files from the
+    confounds TSV files (see load_run_confounds)."""
+    from nilearn.interfaces.fmriprep import load_confounds
 
     # There is currently a bug in nilearn that prevents "load_confounds" from finding
     # the confounds file if it contains any other BIDS entity than "ses" and "run".
@@ -435,72 +734,677 @@ def extract_and_denoise_timeseries(
     if not isinstance(sample_mask, list):
         sample_mask = [sample_mask]
 
-    if interpolate:
-        time_series, confounds = interpolate_and_denoise_timeseries(
-            func_filename,
-            atlas_filename,
-            confounds,
-            sample_mask,
-            t_r=t_r,
-            low_pass=low_pass,
-            output=output,
-            verbose=verbose,
-        )
-        return time_series, confounds
-
-    time_series = fit_transform_patched(
-        func_filename,
-        atlas_filename,
-        confounds,
-        sample_mask,
-        low_pass=low_pass,
-        t_r=t_r,
-        standardize="zscore_sample",
-        verbose=verbose,
-        reports=True,
-        n_jobs=8,
-    )
+    return confounds, sample_mask
 
-    return time_series, confounds, sample_mask
 
+def load_run_confounds(
+    func_filename: list[str],
+    denoising_strategy: Optional[tuple] = (),
+    motion: Optional[str] = None,
+    n_jobs: int = 1,
+    cache_dir: Optional[str] = None,
+    cache_max_gb: float = DEFAULT_CACHE_MAX_GB,
+    **kwargs,
+) -> tuple[list, list]:
+    """Load the fMRIPrep confounds and sample masks of functional files.
 
-def get_fc_strategy(
-    strategy: str = "sparse inverse covariance",
-) -> tuple[Union[GraphicalLassoCV, LedoitWolf], str, str]:
-    """Get the strategy to compute functional connectivity.
+    The wide confounds TSV files are only parsed once: the confounds selected by the
+    strategy are cached on disk (see load_save.get_confounds_cache_filename), and
+    the runs missing from the cache are loaded in parallel.
 
     Parameters
     ----------
-    strategy : str, optional
-        Name of the strategy, could be "correlation", "covariance" or "sparse",
-        by default "sparse inverse covariance"
+    func_filename : list[str]
+        List of BIDS functional filenames
+    denoising_strategy = Optional[tuple], optional,
+        the type of noise regressors to include.
+    motion: Optional[str], optional,
+        type of confounds extracted from head motion estimates
+    n_jobs : int, optional
+        Number of parallel workers loading the uncached confounds, by default 1
+    cache_dir : Optional[str], optional
+        Root of the cache, by default None (see caching.get_cache_dir)
+    cache_max_gb : float, optional
+        Size above which the least recently used cache entries are evicted,
+        by default DEFAULT_CACHE_MAX_GB
 
     Returns
     -------
-    tuple[Union[GraphicalLassoCV, LedoitWolf], str, str]
-        Returns the covariance estimator, the name of the metric (covariance or
-        precision) as well as standardized label for file naming.
+    tuple[list, list]
+        Two lists, one with the loaded confounds (for each input file) and one with the
+        corresponding sample mask.
     """
-    connectivity_kind = "precision"
-    connectivity_label = "sparseinversecovariance"
-    estimator = GraphicalLassoCV(alphas=6, max_iter=1000)
-
-    if strategy in ["cor", "corr", "correlation"]:
-        connectivity_kind = "correlation"
-        connectivity_label = "correlation"
-        estimator = LedoitWolf(store_precision=False)
-    elif strategy not in ["sparse", "sparse inverse covariance"]:
-        connectivity_kind = "covariance"
-        connectivity_label = "covariance"
+    parameters = {
+        "denoising_strategy": list(denoising_strategy),
+        "motion": motion,
+        **kwargs,
+    }
+    cache_paths = [
+        get_confounds_cache_filename(filename, parameters, cache_dir=cache_dir)
+        for filename in func_filename
+    ]
+    loaded = [read_cached_confounds(path) for path in cache_paths]
+
+    missing = [i for i, entry in enumerate(loaded) if entry is None]
+    if missing:
+        logging.debug(f"Loading the confounds of {len(missing)} file(s) ...")
+        results = Parallel(n_jobs=max(1, min(n_jobs, len(missing))))(
+            delayed(_load_confounds_files)(
+                [func_filename[i]],
+                denoising_strategy=denoising_strategy,
+                motion=motion,
+                **kwargs,
+            )
+            for i in missing
+        )
+        for i, (confounds, sample_mask) in zip(missing, results):
+            loaded[i] = (confounds[0], sample_mask[0])
+            write_cached_confounds(cache_paths[i], confounds[0], sample_mask[0])
+        evict_cache(op.dirname(cache_paths[0]), max_gb=cache_max_gb)
 
-    return estimator, connectivity_kind, connectivity_label
+    confounds = [entry[0] for entry in loaded]
+    sample_mask = [entry[1] for entry in loaded]
+    return confounds, sample_mask
 
 
-def compute_connectivity(
-    time_series: list[np.ndarray],
-    estimator: Union[LedoitWolf, GraphicalLassoCV] = LedoitWolf(store_precision=False),
-    connectivity_kind: str = "correlation",
-) -> list[np.ndarray]:
+def extract_and_denoise_timeseries(
+    func_filename: list[str],
+    atlas_filename: str,
+    verbose: int = 2,
+    interpolate: bool = False,
+    denoise: bool = True,
+    low_pass: Optional[float] = None,
+    denoising_strategy: Optional[tuple] = (),
+    motion: Optional[str] = None,
+    t_r: Optional[float] = None,
+    output: Optional[str] = None,
+    n_jobs: int = 1,
+    engine: str = "masker",
+    engine_kwargs: Optional[dict] = None,
+    other_atlases: Optional[list[tuple[str, str]]] = None,
+    cache_signals: bool = True,
+    confounds: Optional[list] = None,
+    sample_mask: Optional[list] = None,
+    **kwargs,
+) -> tuple[list[np.ndarray], list, list[np.ndarray]]:
+    """Extract and denoise regional timeseries for a given atlas.
+
+    Parameters
+    ----------
+    func_filename : list[str]
+        List of BIDS functional filenames
+    atlas_filename : str
+        Path to the atlas filename
+    verbose : int, optional
+        Amount of verbosity, by default 2
+    interpolate : bool, optional
+        Condition to ONLY interpolate the timeseries (without censoring),
+        by default False
+    denoise : bool, optional
+        With `interpolate`, setting it to False returns the extracted timeseries
+        before interpolation and denoising (see denoise_interpolated_timeseries),
+        by default True
+    low_pass : Optional[float], optional
+        Low-pass filtering cutoff frequency, by default None
+    denoising_strategy = Optional[tuple], optional,
+        the type of noise regressors to include.
+    motion: Optional[str], optional,
+        type of confounds extracted from head motion estimates
+    t_r : Optional[float], optional
+        Repetition time of the MRI, by default None
+    output : Optional[str], optional
+        Path to the output directory, by default None
+    n_jobs : int, optional
+        Number of parallel workers extracting the timeseries, by default 1
+    engine : str, optional
+        Extraction engine, either "masker" or "chunked", by default "masker"
+    engine_kwargs : Optional[dict], optional
+        Options of the extraction engine (see fit_transform_patched), by default None.
+        Its "cache_dir" and "cache_max_gb" also apply to the confounds cache.
+    other_atlases : Optional[list[tuple[str, str]]], optional
+        Name and maps filename of other atlases extracted in the same pass (see
+        extract_raw_timeseries), by default None
+    cache_signals : bool, optional
+        Whether the raw signals are written to the cache (see
+        extract_raw_timeseries), by default True
+    confounds : Optional[list], optional
+        Confounds of each file already loaded with load_run_confounds, by default
+        None (loaded with the denoising strategy, motion and kwargs)
+    sample_mask : Optional[list], optional
+        Sample masks of each file loaded along with the confounds, by default None
+
+    Returns
+    -------
+    tuple[list[np.ndarray], list, list[np.ndarray]]
+        Three lists, with the extracted and denoised timeseries, the corresponding
+        confounds and the corresponding sample masks.
+    """
+    if not len(func_filename):
+        return [], [], []
+
+    logging.info(f"Extracting and denoising timeseries for {len(func_filename)} files.")
+    logging.debug(f"Denoising strategy includes : {' '.join(denoising_strategy)}")
+    logging.debug(f"Denoising parameters are: {kwargs}")
+
+    engine_kwargs = engine_kwargs or {}
+    if confounds is None or sample_mask is None:
+        confounds, sample_mask = load_run_confounds(
+            func_filename,
+            denoising_strategy=denoising_strategy,
+            motion=motion,
+            n_jobs=n_jobs,
+            cache_dir=engine_kwargs.get("cache_dir"),
+            cache_max_gb=engine_kwargs.get("cache_max_gb", DEFAULT_CACHE_MAX_GB),
+            **kwargs,
+        )
+
+    time_series = extract_raw_timeseries(
+        func_filename,
+        atlas_filename,
+        verbose=verbose,
+        n_jobs=n_jobs,
+        engine=engine,
+        engine_kwargs=engine_kwargs,
+        other_atlases=other_atlases,
+        cache_signals=cache_signals,
+    )
+
+    if interpolate:
+        from nilearn.signal import clean
+
+        time_series = [
+            clean(ts, detrend=False, standardize="zscore_sample") for ts in time_series
+        ]
+        if not denoise:
+            return time_series, confounds, sample_mask
+
+        logging.info("Interpolating signal (no censoring) ...")
+        time_series, confounds = denoise_interpolated_timeseries(
+            time_series,
+            confounds,
+            sample_mask,
+            func_filename,
+            t_r=t_r,
+            low_pass=low_pass,
+            output=output,
+        )
+        return time_series, confounds, sample_mask
+
+    time_series = denoise_raw_timeseries(
+        time_series, confounds, sample_mask, t_r=t_r, low_pass=low_pass
+    )
+
+    return time_series, confounds, sample_mask
+
+
+def estimate_run_mem_gb(
+    func_filename: str,
+    n_regions: int,
+    engine: str = "masker",
+    engine_kwargs: Optional[dict] = None,
+    shape: Optional[tuple] = None,
+    operator_gb: Optional[float] = None,
+) -> float:
+    """Estimate the peak memory needed to extract the timeseries of one run.
+
+    Parameters
+    ----------
+    func_filename : str
+        BIDS functional filename
+    n_regions : int
+        Number of regions of the atlas
+    engine : str, optional
+        Extraction engine, either "masker" or "chunked", by default "masker"
+    engine_kwargs : Optional[dict], optional
+        Options of the extraction engine (see fit_transform_patched), by default None
+    shape : Optional[tuple], optional
+        Shape of the functional image (e.g., from bids_index.scan_headers),
+        by default read from the file
+    operator_gb : Optional[float], optional
+        Size (in GB) of the projection operators of the atlases on the grid of the
+        run (see prepare_projection_operators), held by the "chunked" engine, by
+        default None (maps covering the whole grid are assumed)
+
+    Returns
+    -------
+    float
+        Estimated memory in GB.
+    """
+    if shape is None:
+        shape = nib.load(func_filename).shape
+    n_voxels = np.prod(shape[:3])
+    n_timepoints = shape[3] if len(shape) > 3 else 1
+
+    if engine == "chunked":
+        if operator_gb is None:
+            operator_gb = 8 * n_voxels * n_regions / 1024**3
+        # The chunks of volumes fill the memory ceiling left by the operators, but
+        # at least one volume is read at a time, with up to 40 bytes per voxel for
+        # its temporaries (see extraction.get_chunk_length)
+        return max(
+            (engine_kwargs or {}).get("mem_gb", DEFAULT_MEM_GB),
+            operator_gb + 40 * n_voxels / 1024**3,
+        )
+
+    # The masker holds the data in float64, a copy of it while cleaning and the
+    # maps resampled to the data grid
+    return 8 * n_voxels * (2 * n_timepoints + n_regions) / 1024**3
+
+
+def prepare_projection_operators(
+    func_filename: list[str],
+    atlas_filename: str,
+    engine_kwargs: Optional[dict] = None,
+    other_atlases: Optional[list[tuple[str, str]]] = None,
+) -> list[Optional[float]]:
+    """Compute (or read from the cache) the projection operators of the atlases on
+    the grid of each functional image, and return their size.
+
+    Called before dispatching the runs, so that the workers only memory-map the
+    cached operators instead of each resampling the atlas maps.
+
+    Parameters
+    ----------
+    func_filename : list[str]
+        List of BIDS functional filenames
+    atlas_filename : str
+        Path to the atlas filename
+    engine_kwargs : Optional[dict], optional
+        Options of the extraction engine (see fit_transform_patched), by default None
+    other_atlases : Optional[list[tuple[str, str]]], optional
+        Name and maps filename of other atlases extracted in the same pass (see
+        extract_raw_timeseries), by default None
+
+    Returns
+    -------
+    list[Optional[float]]
+        Size (in GB) of the operators held to extract each run, None when they are
+        not cached (without "atlas_name" in engine_kwargs).
+    """
+    from extraction import get_file_operators, get_operator_nbytes
+
+    engine_kwargs = engine_kwargs or {}
+    if engine_kwargs.get("atlas_name") is None or not len(func_filename):
+        return [None] * len(func_filename)
+
+    atlases = [(engine_kwargs["atlas_name"], atlas_filename)] + list(
+        other_atlases or []
+    )
+    logging.info(f"Preparing the projection operators of {len(atlases)} atlas(es) ...")
+    operator_gb = np.zeros(len(func_filename))
+    for atlas_name, maps_filename in atlases:
+        operators = get_file_operators(
+            func_filename,
+            maps_filename,
+            atlas_name=atlas_name,
+            cache_dir=engine_kwargs.get("cache_dir"),
+            cache_max_gb=engine_kwargs.get("cache_max_gb", DEFAULT_CACHE_MAX_GB),
+            sparse_threshold=engine_kwargs.get("sparse_threshold"),
+        )
+        operator_gb += [
+            get_operator_nbytes(operator) / 1024**3 for operator in operators
+        ]
+    return operator_gb.tolist()
+
+
+def get_n_workers(
+    run_mem_gb: list[float],
+    n_procs: int = 1,
+    mem_gb: Optional[float] = None,
+) -> int:
+    """Return the number of parallel workers fitting the worker and memory budgets.
+
+    Parameters
+    ----------
+    run_mem_gb : list[float]
+        Estimated memory needed by each run (in GB)
+    n_procs : int, optional
+        Maximum number of workers, by default 1
+    mem_gb : Optional[float], optional
+        Memory budget shared by the workers (in GB), by default None (no limit)
+
+    Returns
+    -------
+    int
+        Number of workers (at least one).
+    """
+    n_workers = max(1, min(n_procs, len(run_mem_gb)))
+
+    if mem_gb is not None and len(run_mem_gb):
+        n_fitting = int(mem_gb // max(run_mem_gb))
+        if n_fitting < 1:
+            logging.warning(
+                f"A single run may need {max(run_mem_gb):.1f} GB, which exceeds the "
+                f"memory budget of {mem_gb} GB. Runs will be processed one at a time."
+            )
+        n_workers = max(1, min(n_workers, n_fitting))
+
+    return n_workers
+
+
+def extract_and_denoise_groups(
+    func_filenames: list[list[str]],
+    t_r_list: list[float],
+    atlas_filename: str,
+    n_procs: int = 1,
+    mem_gb: Optional[float] = None,
+    engine: str = "masker",
+    engine_kwargs: Optional[dict] = None,
+    other_atlases: Optional[list[tuple[str, str]]] = None,
+    cache_signals: bool = True,
+    interpolate: bool = False,
+    output: Optional[str] = None,
+    report_tasks: Optional[list] = None,
+    confound_parameters: Optional[dict] = None,
+    **kwargs,
+) -> tuple[list[np.ndarray], list, list[np.ndarray]]:
+    """Extract and denoise the regional timeseries of several FoV/TR groups
+    concurrently.
+
+    The runs of all the groups are scheduled on a single pool of workers, whose size
+    is bounded by the number of processes and by the memory budget.
+
+    Parameters
+    ----------
+    func_filenames : list[list[str]]
+        Groups of BIDS functional filenames sharing FoV and TR
+    t_r_list : list[float]
+        Repetition time of each group
+    atlas_filename : str
+        Path to the atlas filename
+    n_procs : int, optional
+        Maximum number of workers, by default 1
+    mem_gb : Optional[float], optional
+        Memory budget shared by the workers (in GB), by default None (no limit)
+    engine : str, optional
+        Extraction engine, either "masker" or "chunked", by default "masker"
+    engine_kwargs : Optional[dict], optional
+        Options of the extraction engine (see fit_transform_patched), by default None
+    other_atlases : Optional[list[tuple[str, str]]], optional
+        Name and maps filename of other atlases extracted in the same pass (see
+        extract_raw_timeseries), by default None
+    cache_signals : bool, optional
+        Whether the raw signals are written to the cache (see
+        extract_raw_timeseries), by default True
+    interpolate : bool, optional
+        Condition to ONLY interpolate the timeseries (without censoring),
+        by default False
+    output : Optional[str], optional
+        Path to the output directory, by default None
+    report_tasks : Optional[list], optional
+        List to which the interpolation visual reports are queued (see
+        reports.render_reports), by default None (the reports are rendered directly)
+    confound_parameters : Optional[dict], optional
+        Arguments selecting the confounds and the censored volumes (e.g.,
+        "denoising_strategy", "motion", "fd_threshold"), see load_run_confounds, by
+        default None
+
+    Returns
+    -------
+    tuple[list[np.ndarray], list, list[np.ndarray]]
+        Three lists, with the extracted and denoised timeseries, the corresponding
+        confounds and the corresponding sample masks (in the order of the groups).
+    """
+    runs = [
+        (filename, t_r)
+        for file_group, t_r in zip(func_filenames, t_r_list)
+        for filename in file_group
+    ]
+    if not len(runs):
+        return [], [], []
+
+    engine_kwargs = engine_kwargs or {}
+    confound_parameters = confound_parameters or {}
+
+    # The operators of the runs whose raw signals are not cached yet are prepared
+    # once per FoV/TR grid, before the workers are started
+    to_extract = [
+        filename
+        for filename, _ in runs
+        if not op.exists(
+            get_raw_signals_cache_filename(
+                filename,
+                atlas_filename,
+                cache_dir=engine_kwargs.get("cache_dir"),
+                sparse_threshold=engine_kwargs.get("sparse_threshold"),
+            )
+        )
+    ]
+    operator_gb = dict(
+        zip(
+            to_extract,
+            prepare_projection_operators(
+                to_extract,
+                atlas_filename,
+                engine_kwargs=engine_kwargs,
+                other_atlases=other_atlases,
+            ),
+        )
+    )
+
+    n_regions = nib.load(atlas_filename).shape[-1]
+    # Several atlases are extracted together by projecting chunks of volumes
+    run_mem_gb = [
+        estimate_run_mem_gb(
+            filename,
+            n_regions,
+            "chunked" if other_atlases else engine,
+            engine_kwargs,
+            operator_gb=operator_gb.get(filename, 0.0),
+        )
+        for filename, _ in runs
+    ]
+    n_workers = get_n_workers(run_mem_gb, n_procs=n_procs, mem_gb=mem_gb)
+    logging.info(
+        f"Extracting and denoising timeseries for {len(runs)} files from "
+        f"{sum(bool(group) for group in func_filenames)} FoV/TR group(s) "
+        f"with {n_workers} worker(s)."
+    )
+
+    # The confounds of all the runs are loaded (and cached) up front with all the
+    # processes, as the extraction workers are bounded by the memory budget, and
+    # then handed to the workers
+    confounds, sample_mask = load_run_confounds(
+        [filename for filename, _ in runs],
+        n_jobs=n_procs,
+        cache_dir=engine_kwargs.get("cache_dir"),
+        cache_max_gb=engine_kwargs.get("cache_max_gb", DEFAULT_CACHE_MAX_GB),
+        **confound_parameters,
+    )
+
+    # Without censoring, the workers only extract the timeseries and the runs are
+    # then interpolated and denoised in batches of similar TR
+    results = Parallel(n_jobs=n_workers)(
+        delayed(extract_and_denoise_timeseries)(
+            [filename],
+            atlas_filename,
+            t_r=t_r,
+            n_jobs=1,
+            engine=engine,
+            engine_kwargs=engine_kwargs,
+            other_atlases=other_atlases,
+            cache_signals=cache_signals,
+            interpolate=interpolate,
+            denoise=False,
+            output=output,
+            confounds=[run_confounds],
+            sample_mask=[run_sample_mask],
+            **confound_parameters,
+            **kwargs,
+        )
+        for (filename, t_r), run_confounds, run_sample_mask in zip(
+            runs, confounds, sample_mask
+        )
+    )
+
+    time_series, confounds, sample_mask = [], [], []
+    for ts, conf, mask in results:
+        time_series += ts
+        confounds += conf
+        sample_mask += mask
+
+    if interpolate:
+        start = 0
+        for file_group, t_r in zip(func_filenames, t_r_list):
+            stop = start + len(file_group)
+            (
+                time_series[start:stop],
+                confounds[start:stop],
+            ) = denoise_interpolated_timeseries(
+                time_series[start:stop],
+                confounds[start:stop],
+                sample_mask[start:stop],
+                file_group,
+                t_r=t_r,
+                low_pass=kwargs.get("low_pass"),
+                output=output,
+                report_tasks=report_tasks,
+            )
+            start = stop
+
+    return time_series, confounds, sample_mask
+
+
+def get_fc_kind(strategy: str = "sparse inverse covariance") -> tuple[str, str]:
+    """Get the kind of functional connectivity of a strategy, without setting up its
+    estimator (see get_fc_strategy).
+
+    Parameters
+    ----------
+    strategy : str, optional
+        Name of the strategy, could be "correlation", "covariance" or "sparse",
+        by default "sparse inverse covariance"
+
+    Returns
+    -------
+    tuple[str, str]
+        Returns the name of the metric (covariance, precision or correlation) as well
+        as standardized label for file naming.
+    """
+    if strategy in ["cor", "corr", "correlation"]:
+        return "correlation", "correlation"
+    elif strategy not in ["sparse", "sparse inverse covariance"]:
+        return "covariance", "covariance"
+    return "precision", "sparseinversecovariance"
+
+
+def get_fc_strategy(
+    strategy: str = "sparse inverse covariance",
+    sparse_mode: str = "cv",
+    n_jobs: int = 1,
+) -> tuple[Union[GraphicalLassoCV, SharedGraphicalLassoCV, LedoitWolf], str, str]:
+    """Get the strategy to compute functional connectivity.
+
+    Parameters
+    ----------
+    strategy : str, optional
+        Name of the strategy, could be "correlation", "covariance" or "sparse",
+        by default "sparse inverse covariance"
+    sparse_mode : str, optional
+        Alpha selection of the sparse inverse covariance: "cv" for an independent
+        cross-validation of each run, "shared" for a shared alpha grid with
+        warm-started fits, or "group" for a single group-level alpha,
+        by default "cv"
+    n_jobs : int, optional
+        Number of cross-validation folds computed in parallel by the "shared" and
+        "group" modes, by default 1
+
+    Returns
+    -------
+    tuple[Union[GraphicalLassoCV, SharedGraphicalLassoCV, LedoitWolf], str, str]
+        Returns the covariance estimator, the name of the metric (covariance or
+        precision) as well as standardized label for file naming.
+    """
+    from sklearn.covariance import GraphicalLassoCV, LedoitWolf
+
+    from covariance import SharedGraphicalLassoCV
+
+    if sparse_mode not in SPARSE_MODES:
+        raise ValueError(
+            f"Sparse mode {sparse_mode} is not supported. Choose among "
+            f"{', '.join(SPARSE_MODES)}."
+        )
+
+    connectivity_kind, connectivity_label = get_fc_kind(strategy)
+    if connectivity_kind == "correlation":
+        estimator = LedoitWolf(store_precision=False)
+    elif sparse_mode == "cv":
+        estimator = GraphicalLassoCV(alphas=6, max_iter=1000)
+    else:
+        estimator = SharedGraphicalLassoCV(
+            group_alpha=sparse_mode == "group", max_iter=1000, n_jobs=n_jobs
+        )
+
+    return estimator, connectivity_kind, connectivity_label
+
+
+def iter_connectivity(
+    time_series: list[np.ndarray],
+    estimator: Optional[
+        Union[LedoitWolf, GraphicalLassoCV, SharedGraphicalLassoCV]
+    ] = None,
+    connectivity_kind: str = "correlation",
+) -> Iterator[np.ndarray]:
+    """Compute the functional connectivity of each timeseries in turn, so that each
+    matrix can be saved as soon as it is estimated.
+
+    Parameters
+    ----------
+    time_series : list[np.ndarray]
+        List of timeseries
+    estimator : Union[LedoitWolf, GraphicalLassoCV, SharedGraphicalLassoCV], optional
+        Covariance estimator (usually from Scikit-Learn),
+        by default None (LedoitWolf(store_precision=False))
+    connectivity_kind : str, optional
+        Type of connectivity to compute, by default "correlation"
+
+    Yields
+    ------
+    np.ndarray
+        Functional connectivity matrix of each timeseries
+    """
+    from nilearn.connectome import ConnectivityMeasure, vec_to_sym_matrix
+    from sklearn.covariance import LedoitWolf
+
+    from covariance import prepare_estimator
+
+    if estimator is None:
+        estimator = LedoitWolf(store_precision=False)
+
+    connectivity_estimator = ConnectivityMeasure(
+        # Estimators fitted run after run (e.g., with a shared alpha grid) are set
+        # up from all the timeseries first
+        cov_estimator=prepare_estimator(estimator, time_series),
+        kind=connectivity_kind,
+        vectorize=True,
+        discard_diagonal=True,
+    )
+
+    for i, individual_time_serie in enumerate(time_series):
+        # The covariance estimator is only cloned by the first fit, such that it
+        # can carry state (e.g., a warm start) from one run to the next
+        if i == 0:
+            connectivity_measure = connectivity_estimator.fit_transform(
+                [individual_time_serie]
+            )
+        else:
+            connectivity_measure = connectivity_estimator.transform(
+                [individual_time_serie]
+            )
+        n_area = individual_time_serie.shape[-1]
+        fc_matrix = vec_to_sym_matrix(
+            connectivity_measure, diagonal=np.zeros((1, n_area))
+        )
+        yield fc_matrix[0]
+
+
+def compute_connectivity(
+    time_series: list[np.ndarray],
+    estimator: Optional[
+        Union[LedoitWolf, GraphicalLassoCV, SharedGraphicalLassoCV]
+    ] = None,
+    connectivity_kind: str = "correlation",
+) -> list[np.ndarray]:
     """Compute the functional connectivity using the specified estimator and
     connectivity kind.
 
@@ -508,9 +1412,9 @@ def compute_connectivity(
     ----------
     time_series : list[np.ndarray]
         List of timeseries
-    estimator : Union[LedoitWolf, GraphicalLassoCV], optional
+    estimator : Union[LedoitWolf, GraphicalLassoCV, SharedGraphicalLassoCV], optional
         Covariance estimator (usually from Scikit-Learn),
-        by default LedoitWolf(store_precision=False)
+        by default None (LedoitWolf(store_precision=False))
     connectivity_kind : str, optional
         Type of connectivity to compute, by default "correlation"
 
@@ -521,117 +1425,556 @@ def compute_connectivity(
     """
     if not len(time_series):
         return []
-    n_ts = len(time_series)
-    n_area = time_series[0].shape[-1]
     logging.info(
-        f"Computing functional connectivity matrices for {n_ts} timeseries ..."
+        f"Computing functional connectivity matrices for {len(time_series)} "
+        "timeseries ..."
     )
-
-    connectivity_estimator = ConnectivityMeasure(
-        cov_estimator=estimator,
-        kind=connectivity_kind,
-        vectorize=True,
-        discard_diagonal=True,
+    return np.stack(
+        list(
+            iter_connectivity(
+                time_series, estimator=estimator, connectivity_kind=connectivity_kind
+            )
+        )
     )
-    connectivity_measures = connectivity_estimator.fit_transform(time_series)
-    return vec_to_sym_matrix(connectivity_measures, diagonal=np.zeros((n_ts, n_area)))
 
 
-def main():
-    args = get_arguments()
+def get_report_tasks(
+    timeseries_filenames: list[str],
+    fc_filenames: list[str],
+    output: str,
+    confounds: Optional[list] = None,
+    timeseries_fills: dict = TIMESERIES_FILLS,
+    fc_fills: dict = FC_FILLS,
+    meas: str = "",
+    **kwargs,
+) -> list[tuple]:
+    """List the visual reports of saved timeseries and FC matrices.
 
-    input_path = args.data_dir
-    output = args.output
-    study_name = args.study_name
+    Parameters
+    ----------
+    timeseries_filenames : list[str]
+        BIDS functional filenames whose timeseries are saved
+    fc_filenames : list[str]
+        BIDS functional filenames whose FC matrices are saved
+    output : str
+        Path to the output directory
+    confounds : Optional[list], optional
+        Confounds of each timeseries, shown as design matrices, by default None
+    timeseries_fills : dict, optional
+        BIDS fills of the saved timeseries, by default TIMESERIES_FILLS
+    fc_fills : dict, optional
+        BIDS fills of the saved FC matrices, by default FC_FILLS
+    meas : str, optional
+        Label of the connectivity measure, by default ""
 
-    ses_filter = args.ses
-    task_filter = args.task
-    run_filter = args.run
-    overwrite = args.overwrite
+    Returns
+    -------
+    list[tuple]
+        Reporting functions with their arguments (see reports.render_reports).
+    """
+    from reports import visual_report_fc, visual_report_timeserie
 
-    # denoise_only = args.denoise_only
-    atlas_dimension = args.atlas_dimension
-    low_pass = args.low_pass
-    denoising_strategy = args.denoising_strategy
-    motion = args.motion
-    fd_threshold = args.FD_thresh
-    std_dvars_threshold = args.SDVARS_thresh
-    scrub = args.n_scrub_frames
-    fc_estimator = args.fc_estimator
-    interpolate = args.no_censor
+    if confounds is None:
+        confounds = [None] * len(timeseries_filenames)
 
-    verbosity_level = args.verbosity
-    nilearn_verbose = verbosity_level - 1
+    report_tasks = []
+    for filename, individual_confounds in zip(timeseries_filenames, confounds):
+        timeseries_path = get_bids_savename(
+            filename, patterns=TIMESERIES_PATTERN, **timeseries_fills
+        )
+        report_tasks.append(
+            (
+                visual_report_timeserie,
+                {
+                    "timeseries": op.join(output, timeseries_path),
+                    "filename": filename,
+                    "output": output,
+                    "confounds": individual_confounds,
+                    "labels": kwargs.get("labels"),
+                    "networks": kwargs.get("networks"),
+                },
+            )
+        )
 
-    logging_level_map = {
-        0: logging.WARN,
-        1: logging.INFO,
-        2: logging.INFO,
-        3: logging.DEBUG,
-    }
+    for filename in fc_filenames:
+        fc_path = get_bids_savename(
+            filename, patterns=FC_PATTERN, meas=meas, **fc_fills
+        )
+        report_tasks.append(
+            (
+                visual_report_fc,
+                {
+                    "matrix": op.join(output, fc_path),
+                    "filename": filename,
+                    "output": output,
+                    "labels": kwargs.get("labels"),
+                    "meas": meas,
+                },
+            )
+        )
 
-    logging.basicConfig(
-        # filename='example.log',
-        # format='%(asctime)s %(levelname)s:%(message)s',
-        format="%(levelname)s: %(message)s",
-        level=logging_level_map[min([verbosity_level, 3])],
-    )
+    return report_tasks
 
-    logging.captureWarnings(True)
 
-    func_filenames, t_r_list = get_func_filenames_bids(
-        input_path,
-        task_filter=task_filter,
-        ses_filter=ses_filter,
-        run_filter=run_filter,
+def find_missing_outputs(
+    func_filenames: list[str],
+    output: str,
+    timeseries_keys: dict,
+    fc_keys: dict,
+    timeseries_fills: dict = TIMESERIES_FILLS,
+    fc_fills: dict = FC_FILLS,
+    meas: str = "",
+    output_index: Optional[set] = None,
+) -> tuple[list[str], list[str]]:
+    """Find the runs missing their timeseries, and those only missing their FC matrix.
+
+    Parameters
+    ----------
+    func_filenames : list[str]
+        BIDS functional filenames
+    output : str
+        Path to the output directory
+    timeseries_keys : dict
+        Expected cache key of the timeseries of each run
+    fc_keys : dict
+        Expected cache key of the FC matrix of each run
+    timeseries_fills : dict, optional
+        BIDS fills of the saved timeseries, by default TIMESERIES_FILLS
+    fc_fills : dict, optional
+        BIDS fills of the saved FC matrices, by default FC_FILLS
+    meas : str, optional
+        Label of the connectivity measure, by default ""
+    output_index : Optional[set], optional
+        Files of the output directory (see load_save.index_output), by default None
+
+    Returns
+    -------
+    tuple[list[str], list[str]]
+        Runs missing their timeseries, and runs with timeseries but no FC matrix.
+    """
+    logging.debug("Looking for existing timeseries ...")
+    missing_ts, existing_ts = check_existing_output(
+        output,
+        func_filenames,
+        return_existing=True,
+        cache_keys=timeseries_keys,
+        output_index=output_index,
+        patterns=TIMESERIES_PATTERN,
+        **timeseries_fills,
     )
-    all_filenames = list(chain.from_iterable(func_filenames))
-    logging.info(f"Found {len(all_filenames)} functional file(s):")
-    logging.info(
-        "\t" + "\n\t".join([op.basename(filename) for filename in all_filenames])
+
+    logging.info(f"{len(missing_ts)} files are missing timeseries.")
+    logging.debug("Looking for existing fc matrices ...")
+    missing_only_fc = check_existing_output(
+        output,
+        existing_ts,
+        cache_keys=fc_keys,
+        output_index=output_index,
+        patterns=FC_PATTERN,
+        meas=meas,
+        **fc_fills,
     )
+    logging.info(f"{len(missing_ts + missing_only_fc)} files are missing FC matrices.")
+    return missing_ts, missing_only_fc
+
+
+def get_work_plan(
+    func_filenames: list[list[str]],
+    t_r_list: list[float],
+    missing_ts: list[str],
+    missing_only_fc: list[str],
+    output: str,
+    n_regions: int,
+    headers: Optional[dict] = None,
+    n_procs: int = 1,
+    mem_gb: Optional[float] = None,
+    engine: str = "masker",
+    engine_kwargs: Optional[dict] = None,
+) -> str:
+    """Describe the work of a run of the pipeline, without doing it (--dry-run).
 
-    atlas_data = get_atlas_data(dimension=atlas_dimension)
-    atlas_filename = getattr(atlas_data, "maps")
-    atlas_labels = getattr(atlas_data, "labels").loc[:, "difumo_names"]
-    atlas_network = getattr(atlas_data, "labels").loc[:, NETWORK_MAPPING]
+    Parameters
+    ----------
+    func_filenames : list[list[str]]
+        Groups of BIDS functional filenames sharing FoV and TR
+    t_r_list : list[float]
+        Repetition time of each group
+    missing_ts : list[str]
+        Runs whose timeseries are to be extracted
+    missing_only_fc : list[str]
+        Runs whose timeseries are saved but not their FC matrix
+    output : str
+        Path to the output directory
+    n_regions : int
+        Number of regions of the atlas
+    headers : Optional[dict], optional
+        NIfTI header of each run (see bids_index.scan_headers), by default None
+        (the shapes are read from the files)
+    n_procs : int, optional
+        Maximum number of workers, by default 1
+    mem_gb : Optional[float], optional
+        Memory budget shared by the workers (in GB), by default None (no limit)
+    engine : str, optional
+        Extraction engine, either "masker" or "chunked", by default "masker"
+    engine_kwargs : Optional[dict], optional
+        Options of the extraction engine (see fit_transform_patched), by default None
+
+    Returns
+    -------
+    str
+        Work plan, with the status and estimated memory of each run per FoV/TR group.
+    """
+    headers = headers or {}
+    missing_ts, missing_only_fc = set(missing_ts), set(missing_only_fc)
+    n_runs = sum(len(file_group) for file_group in func_filenames)
+
+    lines = [f"Work plan of {n_runs} run(s), saved in {output}"]
+    run_mem_gb = []
+    for i, (file_group, t_r) in enumerate(zip(func_filenames, t_r_list)):
+        n_missing_ts = len(missing_ts.intersection(file_group))
+        n_missing_fc = len(missing_only_fc.intersection(file_group))
+        lines.append(
+            f"FoV/TR group {i + 1} (TR = {t_r} s): {len(file_group)} run(s), "
+            f"{n_missing_ts} to extract, {n_missing_fc} missing only their FC "
+            f"matrix, {len(file_group) - n_missing_ts - n_missing_fc} up to date"
+        )
+        for filename in file_group:
+            if filename in missing_ts:
+                shape = headers.get(filename, {}).get("shape")
+                run_mem_gb.append(
+                    estimate_run_mem_gb(
+                        filename, n_regions, engine, engine_kwargs, shape=shape
+                    )
+                )
+                status = f"extract (~{run_mem_gb[-1]:.2f} GB)"
+            elif filename in missing_only_fc:
+                status = "FC only"
+            else:
+                status = "up to date"
+            lines.append(f"\t{op.basename(filename)}: {status}")
+
+    if run_mem_gb:
+        n_workers = get_n_workers(run_mem_gb, n_procs=n_procs, mem_gb=mem_gb)
+        lines.append(
+            f"{len(run_mem_gb)} run(s) to extract with {n_workers} worker(s), "
+            f"estimated peak memory of {n_workers * max(run_mem_gb):.2f} GB"
+        )
+    lines.append(f"{len(missing_ts) + len(missing_only_fc)} FC matrices to estimate")
+    return "\n".join(lines)
+
+
+def get_denoising_configurations(filename: Optional[str], defaults: dict) -> list[dict]:
+    """Read the denoising configurations fanned out on the extracted timeseries.
+
+    Parameters
+    ----------
+    filename : Optional[str]
+        Path to a JSON file listing the configurations, each an object overriding
+        some of the denoising options (see DENOISING_OPTIONS) with an optional
+        "name". If None, the single configuration given by the defaults is returned.
+    defaults : dict
+        Value of each denoising option given on the command line
 
-    if output is None:
-        run_name = f"DiFuMo{atlas_dimension:d}"
-        if study_name:
-            run_name = "-".join([study_name, run_name])
+    Returns
+    -------
+    list[dict]
+        Configurations, with a value for "name" and for each denoising option.
+    """
+    if filename is None:
+        return [{"name": "", **defaults}]
+
+    with open(filename) as f:
+        entries = json.load(f)
+
+    configurations = []
+    for i, entry in enumerate(entries):
+        unknown = set(entry).difference(DENOISING_OPTIONS, ["name"])
+        if unknown:
+            raise ValueError(
+                f"Configuration {i + 1} of {filename} has unknown denoising "
+                f"option(s): {', '.join(sorted(unknown))}"
+            )
+        configuration = {**defaults, "name": f"config{i + 1}", **entry}
+        configuration["denoising_strategy"] = tuple(configuration["denoising_strategy"])
+        configurations.append(configuration)
+
+    names = [configuration["name"] for configuration in configurations]
+    if len(set(names)) != len(names):
+        raise ValueError(
+            f"The names of the configurations in {filename} must be unique"
+        )
+    return configurations
 
-        run_name += (low_pass is not None) * "-LP"
-        run_name += (interpolate) * "-noCensoring"
 
-        output = op.join(
-            find_derivative(input_path), "functional_connectivity", run_name
+def get_output_dir(
+    input_path: str,
+    atlas_dimension: int,
+    configuration: dict,
+    output: Optional[str] = None,
+    study_name: str = "",
+    atlas_subfolder: bool = False,
+) -> str:
+    """Return the derivatives folder of an atlas and a denoising configuration.
+
+    Parameters
+    ----------
+    input_path : str
+        BIDS dataset or derivatives with data
+    atlas_dimension : int
+        Dimension of the atlas
+    configuration : dict
+        Denoising configuration (see get_denoising_configurations)
+    output : Optional[str], optional
+        Alternative output directory, by default None. Named configurations are
+        saved in a subfolder of it.
+    study_name : str, optional
+        Name of the study, by default ""
+    atlas_subfolder : bool, optional
+        Save in a subfolder of the alternative output directory named after the atlas
+        (when several atlases are extracted), by default False
+
+    Returns
+    -------
+    str
+        Path to the output directory.
+    """
+    if output is not None and atlas_subfolder:
+        output = op.join(output, f"DiFuMo{atlas_dimension:d}")
+    if output is not None and configuration["name"]:
+        return op.join(output, configuration["name"])
+    if output is not None:
+        return output
+
+    run_name = "-".join(
+        part
+        for part in [study_name, f"DiFuMo{atlas_dimension:d}", configuration["name"]]
+        if part
+    )
+    run_name += (configuration["low_pass"] is not None) * "-LP"
+    run_name += (configuration["no_censor"]) * "-noCensoring"
+
+    return op.join(find_derivative(input_path), "functional_connectivity", run_name)
+
+
+def run_configuration(
+    args: argparse.Namespace,
+    configuration: dict,
+    func_filenames: list[list[str]],
+    t_r_list: list[float],
+    output: str,
+    atlas_dimension: int,
+    atlas_data=None,
+    other_atlases: Optional[list[tuple[str, str]]] = None,
+    cache_signals: bool = True,
+) -> None:
+    """Compute (or plan, with --dry-run) the outputs of one atlas and one denoising
+    configuration.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Options of the command line (see get_arguments)
+    configuration : dict
+        Denoising configuration (see get_denoising_configurations)
+    func_filenames : list[list[str]]
+        Groups of BIDS functional filenames sharing FoV and TR
+    t_r_list : list[float]
+        Repetition time of each group
+    output : str
+        Path to the output directory
+    atlas_dimension : int
+        Dimension of the DiFuMo atlas
+    atlas_data : optional
+        Atlas maps and labels (see load_save.get_atlas_data), by default None
+        (only with --dry-run)
+    other_atlases : Optional[list[tuple[str, str]]], optional
+        Name and maps filename of the other atlases, extracted in the same pass over
+        the functional images (see extract_raw_timeseries), by default None
+    cache_signals : bool, optional
+        Whether the raw signals of the atlas are written to the cache, to be read
+        back by the other denoising configurations, by default True
+    """
+    input_path = args.data_dir
+    overwrite = args.overwrite
+
+    low_pass = configuration["low_pass"]
+    denoising_strategy = configuration["denoising_strategy"]
+    motion = configuration["motion"]
+    fd_threshold = configuration["FD_thresh"]
+    std_dvars_threshold = configuration["SDVARS_thresh"]
+    scrub = configuration["n_scrub_frames"]
+    interpolate = configuration["no_censor"]
+    # Shared by every call loading the confounds, so that they hit the same cache
+    confound_parameters = {
+        "denoising_strategy": denoising_strategy,
+        "motion": motion,
+        "fd_threshold": fd_threshold,
+        "std_dvars_threshold": std_dvars_threshold,
+        "scrub": scrub,
+    }
+    fc_estimator = args.fc_estimator
+    extraction_engine = args.extraction_engine
+    n_procs = args.n_procs
+    reports_mode = args.reports
+    storage = args.storage
+    storage_dtype = args.storage_dtype
+    timeseries_fills = get_storage_fills(TIMESERIES_FILLS, storage)
+    fc_fills = get_storage_fills(FC_FILLS, storage)
+    mem_gb = args.mem_gb
+    engine_kwargs = {
+        "mem_gb": args.extraction_mem_gb,
+        "atlas_name": f"DiFuMo{atlas_dimension:d}",
+        "cache_dir": args.cache_dir,
+        "cache_max_gb": args.cache_max_gb,
+        "sparse_threshold": args.projection_threshold,
+    }
+    if engine_kwargs["sparse_threshold"] is not None and extraction_engine != "chunked":
+        logging.warning(
+            "The atlas maps are only pruned by the 'chunked' extraction engine, "
+            "--projection-threshold is ignored."
         )
+        engine_kwargs["sparse_threshold"] = None
+    nilearn_verbose = args.verbosity - 1
+
+    all_filenames = list(chain.from_iterable(func_filenames))
     logging.info(f"Output will be save as derivatives in:\n\t{output}")
 
-    covar_estimator, fc_kind, fc_label = get_fc_strategy(fc_estimator)
+    fc_kind, fc_label = get_fc_kind(fc_estimator)
     logging.info(f"'{fc_label}' has been selected as connectivity metric")
 
-    # By default, the timeseries and FC of all filenames in input will be computed
-    if not overwrite:
-        logging.debug("Looking for existing timeseries ...")
-        all_missing_ts, all_existing_ts = check_existing_output(
+    # Outputs are only reused if they were computed from the same inputs with the
+    # same parameters (the extraction engines give the same timeseries)
+    timeseries_parameters = {
+        "atlas": f"DiFuMo{atlas_dimension:d}",
+        "low_pass": low_pass,
+        "denoising_strategy": list(denoising_strategy),
+        "motion": motion,
+        "fd_threshold": fd_threshold,
+        "std_dvars_threshold": std_dvars_threshold,
+        "n_scrub_frames": scrub,
+        "no_censor": interpolate,
+        "dtype": storage_dtype,
+    }
+    if engine_kwargs["sparse_threshold"] is not None:
+        # Pruning the maps approximates the timeseries
+        timeseries_parameters["projection_threshold"] = engine_kwargs[
+            "sparse_threshold"
+        ]
+    fc_parameters = {**timeseries_parameters, "fc_estimator": fc_label}
+    if fc_kind != "correlation":
+        fc_parameters["sparse_mode"] = args.sparse_mode
+    timeseries_keys = {
+        filename: get_output_key(filename, timeseries_parameters)
+        for filename in all_filenames
+    }
+    fc_keys = {
+        filename: hash_key(timeseries_keys[filename], sorted(fc_parameters.items()))
+        for filename in all_filenames
+    }
+    # The output directory is walked once for all the existence checks
+    output_index = index_output(output)
+
+    if args.dry_run:
+        if not overwrite:
+            all_missing_ts, missing_only_fc = find_missing_outputs(
+                all_filenames,
+                output,
+                timeseries_keys,
+                fc_keys,
+                timeseries_fills=timeseries_fills,
+                fc_fills=fc_fills,
+                meas=fc_label,
+                output_index=output_index,
+            )
+        else:
+            all_missing_ts, missing_only_fc = all_filenames.copy(), []
+        headers = scan_headers(
+            all_filenames, base_dir=get_bids_index_dir(input_path), n_jobs=n_procs
+        )
+        print(
+            get_work_plan(
+                func_filenames,
+                t_r_list,
+                all_missing_ts,
+                missing_only_fc,
+                output,
+                n_regions=atlas_dimension,
+                headers=headers,
+                n_procs=n_procs,
+                mem_gb=mem_gb,
+                engine=extraction_engine,
+                engine_kwargs=engine_kwargs,
+            )
+        )
+        return
+
+    atlas_filename = getattr(atlas_data, "maps")
+    atlas_labels = getattr(atlas_data, "labels").loc[:, "difumo_names"]
+    atlas_network = getattr(atlas_data, "labels").loc[:, NETWORK_MAPPING]
+
+    if args.reports_only:
+        from reports import render_reports
+
+        logging.info("Rendering the visual reports of existing outputs ...")
+        _, existing_ts = check_existing_output(
             output,
             all_filenames,
             return_existing=True,
+            cache_keys=timeseries_keys,
+            output_index=output_index,
             patterns=TIMESERIES_PATTERN,
-            **TIMESERIES_FILLS,
+            **timeseries_fills,
         )
-
-        logging.info(f"{len(all_missing_ts)} files are missing timeseries.")
-        logging.debug("Looking for existing fc matrices ...")
-        missing_only_fc = check_existing_output(
-            output, all_existing_ts, patterns=FC_PATTERN, meas=fc_label, **FC_FILLS
+        _, existing_fc = check_existing_output(
+            output,
+            all_filenames,
+            return_existing=True,
+            cache_keys=fc_keys,
+            output_index=output_index,
+            patterns=FC_PATTERN,
+            meas=fc_label,
+            **fc_fills,
         )
-        logging.info(
-            f"{len(all_missing_ts + missing_only_fc)} files are missing FC matrices."
+        existing_confounds = None
+        if len(existing_ts):
+            existing_confounds, _ = load_run_confounds(
+                existing_ts,
+                n_jobs=n_procs,
+                cache_dir=args.cache_dir,
+                cache_max_gb=args.cache_max_gb,
+                **confound_parameters,
+            )
+        report_tasks = get_report_tasks(
+            existing_ts,
+            existing_fc,
+            output,
+            confounds=existing_confounds,
+            timeseries_fills=timeseries_fills,
+            fc_fills=fc_fills,
+            meas=fc_label,
+            labels=atlas_labels,
+            networks=atlas_network,
+        )
+        render_reports(report_tasks, mode=reports_mode, n_jobs=n_procs, mem_gb=mem_gb)
+        return
+
+    covar_estimator, _, _ = get_fc_strategy(
+        fc_estimator, sparse_mode=args.sparse_mode, n_jobs=n_procs
+    )
+
+    # By default, the timeseries and FC of all filenames in input will be computed
+    if not overwrite:
+        all_missing_ts, missing_only_fc = find_missing_outputs(
+            all_filenames,
+            output,
+            timeseries_keys,
+            fc_keys,
+            timeseries_fills=timeseries_fills,
+            fc_fills=fc_fills,
+            meas=fc_label,
+            output_index=output_index,
         )
-        existing_timeseries = load_timeseries(missing_only_fc, output)
+        existing_timeseries = load_timeseries(missing_only_fc, output, storage=storage)
     else:
         missing_only_fc = []
         existing_timeseries = []
@@ -644,29 +1987,34 @@ def main():
     sorted_missing_ts = list(chain.from_iterable(separated_missing_ts))
     missing_something = sorted_missing_ts + missing_only_fc
 
-    time_series = []
-    all_confounds = []
-    all_sample_masks = []
-    for filenames_to_ts, t_r in zip(separated_missing_ts, t_r_list):
-        ts, conf, mask = extract_and_denoise_timeseries(
-            filenames_to_ts,
-            atlas_filename,
-            verbose=nilearn_verbose,
-            t_r=t_r,
-            low_pass=low_pass,
-            denoising_strategy=denoising_strategy,
-            motion=motion,
-            fd_threshold=fd_threshold,
-            std_dvars_threshold=std_dvars_threshold,
-            scrub=scrub,
-            interpolate=interpolate,
-            output=output,
-        )
-        time_series += ts
-        all_confounds += conf
-        all_sample_masks += mask
+    missing_t_rs = [
+        t_r
+        for file_group, t_r in zip(separated_missing_ts, t_r_list)
+        for _ in file_group
+    ]
+
+    # Visual reports are rendered once everything is computed and saved
+    report_tasks = []
+
+    time_series, all_confounds, all_sample_masks = extract_and_denoise_groups(
+        separated_missing_ts,
+        t_r_list,
+        atlas_filename,
+        n_procs=n_procs,
+        mem_gb=mem_gb,
+        engine=extraction_engine,
+        engine_kwargs=engine_kwargs,
+        other_atlases=other_atlases,
+        cache_signals=cache_signals,
+        verbose=nilearn_verbose,
+        low_pass=low_pass,
+        confound_parameters=confound_parameters,
+        interpolate=interpolate,
+        output=output,
+        report_tasks=report_tasks,
+    )
 
-    # Saving aggregated/denoised timeseries and visual reports
+    # Saving aggregated/denoised timeseries
     if len(time_series):
         logging.info("Saving denoised timeseries ...")
         os.makedirs(output, exist_ok=True)
@@ -674,31 +2022,16 @@ def main():
             time_series,
             sorted_missing_ts,
             output,
+            cache_keys=timeseries_keys,
+            parameters=timeseries_parameters,
+            dtype=storage_dtype,
             patterns=TIMESERIES_PATTERN,
-            **TIMESERIES_FILLS,
+            **timeseries_fills,
         )
 
-        for individual_time_serie, confounds, filename in zip(
-            time_series, all_confounds, sorted_missing_ts
-        ):
-            visual_report_timeserie(
-                individual_time_serie,
-                filename=filename,
-                output=output,
-                confounds=confounds,
-                labels=atlas_labels,
-                networks=atlas_network,
-            )
-
-    fc_matrices = compute_connectivity(
-        time_series + existing_timeseries,
-        estimator=covar_estimator,
-        connectivity_kind=fc_kind,
-    )
-
     # Compute duration of fMRI scans after censoring
     fMRI_duration_after_censoring = {}
-    for filename, mask in zip(all_filenames, all_sample_masks):
+    for filename, mask, t_r in zip(sorted_missing_ts, all_sample_masks, missing_t_rs):
         fMRI_duration_after_censoring[op.basename(filename)] = mask.shape[0] * t_r
         # mask.shape[0] indicates the number of volumes that are not censored
     with open(
@@ -710,27 +2043,46 @@ def main():
         for key, value in fMRI_duration_after_censoring.items():
             writer.writerow([key, value])
 
-    # Saving FC matrices and visual reports
-    if len(fc_matrices):
-        logging.info("Saving connectivity matrices ...")
+    # Each FC matrix is estimated and saved on its own, such that the computed
+    # matrices are kept even if a later run fails
+    if len(missing_something):
+        logging.info(
+            f"Computing functional connectivity matrices for "
+            f"{len(missing_something)} timeseries ..."
+        )
+    fc_matrices = iter_connectivity(
+        time_series + existing_timeseries,
+        estimator=covar_estimator,
+        connectivity_kind=fc_kind,
+    )
+    for individual_matrix, filename in zip(fc_matrices, missing_something):
+        logging.debug(f"Saving connectivity matrix of {op.basename(filename)}")
         save_output(
-            fc_matrices,
-            missing_something,
+            [individual_matrix],
+            [filename],
             output,
+            cache_keys=fc_keys,
+            parameters=fc_parameters,
+            dtype=storage_dtype,
             patterns=FC_PATTERN,
             meas=fc_label,
-            **FC_FILLS,
+            **fc_fills,
         )
 
-        # Generate session-specific figures
-        for individual_matrix, filename in zip(fc_matrices, missing_something):
-            visual_report_fc(
-                individual_matrix,
-                filename=filename,
-                output=output,
-                labels=atlas_labels,
-                meas=fc_label,
-            )
+    from reports import render_reports
+
+    report_tasks += get_report_tasks(
+        sorted_missing_ts,
+        missing_something,
+        output,
+        confounds=all_confounds,
+        timeseries_fills=timeseries_fills,
+        fc_fills=fc_fills,
+        meas=fc_label,
+        labels=atlas_labels,
+        networks=atlas_network,
+    )
+    render_reports(report_tasks, mode=reports_mode, n_jobs=n_procs, mem_gb=mem_gb)
 
     logging.info(
         f"Computation is done for {len(missing_something)} files out of the "
@@ -742,5 +2094,101 @@ def main():
     logging.info("Functional connectivity finished successfully !")
 
 
+def main():
+    args = get_arguments()
+
+    input_path = args.data_dir
+    ses_filter = args.ses
+    task_filter = args.task
+    run_filter = args.run
+    n_procs = args.n_procs
+
+    verbosity_level = args.verbosity
+
+    logging_level_map = {
+        0: logging.WARN,
+        1: logging.INFO,
+        2: logging.INFO,
+        3: logging.DEBUG,
+    }
+
+    logging.basicConfig(
+        # filename='example.log',
+        # format='%(asctime)s %(levelname)s:%(message)s',
+        format="%(levelname)s: %(message)s",
+        level=logging_level_map[min([verbosity_level, 3])],
+    )
+
+    logging.captureWarnings(True)
+
+    func_filenames, t_r_list = get_func_filenames_bids(
+        input_path,
+        task_filter=task_filter,
+        ses_filter=ses_filter,
+        run_filter=run_filter,
+        reindex=args.reindex,
+        n_jobs=n_procs,
+    )
+    all_filenames = list(chain.from_iterable(func_filenames))
+    logging.info(f"Found {len(all_filenames)} functional file(s):")
+    logging.info(
+        "\t" + "\n\t".join([op.basename(filename) for filename in all_filenames])
+    )
+
+    defaults = {key: getattr(args, key) for key in DENOISING_OPTIONS}
+    configurations = get_denoising_configurations(args.denoising_configs, defaults)
+
+    atlas_dimensions = list(dict.fromkeys(args.atlas_dimension))
+    if len(atlas_dimensions) > 1 and args.extraction_engine != "chunked":
+        logging.warning(
+            "Several atlas dimensions are extracted together by projecting chunks of "
+            f"volumes, the '{args.extraction_engine}' extraction engine is replaced "
+            "by the 'chunked' engine."
+        )
+        args.extraction_engine = "chunked"
+    atlases = {}
+    if not args.dry_run:
+        atlases = {
+            dimension: get_atlas_data(dimension=dimension, cache_dir=args.cache_dir)
+            for dimension in atlas_dimensions
+        }
+
+    # The raw timeseries of all the atlases are extracted in a single pass over the
+    # functional images with the first atlas and configuration, and read back from
+    # the cache by the following ones. The signals of an atlas are only cached for
+    # the other configurations, the other atlases always cache theirs.
+    for atlas_dimension in atlas_dimensions:
+        other_atlases = [
+            (f"DiFuMo{dimension:d}", atlas.maps)
+            for dimension, atlas in atlases.items()
+            if dimension != atlas_dimension
+        ]
+        for configuration in configurations:
+            if configuration["name"]:
+                logging.info(f"Denoising configuration '{configuration['name']}' ...")
+            output = get_output_dir(
+                input_path,
+                atlas_dimension,
+                configuration,
+                output=args.output,
+                study_name=args.study_name,
+                atlas_subfolder=len(atlas_dimensions) > 1,
+            )
+            run_configuration(
+                args,
+                configuration,
+                func_filenames,
+                t_r_list,
+                output,
+                atlas_dimension,
+                atlas_data=atlases.get(atlas_dimension),
+                other_atlases=other_atlases,
+                cache_signals=len(configurations) > 1,
+            )
+
+    if not args.dry_run:
+        evict_cache(get_cache_dir(args.cache_dir, "signals"), max_gb=args.cache_max_gb)
+
+
 if __name__ == "__main__":
     main()
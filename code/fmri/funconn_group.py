@@ -24,27 +24,25 @@
 import argparse
 import logging
 
-import numpy as np
 import os.path as op
-import pandas as pd
 
 
 from itertools import chain
-from funconn import FC_FILLS, FC_PATTERN
 
 from load_save import (
+    FC_FILLS,
+    FC_PATTERN,
     get_atlas_data,
     find_atlas_dimension,
     find_derivative,
     check_existing_output,
     get_bids_savename,
     get_func_filenames_bids,
+    get_storage_fills,
     load_iqms,
+    STORAGE_EXTENSIONS,
 )
-
-from reports import (
-    group_report,
-)
+from options import GROUP_REPORTLET_NAMES
 
 
 def get_arguments() -> argparse.Namespace:
@@ -78,6 +76,49 @@ def get_arguments() -> argparse.Namespace:
         help="""type of connectivity to compute (can be 'correlation', 'covariance' or
         'sparse')""",
     )
+    parser.add_argument(
+        "--storage",
+        default="tsv",
+        action="store",
+        choices=list(STORAGE_EXTENSIONS),
+        help="file format of the functional connectivity matrices",
+    )
+    parser.add_argument(
+        "--n-procs",
+        default=8,
+        action="store",
+        type=int,
+        help="""maximum number of processes rendering the reportlets and of threads
+        computing the QC-FC null distributions""",
+    )
+    parser.add_argument(
+        "--only",
+        default=None,
+        action="store",
+        nargs="+",
+        choices=GROUP_REPORTLET_NAMES,
+        help="""render only these reportlets, even if their inputs did not change
+        (by default, the reportlets whose inputs changed are rendered)""",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        action="store",
+        help="""directory caching the indexed IQMs (defaults to $HCPH_FUNCONN_CACHE or
+        ~/.cache/hcph-funconn)""",
+    )
+    parser.add_argument(
+        "--reindex",
+        default=False,
+        action="store_true",
+        help="rebuild the index of the BIDS files from scratch",
+    )
+    parser.add_argument(
+        "--dry-run",
+        default=False,
+        action="store_true",
+        help="print the functional connectivity matrices found for the report and exit",
+    )
     parser.add_argument(
         "-v",
         "--verbosity",
@@ -98,6 +139,7 @@ def main():
     task_filter = args.task
     mriqc_path = args.mriqc_path
     fc_label = args.fc_estimator.replace(" ", "")
+    fc_fills = get_storage_fills(FC_FILLS, args.storage)
 
     verbosity_level = args.verbosity
 
@@ -119,12 +161,12 @@ def main():
 
     # Find the atlas dimension from the output path
     atlas_dimension = find_atlas_dimension(output)
-    atlas_data = get_atlas_data(dimension=atlas_dimension)
-    atlas_filename = getattr(atlas_data, "maps")
 
     # Find all existing functional connectivity
     input_path = find_derivative(output)
-    func_filenames, _ = get_func_filenames_bids(input_path, task_filter=task_filter)
+    func_filenames, _ = get_func_filenames_bids(
+        input_path, task_filter=task_filter, reindex=args.reindex
+    )
     all_filenames = list(chain.from_iterable(func_filenames))
 
     existing_fc = check_existing_output(
@@ -134,39 +176,48 @@ def main():
         return_output=True,
         patterns=FC_PATTERN,
         meas=fc_label,
-        **FC_FILLS,
+        **fc_fills,
     )
     if not existing_fc:
         filename = op.join(
             output,
             get_bids_savename(
-                all_filenames[0], patterns=FC_PATTERN, meas=fc_label, **FC_FILLS
+                all_filenames[0], patterns=FC_PATTERN, meas=fc_label, **fc_fills
             ),
         )
         raise ValueError(
             f"No functional connectivity of type {filename} were found. Please revise the arguments."
         )
 
-    # Load functional connectivity matrices
-    fc_matrices = []
-    for file_path in existing_fc:
-        fc_matrices.append(np.loadtxt(file_path, delimiter="\t"))
+    if args.dry_run:
+        print(
+            f"Group report of {len(existing_fc)} functional connectivity matrices "
+            f"out of {len(all_filenames)} run(s), with the DiFuMo{atlas_dimension} "
+            f"atlas, saved in {output}"
+        )
+        print("\t" + "\n\t".join(op.basename(path) for path in existing_fc))
+        return
 
-    # Load fMRI duration after censoring
-    good_timepoints_df = pd.read_csv(
-        op.join(output, "fMRI_duration_after_censoring.csv")
-    )
+    # The plotting libraries are only imported once the report is to be generated
+    from reports import group_report
+
+    atlas_data = get_atlas_data(dimension=atlas_dimension, cache_dir=args.cache_dir)
+    atlas_filename = getattr(atlas_data, "maps")
 
     # Load IQMs
-    iqms_df = load_iqms(output, existing_fc, mriqc_path=mriqc_path)
+    iqms_df = load_iqms(
+        output, existing_fc, mriqc_path=mriqc_path, cache_dir=args.cache_dir
+    )
 
-    # Generate group figures
+    # Generate group figures, only rendering the reportlets whose inputs changed
     group_report(
-        good_timepoints_df,
-        fc_matrices,
+        existing_fc,
         iqms_df,
         atlas_filename,
         output,
+        durations_filename=op.join(output, "fMRI_duration_after_censoring.csv"),
+        n_jobs=args.n_procs,
+        only=args.only,
     )
 
 
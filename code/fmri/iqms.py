@@ -0,0 +1,267 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2023 The Axon Lab <theaxonlab@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Python module for an indexed store of the MRIQC image quality metrics (IQMs).
+
+The group table of MRIQC is converted once (per MRIQC version and table content)
+into a columnar NPZ file in the on-disk cache, with the BIDS entities of each row.
+The rows are then looked up by their (subject, session, task, run, echo) key, and
+only the requested IQM columns are read.
+"""
+
+import json
+import logging
+import os
+import os.path as op
+from collections import defaultdict
+from typing import Optional
+from uuid import uuid4
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+from caching import file_fingerprint, get_cache_dir, hash_key
+
+IQMS_KEYS: tuple = ("subject", "session", "task", "run", "echo")
+# Entity labels of the MRIQC "bids_name" column
+BIDS_NAME_ENTITIES: dict = {
+    "subject": "sub",
+    "session": "ses",
+    "task": "task",
+    "run": "run",
+    "echo": "echo",
+}
+STORE_VERSION: int = 1
+
+
+def _normalize_key(value) -> str:
+    """Return the string value of an entity (runs and echos without zero-padding,
+    and "" when missing)."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ""
+    value = str(value)
+    return str(int(value)) if value.isdigit() else value
+
+
+def get_mriqc_version(mriqc_path: str) -> Optional[str]:
+    """Read the version of MRIQC from the dataset description of its derivatives."""
+    try:
+        with open(op.join(mriqc_path, "dataset_description.json")) as f:
+            generated_by = json.load(f).get("GeneratedBy", [{}])
+        return generated_by[0].get("Version")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class IQMStore:
+    """IQMs of a MRIQC group table, indexed by the BIDS entities of each row.
+
+    Parameters
+    ----------
+    columns : dict
+        Arrays of the columns of the table (possibly lazily loaded, see load)
+    keys : list[tuple]
+        Key of each row, with the entities of IQMS_KEYS
+    """
+
+    def __init__(self, columns: dict, keys: list[tuple]):
+        self.columns = columns
+        self.keys = keys
+        self.index = defaultdict(list)
+        # Rows sharing subject, session and task, for the lookups of files without run
+        # or echo entities
+        self.partial_index = defaultdict(list)
+        for row, key in enumerate(keys):
+            self.index[key].append(row)
+            self.partial_index[key[:3]].append(row)
+
+    @classmethod
+    def from_dataframe(cls, iqms_df: pd.DataFrame) -> "IQMStore":
+        """Index the IQMs of a MRIQC group table."""
+        keys = pd.DataFrame(
+            {
+                name: iqms_df["bids_name"].str.extract(
+                    rf"(?:^|_){label}-([a-zA-Z0-9]+)", expand=False
+                )
+                for name, label in BIDS_NAME_ENTITIES.items()
+            }
+        )
+        keys = [
+            tuple(_normalize_key(value) for value in row)
+            for row in keys.itertuples(index=False)
+        ]
+        columns = {name: iqms_df[name].to_numpy() for name in iqms_df.columns}
+        return cls(columns, keys)
+
+    @classmethod
+    def load(cls, path: str) -> "IQMStore":
+        """Load a store saved with save, reading the IQM columns only when needed."""
+        with np.load(path, allow_pickle=False) as entry:
+            if int(entry["version"]) != STORE_VERSION:
+                raise ValueError(f"Outdated IQM store {path}")
+            keys = [tuple(key) for key in entry["keys"].tolist()]
+            names = entry["columns"].tolist()
+        return cls(_LazyColumns(path, names), keys)
+
+    def save(self, path: str) -> None:
+        """Save the store as one array per column in a NPZ file."""
+        arrays = {
+            f"column_{i}": (
+                np.asarray(values)
+                if is_numeric_dtype(values.dtype)
+                else np.asarray(values, dtype=str)
+            )
+            for i, values in enumerate(self.columns[name] for name in self.columns)
+        }
+        # Write to a temporary file first so that concurrent jobs never read a
+        # partially written store
+        tmp_path = op.join(op.dirname(path), f".tmp-{uuid4()}.npz")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                version=STORE_VERSION,
+                keys=np.array(self.keys, dtype=str).reshape(-1, len(IQMS_KEYS)),
+                columns=np.array(list(self.columns), dtype=str),
+                **arrays,
+            )
+        os.replace(tmp_path, path)
+
+    @property
+    def multi_echo(self) -> bool:
+        """Whether the table holds the IQMs of several echos."""
+        return any(key[4] for key in self.keys)
+
+    def find_rows(self, entities: dict, echo: Optional[str] = None) -> list[int]:
+        """Return the rows matching the entities of a file (all the runs or echos
+        when the file has none, unless an echo is selected)."""
+        key = tuple(_normalize_key(entities.get(name)) for name in IQMS_KEYS)
+        if echo is not None and not key[4]:
+            key = key[:4] + (_normalize_key(echo),)
+
+        if key in self.index:
+            return self.index[key]
+        return [
+            row
+            for row in self.partial_index.get(key[:3], [])
+            if all(
+                not value or value == row_value
+                for value, row_value in zip(key[3:], self.keys[row][3:])
+            )
+        ]
+
+    def lookup(
+        self,
+        filenames: list[str],
+        columns: Optional[list] = None,
+        echo: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """Return the IQMs of the rows matching BIDS files, in the order of the files.
+
+        Parameters
+        ----------
+        filenames : list[str]
+            Paths to the BIDS files (e.g., functional connectivity matrices)
+        columns : Optional[list], optional
+            Columns of the table to return, by default all of them
+        echo : Optional[str], optional
+            Echo whose IQMs are returned for the files without echo entity,
+            by default all of them
+
+        Returns
+        -------
+        pd.DataFrame
+            The entities of each file followed by the requested IQMs, files without
+            IQMs being dropped.
+        """
+        from bids.layout import parse_file_entities
+
+        if columns is None:
+            columns = list(self.columns)
+
+        entities, rows = [], []
+        for filename in filenames:
+            file_entities = parse_file_entities(filename)
+            file_rows = self.find_rows(file_entities, echo=echo)
+            entities += [file_entities] * len(file_rows)
+            rows += file_rows
+
+        entities_df = pd.DataFrame(entities)
+        iqms_df = pd.DataFrame(
+            {name: np.asarray(self.columns[name])[rows] for name in columns}
+        )
+        overlapping = [name for name in iqms_df.columns if name in entities_df.columns]
+        return pd.concat([entities_df.drop(columns=overlapping), iqms_df], axis=1)
+
+
+class _LazyColumns(dict):
+    """Columns of a NPZ store, each read from disk on first access."""
+
+    def __init__(self, path: str, names: list[str]):
+        super().__init__((name, None) for name in names)
+        self.path = path
+        self.names = names
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        values = super().__getitem__(name)
+        if values is None:
+            with np.load(self.path, allow_pickle=False) as entry:
+                values = entry[f"column_{self.names.index(name)}"]
+            self[name] = values
+        return values
+
+
+def load_iqms_store(iqms_filename: str, cache_dir: Optional[str] = None) -> IQMStore:
+    """Return the IQM store of a MRIQC group table, building it on the first call.
+
+    The store is keyed on the MRIQC version and the size and modification time of
+    the table.
+
+    Parameters
+    ----------
+    iqms_filename : str
+        Path to the MRIQC group table (e.g., group_bold.tsv)
+    cache_dir : Optional[str], optional
+        Root of the cache, by default None (see caching.get_cache_dir)
+
+    Returns
+    -------
+    IQMStore
+        Store of the IQMs.
+    """
+    key = hash_key(
+        file_fingerprint(iqms_filename),
+        get_mriqc_version(op.dirname(iqms_filename)),
+        STORE_VERSION,
+    )
+    path = op.join(get_cache_dir(cache_dir, "iqms"), f"{key}.npz")
+
+    if op.exists(path):
+        try:
+            return IQMStore.load(path)
+        except (OSError, ValueError, KeyError):
+            logging.warning(f"Corrupted IQM store {path}, building it again.")
+
+    logging.info(f"Indexing the IQMs of {iqms_filename} ...")
+    store = IQMStore.from_dataframe(pd.read_csv(iqms_filename, sep="\t"))
+    store.save(path)
+    return store
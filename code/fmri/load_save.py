@@ -24,21 +24,21 @@
 
 import os
 import re
+import json
 import os.path as op
 import pandas as pd
 from collections import defaultdict
+from functools import lru_cache
 import logging
 from typing import Optional, Union
+from uuid import uuid4
 
-from bids import BIDSLayout
 import numpy as np
 
-from pandas import read_csv
-from nibabel import loadsave
-from bids.layout import parse_file_entities
-from bids.layout.writing import build_path
-from nilearn.datasets import fetch_atlas_difumo
-from nilearn.interfaces.fmriprep.load_confounds import _load_single_confounds_file
+from atlases import get_atlas_name, load_atlas, register_atlas
+from bids_index import find_func_files, scan_headers
+from caching import file_fingerprint, get_cache_dir, hash_key
+from iqms import IQMStore, load_iqms_store
 
 FC_PATTERN: list = [
     "sub-{subject}[/ses-{session}]/func/sub-{subject}"
@@ -60,6 +60,18 @@ CONFOUND_PATTERN: list = [
 ]
 CONFOUND_FILLS: dict = {"desc": "confounds", "suffix": "timeseries", "extension": "tsv"}
 
+# Field of the sidecar manifests storing the cache key of an output
+MANIFEST_KEY: str = "CacheKey"
+
+# File extension of each storage format of the timeseries and FC matrices
+STORAGE_EXTENSIONS: dict = {
+    "tsv": ".tsv",
+    "npy": ".npy",
+    "hdf5": ".h5",
+    "zarr": ".zarr",
+}
+HDF5_DATASET: str = "data"
+
 
 def separate_by_similar_values(
     input_list: list, external_value: Optional[Union[list, np.ndarray]] = None
@@ -90,15 +102,34 @@ def separate_by_similar_values(
     return data_by_value
 
 
+def get_bids_index_dir(paths_to_func_dir: str) -> str:
+    """Return the directory whose BIDS index (see bids_index.py) covers a dataset.
+
+    The index is shared by all the datasets of the derivatives folder.
+    """
+    base_dir = op.abspath(paths_to_func_dir)
+    # Only a "derivatives" folder of the path, not any name containing the word
+    if "derivatives" in base_dir.split(os.sep):
+        base_dir = find_derivative(base_dir)
+    return base_dir
+
+
 def get_func_filenames_bids(
     paths_to_func_dir: str,
     task_filter: Optional[list] = None,
     ses_filter: Optional[list] = None,
     run_filter: Optional[list] = None,
+    reindex: bool = False,
+    n_jobs: int = 1,
 ) -> tuple[list[list[str]], list[float]]:
     """Return the BIDS functional imaging files matching the specified task and session
     filters as well as the first (if multiple) unique repetition time (TR).
 
+    The files are found with a persistent index stored at the root of the derivatives
+    (see bids_index.find_func_files), which is only refreshed for the directories
+    modified since the previous run. Only the NIfTI headers of the new or modified files
+    are read (see bids_index.scan_headers) to group the files by FoV.
+
     Parameters
     ----------
     paths_to_func_dir : str
@@ -109,28 +140,32 @@ def get_func_filenames_bids(
         List of session name(s) to consider, by default `None`
     run_filter : list, optional
         List of run(s) to consider, by default `None`
+    reindex : bool, optional
+        Condition to rebuild the index from scratch, by default False
+    n_jobs : int, optional
+        Number of threads reading the NIfTI headers, by default 1
 
     Returns
     -------
     tuple[list[list[str]], list[float]]
         Returns two lists with: a list of sorted filenames and a list of TRs.
     """
-    logging.debug("Using BIDS to find functional files...")
+    logging.debug("Using the BIDS index to find functional files...")
 
-    layout = BIDSLayout(
-        paths_to_func_dir,
-        validate=False,
-    )
+    base_dir = get_bids_index_dir(paths_to_func_dir)
 
-    all_derivatives = layout.get(
-        scope="all",
-        return_type="file",
-        extension=["nii.gz", "gz"],
+    func_files = find_func_files(
+        paths_to_func_dir,
         suffix="bold",
+        base_dir=base_dir,
+        reindex=reindex,
+        extension=[".nii.gz"],
         task=task_filter or [],
         session=ses_filter or [],
         run=run_filter or [],
     )
+    all_derivatives = [filename for filename, _ in func_files]
+    metadata = dict(func_files)
 
     if not all_derivatives:
         raise ValueError(
@@ -142,9 +177,8 @@ def get_func_filenames_bids(
             f"\nRun: {run_filter or []}"
         )
 
-    affines = []
-    for file in all_derivatives:
-        affines.append(loadsave.load(file).affine)
+    headers = scan_headers(all_derivatives, base_dir=base_dir, n_jobs=n_jobs)
+    affines = [headers[file]["affine"] for file in all_derivatives]
 
     similar_fov_dict = separate_by_similar_values(
         all_derivatives, np.array(affines)[:, 0, 0]
@@ -161,7 +195,7 @@ def get_func_filenames_bids(
     for file_group in similar_fov_dict.values():
         t_rs = []
         for file in file_group:
-            t_rs.append(layout.get_metadata(file)["RepetitionTime"])
+            t_rs.append(metadata[file]["RepetitionTime"])
 
         similar_tr_dict = separate_by_similar_values(file_group, t_rs)
         separated_files += list(similar_tr_dict.values())
@@ -177,10 +211,55 @@ def get_func_filenames_bids(
     return separated_files, separated_trs
 
 
+@lru_cache(maxsize=None)
+def _parse_entities(filename: str) -> dict:
+    """Memoized parse_file_entities (callers must copy the returned dictionary)."""
+    from bids.layout import parse_file_entities
+
+    return parse_file_entities(filename)
+
+
+@lru_cache(maxsize=None)
+def compile_bids_pattern(
+    patterns: tuple, entity_names: frozenset, extension: Optional[str] = None
+) -> Optional[str]:
+    """Compile BIDS path patterns into a format string for a given set of entities.
+
+    The optional segments and the choice between patterns only depend on the entities
+    that are defined, so PyBIDS ``build_path`` is called once with placeholders as
+    values and the resulting template is formatted for each file. The extension is
+    baked in the template as ``build_path`` normalizes it.
+
+    Parameters
+    ----------
+    patterns : tuple
+        Patterns for the output file
+    entity_names : frozenset
+        Names of the defined entities (except the extension)
+    extension : Optional[str], optional
+        Extension of the output file, by default None
+
+    Returns
+    -------
+    Optional[str]
+        Template to be formatted with the entities, None if no pattern matches.
+    """
+    from bids.layout.writing import build_path
+
+    placeholders = {name: "{%s}" % name for name in entity_names}
+    if extension is not None:
+        placeholders["extension"] = extension
+    template = build_path(placeholders, list(patterns))
+    return None if template is None else str(template)
+
+
 def get_bids_savename(filename: str, patterns: list, **kwargs) -> str:
     """Return the BIDS filename following the specified patterns and modifying the
     entities from the keywords arguments.
 
+    The parsed entities and the compiled patterns (see compile_bids_pattern) are
+    memoized, as the same files and patterns are used over and over.
+
     Parameters
     ----------
     filename : str
@@ -193,38 +272,103 @@ def get_bids_savename(filename: str, patterns: list, **kwargs) -> str:
     str
         BIDS output filename.
     """
-    entity = parse_file_entities(filename)
+    from bids.layout.writing import build_path
+
+    entity = dict(_parse_entities(filename))
 
     for key, value in kwargs.items():
         entity[key] = value
 
-    bids_savename = build_path(entity, patterns)
+    # Same filtering as build_path (lists of values expand to several paths)
+    entity = {key: value for key, value in entity.items() if value or value == 0}
+    if any(isinstance(value, (list, tuple)) for value in entity.values()):
+        return str(build_path(entity, patterns))
 
-    return str(bids_savename)
+    extension = entity.pop("extension", None)
+    template = compile_bids_pattern(tuple(patterns), frozenset(entity), extension)
+    if template is None:
+        return str(template)
 
+    return template.format(**entity)
+
+
+def index_output(output: str) -> set[str]:
+    """List all the files of an output directory in a single walk.
+
+    Folders with an extension (e.g., Zarr arrays) are listed as files and not
+    walked into.
+
+    Parameters
+    ----------
+    output : str
+        Path to the output directory
 
-def get_atlas_data(atlas_name: str = "DiFuMo", **kwargs) -> dict:
+    Returns
+    -------
+    set[str]
+        Paths relative to the output directory.
+    """
+    output_index = set()
+    stack = [""]
+    while stack:
+        relpath = stack.pop()
+        try:
+            it = os.scandir(op.join(output, relpath))
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                entry_relpath = op.join(relpath, entry.name)
+                if entry.is_dir() and not op.splitext(entry.name)[1]:
+                    stack.append(entry_relpath)
+                else:
+                    output_index.add(entry_relpath)
+    return output_index
+
+
+def get_atlas_data(
+    atlas_name: str = "DiFuMo", cache_dir: Optional[str] = None, **kwargs
+) -> dict:
     """Fetch the specifies atlas filename and data.
 
+    The atlas is loaded from the local registry (see atlases.load_atlas), and only
+    fetched (then registered) if it is missing from it.
+
     Parameters
     ----------
     atlas_name : str, optional
         Name of the atlas to fetch, by default "DiFuMo"
+    cache_dir : Optional[str], optional
+        Root of the cache holding the registry, by default None (see
+        caching.get_cache_dir)
 
     Returns
     -------
     dict
-        Dictionary with keys "maps" (filename) and "labels" (ROI labels).
+        Dictionary with keys "maps" (filename), "labels" (ROI labels) and "centroids"
+        (center of mass of the regions).
     """
-    logging.info("Fetching the DiFuMo atlas ...")
-
     if kwargs["dimension"] not in [64, 128, 512]:
         logging.warning(
             "Dimension for DiFuMo atlas is different from 64, 128 or 512 ! Are you"
             "certain you want to deviate from those optimized modes? "
         )
 
-    return fetch_atlas_difumo(legacy_format=False, **kwargs)
+    name = get_atlas_name(
+        atlas_name, kwargs["dimension"], kwargs.get("resolution_mm", 2)
+    )
+    atlas = load_atlas(name, cache_dir=cache_dir)
+    if atlas is not None:
+        logging.debug(f"Loaded the {name} atlas from the registry.")
+        return atlas
+
+    from nilearn.datasets import fetch_atlas_difumo
+
+    logging.info("Fetching the DiFuMo atlas ...")
+    fetched_atlas = fetch_atlas_difumo(legacy_format=False, **kwargs)
+    register_atlas(name, fetched_atlas.maps, fetched_atlas.labels, cache_dir=cache_dir)
+
+    return load_atlas(name, cache_dir=cache_dir)
 
 
 def find_atlas_dimension(path: str, atlas_name: str = "DiFuMo") -> int:
@@ -329,15 +473,7 @@ def reorder_iqms(iqms_df: pd.DataFrame, fc_paths: list[str]):
     panda.df
         Dataframe containing the IQMs dataframe with reordered rows.
     """
-    iqms_df[["subject", "session", "task"]] = iqms_df["bids_name"].str.extract(
-        r"sub-(\d+)_ses-(\d+)_task-(\w+)_"
-    )
-    entities_list = [parse_file_entities(filepath) for filepath in fc_paths]
-    entities_df = pd.DataFrame(entities_list)
-
-    return pd.merge(
-        entities_df, iqms_df, on=["subject", "session", "task"], how="inner"
-    )
+    return IQMStore.from_dataframe(iqms_df).lookup(fc_paths)
 
 
 def load_iqms(
@@ -346,9 +482,13 @@ def load_iqms(
     mriqc_path: str = None,
     mod="bold",
     iqms_name: list = ["fd_mean", "fd_num", "fd_perc"],
+    cache_dir: Optional[str] = None,
 ) -> str:
     """Load the IQMs and match their order with the corresponding functional matrix.
 
+    The MRIQC group table is indexed once in the on-disk cache (see
+    iqms.load_iqms_store), and only the IQMs of interest are read from it.
+
     Parameters
     ----------
     derivative_path : str
@@ -361,6 +501,8 @@ def load_iqms(
         Load the IQMs of that modality
     iqms_name : list, optional
         Name of the IQMs to find, by default ["fd_mean", "fd_num", "fd_perc"]
+    cache_dir : Optional[str], optional
+        Root of the cache, by default None (see caching.get_cache_dir)
 
     Returns
     -------
@@ -373,21 +515,78 @@ def load_iqms(
 
     # Load the IQMs from the group tsv
     iqms_filename = op.join(mriqc_path, f"group_{mod}.tsv")
-    iqms_df = read_csv(iqms_filename, sep="\t")
+    store = load_iqms_store(iqms_filename, cache_dir=cache_dir)
     # If multi-echo dataset and the IQMs of interest are motion-related, keep only the IQMs from the second echo
-    if "echo" in iqms_df["bids_name"][0] and all("fd" in i for i in iqms_name):
-        iqms_df = iqms_df[iqms_df["bids_name"].str.contains("echo-2")]
+    echo = None
+    if store.multi_echo and all("fd" in i for i in iqms_name):
+        echo = "2"
         logging.info(
             "In the case of a multi-echo dataset, the IQMs of the second echo are considered."
         )
 
-    # Match the order of the rows in iqms_df with the corresponding FC
-    iqms_df = reorder_iqms(iqms_df, fc_paths)
+    # Match the order of the rows with the corresponding FC, keeping only the IQMs of
+    # interest
+    iqms_df = store.lookup(fc_paths, columns=iqms_name, echo=echo)
+
+    return iqms_df[iqms_name]
+
+
+def get_confounds_filename(filename: str) -> str:
+    """Return the path to the fMRIPrep confounds file of a functional file."""
+    return op.join(
+        op.dirname(filename),
+        get_bids_savename(filename, patterns=CONFOUND_PATTERN, **CONFOUND_FILLS),
+    )
+
+
+def get_output_key(filename: str, parameters: dict) -> str:
+    """Compute the cache key of an output derived from a functional file.
+
+    The key changes whenever the functional file or its confounds file are modified
+    (based on their size and modification time) or any of the parameters differs.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the functional file
+    parameters : dict
+        Parameters used to compute the output
+
+    Returns
+    -------
+    str
+        Hexadecimal cache key.
+    """
+    return hash_key(
+        file_fingerprint(filename),
+        file_fingerprint(get_confounds_filename(filename)),
+        sorted(parameters.items()),
+    )
+
+
+def get_manifest_filename(path: str) -> str:
+    """Return the path to the JSON sidecar manifest of an output file."""
+    return f"{op.splitext(path)[0]}.json"
+
+
+def read_output_key(path: str) -> Optional[str]:
+    """Read the cache key stored in the sidecar manifest of an output file.
 
-    # Keep only the IQMs of interest
-    iqms_df = iqms_df[iqms_name]
+    Parameters
+    ----------
+    path : str
+        Path to the output file
 
-    return iqms_df
+    Returns
+    -------
+    Optional[str]
+        Cache key of the output, None if the output has no (valid) manifest.
+    """
+    try:
+        with open(get_manifest_filename(path)) as f:
+            return json.load(f).get(MANIFEST_KEY)
+    except (OSError, ValueError, AttributeError):
+        return None
 
 
 def check_existing_output(
@@ -395,6 +594,8 @@ def check_existing_output(
     func_filename: list[str],
     return_existing: bool = False,
     return_output: bool = False,
+    cache_keys: Optional[dict] = None,
+    output_index: Optional[set] = None,
     **kwargs,
 ) -> tuple[list[str], list[str]]:
     """Check for existing output.
@@ -410,6 +611,12 @@ def check_existing_output(
         False
     return_output: bool, optional
         Condition to return the path of existing outputs, by default False
+    cache_keys: Optional[dict], optional
+        Expected cache key of the output of each input file. If given, outputs whose
+        manifest does not store the same key are considered missing, by default None
+    output_index: Optional[set], optional
+        Files of the output directory as returned by index_output, to be shared by
+        several checks, by default the output directory is walked once
 
     Returns
     -------
@@ -421,9 +628,21 @@ def check_existing_output(
             "Setting return_output=True in check_existing_output requires return_existing=True."
         )
 
+    if output_index is None:
+        output_index = index_output(output)
+
+    savenames = [get_bids_savename(filename, **kwargs) for filename in func_filename]
+
+    def is_up_to_date(filename: str, savename: str) -> bool:
+        if op.normpath(savename) not in output_index:
+            return False
+        if cache_keys is None:
+            return True
+        return read_output_key(op.join(output, savename)) == cache_keys[filename]
+
     missing_data_filter = [
-        not op.exists(op.join(output, get_bids_savename(filename, **kwargs)))
-        for filename in func_filename
+        not is_up_to_date(filename, savename)
+        for filename, savename in zip(func_filename, savenames)
     ]
 
     missing_data = np.array(func_filename)[missing_data_filter]
@@ -435,9 +654,9 @@ def check_existing_output(
     if return_existing:
         if return_output:
             existing_output = [
-                op.join(output, get_bids_savename(filename, **kwargs))
-                for filename in func_filename
-                if op.exists(op.join(output, get_bids_savename(filename, **kwargs)))
+                op.join(output, savename)
+                for savename, missing in zip(savenames, missing_data_filter)
+                if not missing
             ]
             return existing_output
         else:
@@ -449,8 +668,101 @@ def check_existing_output(
     return missing_data.tolist()
 
 
-def load_timeseries(func_filename: list[str], output: str) -> list[np.ndarray]:
-    """Load existing timeseries from .csv files.
+def get_storage_fills(fills: dict, storage: str = "tsv") -> dict:
+    """Set the extension of BIDS fills to the one of a storage format.
+
+    Parameters
+    ----------
+    fills : dict
+        BIDS entities used to build output filenames
+    storage : str, optional
+        Storage format ("tsv", "npy", "hdf5" or "zarr"), by default "tsv"
+
+    Returns
+    -------
+    dict
+        Copy of the fills with the extension of the storage format.
+    """
+    if storage not in STORAGE_EXTENSIONS:
+        raise ValueError(
+            f"Storage format {storage} is not supported. Choose among "
+            f"{', '.join(STORAGE_EXTENSIONS)}."
+        )
+    return {**fills, "extension": STORAGE_EXTENSIONS[storage]}
+
+
+def save_array(path: str, data: np.ndarray, dtype: Optional[str] = None) -> None:
+    """Save an array in the storage format given by the file extension.
+
+    Parameters
+    ----------
+    path : str
+        Path to the output file (.tsv, .npy, .h5 or .zarr)
+    data : np.ndarray
+        Array to save
+    dtype : Optional[str], optional
+        Data type of the saved array, by default the one of the data
+    """
+    data = np.asarray(data, dtype=dtype)
+    extension = op.splitext(path)[1]
+
+    if extension == ".npy":
+        np.save(path, data)
+    elif extension == ".h5":
+        import h5py
+
+        # Contiguous and uncompressed, so that the dataset can be memory-mapped
+        with h5py.File(path, "w") as f:
+            f.create_dataset(HDF5_DATASET, data=data)
+    elif extension == ".zarr":
+        import zarr
+
+        zarr.save_array(path, data)
+    else:
+        fmt = "%.9g" if data.dtype == np.float32 else "%.18e"
+        np.savetxt(path, data, fmt=fmt, delimiter="\t")
+
+
+def load_array(path: str, mmap: bool = True) -> np.ndarray:
+    """Load an array saved with save_array (or as a text TSV file).
+
+    Parameters
+    ----------
+    path : str
+        Path to the file (.tsv, .npy, .h5 or .zarr)
+    mmap : bool, optional
+        Condition to memory-map binary files instead of reading them, by default True
+
+    Returns
+    -------
+    np.ndarray
+        Loaded array (read-only if memory-mapped).
+    """
+    extension = op.splitext(path)[1]
+
+    if extension == ".npy":
+        return np.load(path, mmap_mode="r" if mmap else None)
+    if extension == ".h5":
+        import h5py
+
+        with h5py.File(path, "r") as f:
+            dataset = f[HDF5_DATASET]
+            offset = dataset.id.get_offset()
+            if not mmap or offset is None or dataset.chunks is not None:
+                return dataset[()]
+            dtype, shape = dataset.dtype, dataset.shape
+        return np.memmap(path, mode="r", dtype=dtype, shape=shape, offset=offset)
+    if extension == ".zarr":
+        import zarr
+
+        return zarr.open_array(path, mode="r")[...]
+    return np.loadtxt(path, delimiter="\t", ndmin=2)
+
+
+def load_timeseries(
+    func_filename: list[str], output: str, storage: str = "tsv"
+) -> list[np.ndarray]:
+    """Load existing timeseries.
 
     Parameters
     ----------
@@ -458,6 +770,8 @@ def load_timeseries(func_filename: list[str], output: str) -> list[np.ndarray]:
         List of timeseries filenames.
     output : str
         Path to the output folder.
+    storage : str, optional
+        Storage format of the timeseries, by default "tsv"
 
     Returns
     -------
@@ -470,12 +784,12 @@ def load_timeseries(func_filename: list[str], output: str) -> list[np.ndarray]:
     loaded_ts = []
     for filename in func_filename:
         path_to_ts = get_bids_savename(
-            filename, patterns=TIMESERIES_PATTERN, **TIMESERIES_FILLS
+            filename,
+            patterns=TIMESERIES_PATTERN,
+            **get_storage_fills(TIMESERIES_FILLS, storage),
         )
         logging.debug(f"\t{op.join(output, path_to_ts)}")
-        loaded_ts.append(
-            np.genfromtxt(op.join(output, path_to_ts), float, delimiter="\t")
-        )
+        loaded_ts.append(load_array(op.join(output, path_to_ts)))
 
     return loaded_ts
 
@@ -494,14 +808,12 @@ def get_confounds_manually(func_filename: list[str], **kwargs) -> tuple[list, li
         Two lists, one with the loaded confounds (for each input file) and one with the
         corresponding sample mask.
     """
+    from nilearn.interfaces.fmriprep.load_confounds import _load_single_confounds_file
+
     confounds, sample_mask = [], []
 
     for filename in func_filename:
-        dir_name = op.dirname(filename)
-        confounds_file = op.join(
-            dir_name,
-            get_bids_savename(filename, patterns=CONFOUND_PATTERN, **CONFOUND_FILLS),
-        )
+        confounds_file = get_confounds_filename(filename)
 
         # confounds_json_file = load_confounds._get_json(confounds_file)
         confounds_json_file = confounds_file.replace("tsv", "json")
@@ -516,10 +828,140 @@ def get_confounds_manually(func_filename: list[str], **kwargs) -> tuple[list, li
     return confounds, sample_mask
 
 
+def get_confounds_cache_filename(
+    filename: str, parameters: dict, cache_dir: Optional[str] = None
+) -> str:
+    """Return the path to the cached confounds of a functional file.
+
+    The entry is keyed on the size and modification time of the fMRIPrep confounds
+    file and its JSON sidecar, and on the parameters of the denoising strategy.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the functional file
+    parameters : dict
+        Parameters of the denoising strategy (see funconn.load_run_confounds)
+    cache_dir : Optional[str], optional
+        Root of the cache, by default None (see caching.get_cache_dir)
+
+    Returns
+    -------
+    str
+        Path to the (possibly missing) NPZ cache entry.
+    """
+    confounds_file = get_confounds_filename(filename)
+    key = hash_key(
+        file_fingerprint(confounds_file),
+        file_fingerprint(confounds_file.replace("tsv", "json")),
+        sorted(parameters.items()),
+    )
+    return op.join(get_cache_dir(cache_dir, "confounds"), f"{key}.npz")
+
+
+def read_cached_confounds(
+    path: str,
+) -> Optional[tuple[Optional[pd.DataFrame], Optional[np.ndarray]]]:
+    """Read cached confounds and sample mask, None if the entry is missing."""
+    try:
+        with np.load(path, allow_pickle=False) as entry:
+            confounds = None
+            if entry["has_confounds"]:
+                confounds = pd.DataFrame(
+                    entry["values"], columns=entry["columns"].tolist()
+                )
+            sample_mask = entry["sample_mask"] if entry["has_sample_mask"] else None
+    except (OSError, ValueError, KeyError):
+        return None
+
+    os.utime(path)
+    return confounds, sample_mask
+
+
+def write_cached_confounds(
+    path: str, confounds: Optional[pd.DataFrame], sample_mask: Optional[np.ndarray]
+) -> None:
+    """Save the selected confounds and the sample mask of a run, column by column, in
+    an NPZ cache entry."""
+    has_confounds = confounds is not None
+    has_sample_mask = sample_mask is not None
+    # Write to a temporary file first so that concurrent jobs never read a partially
+    # written entry
+    tmp_path = op.join(op.dirname(path), f".tmp-{uuid4()}.npz")
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            values=confounds.to_numpy(dtype=float) if has_confounds else np.empty(0),
+            columns=np.array(confounds.columns if has_confounds else [], dtype=str),
+            sample_mask=sample_mask if has_sample_mask else np.empty(0, dtype=int),
+            has_confounds=has_confounds,
+            has_sample_mask=has_sample_mask,
+        )
+    os.replace(tmp_path, path)
+
+
+def get_raw_signals_cache_filename(
+    filename: str,
+    atlas_filename: str,
+    cache_dir: Optional[str] = None,
+    sparse_threshold: Optional[float] = None,
+) -> str:
+    """Return the path to the cached raw (not denoised) regional signals of a
+    functional file.
+
+    The entry is keyed on the size and modification time of the functional file and
+    of the atlas maps (and on the pruning of the maps), so that it holds for any
+    denoising strategy.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the functional file
+    atlas_filename : str
+        Path to the atlas maps
+    cache_dir : Optional[str], optional
+        Root of the cache, by default None (see caching.get_cache_dir)
+    sparse_threshold : Optional[float], optional
+        Relative threshold pruning the maps (see extraction.get_sparse_operator),
+        by default None (dense maps)
+
+    Returns
+    -------
+    str
+        Path to the (possibly missing) NPY cache entry.
+    """
+    key = hash_key(
+        file_fingerprint(filename), file_fingerprint(atlas_filename), sparse_threshold
+    )
+    return op.join(get_cache_dir(cache_dir, "signals"), f"{key}.npy")
+
+
+def read_cached_raw_signals(path: str) -> Optional[np.ndarray]:
+    """Read cached raw regional signals, None if the entry is missing."""
+    try:
+        signals = np.load(path, allow_pickle=False)
+    except (OSError, ValueError):
+        return None
+
+    os.utime(path)
+    return signals
+
+
+def write_cached_raw_signals(path: str, signals: np.ndarray) -> None:
+    """Save the raw regional signals of a run in an NPY cache entry."""
+    tmp_path = op.join(op.dirname(path), f".tmp-{uuid4()}.npy")
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.asarray(signals, dtype=np.float64))
+    os.replace(tmp_path, path)
+
+
 def save_output(
     data_list: list[np.ndarray],
     original_filenames: list[str],
     output: str,
+    cache_keys: Optional[dict] = None,
+    parameters: Optional[dict] = None,
+    dtype: Optional[str] = None,
     **kwargs,
 ) -> None:
     """Save the output files.
@@ -532,10 +974,26 @@ def save_output(
         List of original filenames
     output : Optional[str], optional
         Path to the output directory, by default None
+    cache_keys : Optional[dict], optional
+        Cache key of the output of each original file. If given, a JSON manifest with
+        the key and the parameters is saved next to each output, by default None
+    parameters : Optional[dict], optional
+        Parameters used to compute the outputs, stored in the manifests, by default None
+    dtype : Optional[str], optional
+        Data type of the saved arrays (e.g., "float32"), by default the one of the data
     """
     for data, filename in zip(data_list, original_filenames):
         path_to_save = get_bids_savename(filename, **kwargs)
         saveloc = op.join(output, path_to_save)
         logging.debug(f"Saving data of type {type(data)} to: {saveloc}")
         os.makedirs(op.dirname(saveloc), exist_ok=True)
-        np.savetxt(saveloc, data, delimiter="\t")
+        save_array(saveloc, data, dtype=dtype)
+
+        if cache_keys is not None:
+            manifest = {
+                MANIFEST_KEY: cache_keys[filename],
+                "Sources": [filename, get_confounds_filename(filename)],
+                "Parameters": parameters or {},
+            }
+            with open(get_manifest_filename(saveloc), "w") as f:
+                json.dump(manifest, f, indent=2)
@@ -0,0 +1,37 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2023 The Axon Lab <theaxonlab@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Python module with the choices and defaults of the command-line options.
+
+It only depends on the standard library, so that the command-line interfaces can
+be parsed (e.g., --help or --dry-run) without importing nilearn, scikit-learn or
+matplotlib.
+"""
+
+# Alpha selection modes of the sparse inverse covariance (see covariance.py)
+SPARSE_MODES: tuple = ("cv", "shared", "group")
+# Memory ceiling (in GB) of each worker of the chunked extraction (see extraction.py)
+DEFAULT_MEM_GB: float = 1.0
+# Rendering modes of the visual reports (see reports.py)
+REPORT_MODES: tuple = ("none", "thumbnails", "full")
+# Reportlets of the group report (see reports.GROUP_REPORTLETS)
+GROUP_REPORTLET_NAMES: tuple = ("censoring", "fcdist", "qcfc", "qcfcvseuclidean")
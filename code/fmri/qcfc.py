@@ -0,0 +1,168 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2023 The Axon Lab <theaxonlab@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Python module for the vectorized computation of QC-FC correlations.
+
+Once the edges (edges x sessions) and the IQMs are z-scored, the Pearson correlation
+of every edge with an IQM is a single matrix product. Permuting the sessions of the
+edges is equivalent to permuting the IQM, so the null distribution is generated by
+correlating all the edges at once with batches of permuted IQMs. The null
+correlations are only accumulated as a histogram, whose size does not depend on the
+number of edges and permutations.
+"""
+
+import numpy as np
+from joblib import Parallel, delayed
+
+# Bins of the histograms of the null correlations
+N_BINS: int = 2000
+BIN_EDGES: np.ndarray = np.linspace(-1, 1, N_BINS + 1)
+DEFAULT_MEM_GB: float = 0.5
+
+
+def zscore_rows(data: np.ndarray) -> np.ndarray:
+    """Center the rows of a matrix and scale them to unit norm, so that the dot
+    product of two rows is their Pearson correlation (NaN for constant rows)."""
+    data = np.asarray(data, dtype=np.float64)
+    data = data - data.mean(axis=-1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return data / np.linalg.norm(data, axis=-1, keepdims=True)
+
+
+def compute_qc_fc(edges: np.ndarray, iqms: np.ndarray) -> np.ndarray:
+    """Correlate each edge with each IQM across sessions.
+
+    Parameters
+    ----------
+    edges : np.ndarray
+        Connectivity of each edge in each session (edges x sessions)
+    iqms : np.ndarray
+        Value of each IQM in each session (IQMs x sessions)
+
+    Returns
+    -------
+    np.ndarray
+        QC-FC correlations (edges x IQMs).
+    """
+    return zscore_rows(edges) @ zscore_rows(np.atleast_2d(iqms)).T
+
+
+def _null_histogram(
+    z_edges: np.ndarray,
+    z_iqm: np.ndarray,
+    n_permutations: int,
+    seed: np.random.SeedSequence,
+    bin_edges: np.ndarray,
+) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    permuted_iqms = rng.permuted(np.tile(z_iqm, (n_permutations, 1)), axis=1)
+    correlations = z_edges @ permuted_iqms.T
+    return np.histogram(correlations[np.isfinite(correlations)], bins=bin_edges)[0]
+
+
+def get_null_histogram(
+    edges: np.ndarray,
+    iqm: np.ndarray,
+    n_permutations: int,
+    seed: int = 42,
+    bin_edges: np.ndarray = BIN_EDGES,
+    mem_gb: float = DEFAULT_MEM_GB,
+    n_jobs: int = 1,
+) -> np.ndarray:
+    """Histogram the QC-FC correlations of all the edges with permuted sessions.
+
+    Parameters
+    ----------
+    edges : np.ndarray
+        Connectivity of each edge in each session (edges x sessions)
+    iqm : np.ndarray
+        Value of the IQM in each session
+    n_permutations : int
+        Number of permutations of the sessions
+    seed : int, optional
+        Seed of the permutations, by default 42
+    bin_edges : np.ndarray, optional
+        Edges of the bins of the histogram, by default BIN_EDGES
+    mem_gb : float, optional
+        Memory ceiling (in GB) of the correlations of one batch of permutations,
+        by default DEFAULT_MEM_GB
+    n_jobs : int, optional
+        Number of threads processing the batches, by default 1
+
+    Returns
+    -------
+    np.ndarray
+        Number of null correlations in each bin.
+    """
+    z_edges = zscore_rows(edges)
+    z_iqm = zscore_rows(iqm)
+    # The correlations of a batch are held twice (filtered of NaNs to be binned)
+    batch_size = int(mem_gb * 1024**3 // (16 * len(z_edges)))
+    batch_size = max(1, min(n_permutations, batch_size))
+    batches = [
+        min(batch_size, n_permutations - start)
+        for start in range(0, n_permutations, batch_size)
+    ]
+
+    # The batches draw their permutations from independent streams, so that the
+    # null distribution does not depend on the number of jobs
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+    counts = Parallel(n_jobs=n_jobs, prefer="threads")(
+        delayed(_null_histogram)(z_edges, z_iqm, n, batch_seed, bin_edges)
+        for n, batch_seed in zip(batches, seeds)
+    )
+    return np.sum(counts, axis=0)
+
+
+def ks_statistic_binned(
+    values: np.ndarray,
+    counts: np.ndarray,
+    bin_edges: np.ndarray = BIN_EDGES,
+) -> float:
+    """Two-sample Kolmogorov-Smirnov statistic between samples and a histogram.
+
+    The empirical distribution functions are compared at the edges of the bins, so
+    that the statistic is exact up to the width of the bins.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Samples of the first distribution
+    counts : np.ndarray
+        Histogram of the second distribution
+    bin_edges : np.ndarray, optional
+        Edges of the bins of the histogram, by default BIN_EDGES
+
+    Returns
+    -------
+    float
+        Maximum distance between the two empirical distribution functions.
+    """
+    values = np.sort(np.asarray(values)[~np.isnan(values)])
+    cdf_values = np.searchsorted(values, bin_edges, side="right") / values.size
+    cdf_counts = np.concatenate([[0], np.cumsum(counts)]) / np.sum(counts)
+    return float(np.max(np.abs(cdf_values - cdf_counts)))
+
+
+def get_bin_centers(bin_edges: np.ndarray = BIN_EDGES) -> np.ndarray:
+    """Return the centers of the bins of a histogram."""
+    return (bin_edges[1:] + bin_edges[:-1]) / 2
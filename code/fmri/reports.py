@@ -22,28 +22,39 @@
 #
 """Python module for functional connectivity visual reports"""
 
+import json
 import logging
 import os
 import os.path as op
-from typing import Optional, Union
+from typing import Callable, Optional, Union
 
 import matplotlib.pyplot as plt
-import nibabel as nib
 import numpy as np
 import pandas as pd
 import plotly.offline as pyo
 import seaborn as sns
+from joblib import Parallel, delayed
 from matplotlib.axes import Axes
+from matplotlib.collections import LineCollection
 from matplotlib.cm import get_cmap
 from matplotlib.lines import Line2D
 from nireports.assembler.report import Report
 from nilearn.plotting import plot_design_matrix, plot_matrix
-from scipy.stats import pearsonr, ks_2samp
+from scipy.stats import pearsonr
 from time import strftime
 from uuid import uuid4
 
-from load_save import get_bids_savename
-
+from atlases import get_atlas_distances
+from caching import file_digest, file_fingerprint, hash_key
+from fcdist import get_fc_densities, get_upper_triangles
+from load_save import get_bids_savename, load_array
+from options import REPORT_MODES
+from qcfc import (
+    compute_qc_fc,
+    get_bin_centers,
+    get_null_histogram,
+    ks_statistic_binned,
+)
 
 FIGURE_PATTERN: list = [
     "sub-{subject}/figures/sub-{subject}[_ses-{session}]"
@@ -62,12 +73,183 @@ N_PERMUTATION: int = 10000
 ALPHA = 0.05
 PERCENT_MATCH_CUT_OFF = 95
 DURATION_CUT_OFF = 300
+# Percentiles of the bands of the FC distributions
+FC_DIST_PERCENTILES: tuple = (5, 25, 50, 75, 95)
+
+# Reportlets of the group report, with their inputs and the files they render
+GROUP_REPORTLETS: dict = {
+    "censoring": {
+        "inputs": ("durations",),
+        "filename": "group_desc-censoring_bold.html",
+    },
+    "fcdist": {"inputs": ("fc",), "filename": "group_desc-fcdist_bold.svg"},
+    "qcfc": {"inputs": ("fc", "iqms"), "filename": "group_desc-qcfc_bold.svg"},
+    "qcfcvseuclidean": {
+        "inputs": ("fc", "iqms", "atlas"),
+        "filename": "group_desc-qcfcvseuclidean_bold.svg",
+    },
+}
+# Reportlets sharing the QC-FC correlations
+QC_FC_REPORTLETS: tuple = ("qcfc", "qcfcvseuclidean")
+# Content hashes of the inputs of the rendered reportlets
+GROUP_MANIFEST_FILENAME: str = "group_report_manifest.json"
+
+# Largest side of the thumbnails (in pixels)
+THUMBNAIL_MAX_PIXELS: int = 1024
+# Approximate peak memory of a worker rendering a report (in GB)
+REPORT_MEM_GB: dict = {"thumbnails": 0.3, "full": 1.2}
+
+
+def save_figure(path: str, mode: str = "full") -> None:
+    """Save and close the current figure.
+
+    Parameters
+    ----------
+    path : str
+        Path to the figure file
+    mode : str, optional
+        Either "full" to save the figure at its default resolution, or "thumbnails"
+        to bound its largest side to THUMBNAIL_MAX_PIXELS pixels, by default "full"
+    """
+    fig = plt.gcf()
+    dpi = None
+    if mode == "thumbnails":
+        dpi = min(fig.dpi, THUMBNAIL_MAX_PIXELS / max(fig.get_size_inches()))
+
+    os.makedirs(op.dirname(path), exist_ok=True)
+    plt.savefig(path, dpi=dpi)
+    plt.close(fig)
+
+
+def _render_report(report_func: Callable, kwargs: dict, mode: str) -> None:
+    """Render one visual report on the Agg backend, loading the arrays given as
+    paths to saved outputs."""
+    plt.switch_backend("Agg")
+    kwargs = {
+        key: load_array(value) if key in ["timeseries", "matrix"] else value
+        for key, value in kwargs.items()
+    }
+
+    # Thumbnails are drawn at a low resolution, not only downsampled when saved
+    figure_dpi = plt.rcParams["figure.dpi"]
+    if mode == "thumbnails":
+        figure_dpi = THUMBNAIL_MAX_PIXELS / min(
+            max(TS_FIGURE_SIZE), max(FC_FIGURE_SIZE)
+        )
+    with plt.rc_context({"figure.dpi": figure_dpi}):
+        report_func(mode=mode, **kwargs)
+
+
+def render_reports(
+    report_tasks: list[tuple[Callable, dict]],
+    mode: str = "full",
+    n_jobs: int = 1,
+    mem_gb: Optional[float] = None,
+) -> None:
+    """Render the visual reports of individual runs in a pool of processes.
+
+    Parameters
+    ----------
+    report_tasks : list[tuple[Callable, dict]]
+        Reporting functions (e.g., visual_report_fc) with their arguments. The
+        "timeseries" and "matrix" arguments can be paths to saved outputs, which are
+        then only loaded by the worker rendering the report.
+    mode : str, optional
+        Either "none" to skip the reports, "thumbnails" for figures of bounded size
+        or "full", by default "full"
+    n_jobs : int, optional
+        Maximum number of reports rendered in parallel, by default 1
+    mem_gb : Optional[float], optional
+        Memory budget shared by the workers (in GB), by default None (no limit)
+    """
+    if mode not in REPORT_MODES:
+        raise ValueError(
+            f"Report mode {mode} is not supported. Choose among "
+            f"{', '.join(REPORT_MODES)}."
+        )
+    if mode == "none" or not len(report_tasks):
+        return
+
+    n_jobs = min(n_jobs, len(report_tasks))
+    if mem_gb is not None:
+        n_jobs = max(1, min(n_jobs, int(mem_gb // REPORT_MEM_GB[mode])))
+
+    logging.info(
+        f"Rendering {len(report_tasks)} visual reports with {n_jobs} worker(s) ..."
+    )
+    Parallel(n_jobs=n_jobs)(
+        delayed(_render_report)(report_func, kwargs, mode)
+        for report_func, kwargs in report_tasks
+    )
+
+
+def get_figure_pixels(fig: plt.Figure) -> tuple[int, int]:
+    """Return the size (width, height) of a figure in pixels at its resolution."""
+    width, height = np.ceil(fig.get_size_inches() * fig.dpi).astype(int)
+    return max(1, width), max(1, height)
+
+
+def _bin_starts(n_samples: int, n_bins: int) -> np.ndarray:
+    return np.linspace(0, n_samples, n_bins + 1).astype(int)[:-1]
+
+
+def decimate_minmax(
+    timeseries: np.ndarray, n_columns: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Decimate timeseries to their min/max envelope in each pixel column.
+
+    The timepoints are split into n_columns consecutive bins, each replaced by the
+    minimum and the maximum of the signals within it, which draws the same pixels as
+    the full resolution signals as long as a bin does not span more than one pixel
+    column.
+
+    Parameters
+    ----------
+    timeseries : np.ndarray
+        Timeseries to decimate (timepoints x signals)
+    n_columns : int
+        Number of pixel columns spanned by the timeseries
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Timepoints of the envelope, and envelope of each signal (points x signals).
+        The timeseries are returned unchanged if they have less than two timepoints
+        per column.
+    """
+    n_timepoints = len(timeseries)
+    if n_timepoints <= 2 * n_columns:
+        return np.arange(n_timepoints), timeseries
+
+    starts = _bin_starts(n_timepoints, n_columns)
+    ends = np.append(starts[1:], n_timepoints) - 1
+    minima = np.minimum.reduceat(timeseries, starts, axis=0)
+    maxima = np.maximum.reduceat(timeseries, starts, axis=0)
+    x_envelope = np.stack([starts, ends], axis=1).ravel()
+    envelope = np.stack([minima, maxima], axis=1).reshape(2 * n_columns, -1)
+    return x_envelope, envelope
+
+
+def downsample_image(image: np.ndarray, shape: tuple[int, int]) -> np.ndarray:
+    """Average consecutive blocks of rows and columns of an image so that it is not
+    larger than shape (rows, columns)."""
+    image = np.asarray(image, dtype=float)
+    for axis, size in enumerate(shape):
+        n_samples = image.shape[axis]
+        if n_samples <= size:
+            continue
+        starts = _bin_starts(n_samples, size)
+        counts = np.diff(np.append(starts, n_samples))
+        image = np.add.reduceat(image, starts, axis=axis)
+        image /= np.expand_dims(counts, 1 - axis)
+    return image
 
 
 def plot_timeseries_carpet(
     timeseries: np.ndarray,
     labels: Optional[Union[list[str], np.ndarray]] = None,
     networks: Optional[pd.Series] = None,
+    decimate: bool = True,
 ) -> list[Axes]:
     """Plot the timeseries as a carpet plot.
 
@@ -79,6 +261,9 @@ def plot_timeseries_carpet(
         Labels corresponding to the atlas ROIs, by default None
     networks : Optional[pd.Series], optional
         Networks of the atlas ROIs, by default None
+    decimate : bool, optional
+        Whether to average the carpet down to the size of the figure in pixels
+        before drawing it (level of detail), by default True
 
     Returns
     -------
@@ -133,11 +318,21 @@ def plot_timeseries_carpet(
             fontsize=LABELSIZE,
         )
 
+    carpet = np.asarray(timeseries).T[sorting_index]
+    # The color scale and the coordinates are those of the full resolution carpet
+    vmin, vmax = np.nanmin(carpet), np.nanmax(carpet)
+    if decimate:
+        width, height = get_figure_pixels(fig)
+        carpet = downsample_image(carpet, (height, width))
+
     image = ax_carpet.imshow(
-        timeseries.T[sorting_index],
+        carpet,
         cmap="binary_r",
         aspect="auto",
         interpolation="antialiased",
+        vmin=vmin,
+        vmax=vmax,
+        extent=(-0.5, n_timepoints - 0.5, n_area - 0.5, -0.5),
     )
     cbar = plt.colorbar(image, pad=0, aspect=40)
     cbar.ax.tick_params(labelsize=LABELSIZE)
@@ -162,6 +357,7 @@ def plot_timeseries_signal(
     color: str = "tab:blue",
     linewidth: float = 4,
     ax: Optional[Axes] = None,
+    decimate: bool = True,
 ) -> Axes:
     """Plot the timeseries as a signal plot.
 
@@ -183,6 +379,9 @@ def plot_timeseries_signal(
         Linewidth of the line plots, by default 4
     ax : Optional[Axes], optional
         Axes to draw on, by default None
+    decimate : bool, optional
+        Whether to decimate the signals to their min/max envelope in each pixel
+        column of the figure before drawing them (level of detail), by default True
 
     Returns
     -------
@@ -232,9 +431,20 @@ def plot_timeseries_signal(
             fontsize=LABELSIZE,
         )
 
-    x_plot = np.arange(n_timepoints)
-    for i, (roi_signal, col) in enumerate(zip(timeseries.T[sorting_index], colors)):
-        ax.plot(x_plot, i * vert_scale + roi_signal, color=col, linewidth=linewidth)
+    signals = np.asarray(timeseries)[:, sorting_index]
+    if decimate:
+        x_plot, signals = decimate_minmax(signals, get_figure_pixels(ax.figure)[0])
+    else:
+        x_plot = np.arange(n_timepoints)
+
+    # All the signals are drawn as a single collection of lines
+    offsets = np.arange(n_area) * vert_scale
+    lines = np.stack(
+        [np.broadcast_to(x_plot, signals.T.shape), signals.T + offsets[:, np.newaxis]],
+        axis=-1,
+    )
+    ax.add_collection(LineCollection(lines, colors=colors, linewidths=linewidth))
+    ax.autoscale_view()
 
     ax.set_yticks(np.arange(n_area) * vert_scale)
     ax.set_yticklabels(labels, fontsize=LABELSIZE)
@@ -247,7 +457,11 @@ def plot_timeseries_signal(
 
 
 def plot_interpolation(
-    ts: np.ndarray, interpolated_ts: np.ndarray, filename: str, output: str
+    ts: np.ndarray,
+    interpolated_ts: np.ndarray,
+    filename: str,
+    output: str,
+    mode: str = "full",
 ) -> None:
     """Plot the interpolated timeseries overlaid with the timeseries before
     interpolation.
@@ -262,6 +476,8 @@ def plot_interpolation(
         Name of the corresponding BIDS functional file
     output : str
         Path to the output directory
+    mode : str, optional
+        Figure resolution, "full" or "thumbnails" (see save_figure), by default "full"
     """
     ax = plot_timeseries_signal(ts)
     ax = plot_timeseries_signal(interpolated_ts, color="tab:red", ax=ax, linewidth=2)
@@ -288,9 +504,7 @@ def plot_interpolation(
 
     logging.debug("Saving interpolated timeseries visual report at:")
     logging.debug(f"\t{op.join(output, interpolate_saveloc)}")
-    os.makedirs(op.join(output, op.dirname(interpolate_saveloc)), exist_ok=True)
-    plt.savefig(op.join(output, interpolate_saveloc))
-    plt.close()
+    save_figure(op.join(output, interpolate_saveloc), mode=mode)
 
 
 def visual_report_timeserie(
@@ -298,6 +512,7 @@ def visual_report_timeserie(
     filename: str,
     output: str,
     confounds: Optional[np.ndarray] = None,
+    mode: str = "full",
     **kwargs,
 ) -> None:
     """Plot and save the timeseries visual reports.
@@ -312,6 +527,8 @@ def visual_report_timeserie(
         Path to the output directory
     confounds : Optional[np.ndarray], optional
         Confounds to plot, by default None
+    mode : str, optional
+        Figure resolution, "full" or "thumbnails" (see save_figure), by default "full"
     """
     # Plotting denoised and aggregated timeseries
     for plot_func, plot_desc in zip(
@@ -324,9 +541,7 @@ def visual_report_timeserie(
 
         logging.debug("Saving timeseries visual report at:")
         logging.debug(f"\t{op.join(output, ts_saveloc)}")
-        os.makedirs(op.join(output, op.dirname(ts_saveloc)), exist_ok=True)
-        plt.savefig(op.join(output, ts_saveloc))
-        plt.close()
+        save_figure(op.join(output, ts_saveloc), mode=mode)
 
     # Plotting confounds as a design matrix
     if confounds is not None:
@@ -338,9 +553,7 @@ def visual_report_timeserie(
         plot_design_matrix(confounds, ax=ax)
         logging.debug("Saving confounds visual report at:")
         logging.debug(f"\t{op.join(output, conf_saveloc)}")
-
-        plt.savefig(op.join(output, conf_saveloc))
-        plt.close()
+        save_figure(op.join(output, conf_saveloc), mode=mode)
 
 
 def visual_report_fc(
@@ -348,6 +561,7 @@ def visual_report_fc(
     filename: str,
     output: str,
     labels: Optional[Union[list, np.ndarray]] = None,
+    mode: str = "full",
     **kwargs,
 ) -> None:
     """Plot and save the functional connectivity visual reports.
@@ -362,13 +576,26 @@ def visual_report_fc(
         Path to the output directory
     labels : Optional[list], optional
         Labels of the atlas ROIs, by default None
+    mode : str, optional
+        Figure resolution, "full" or "thumbnails" (see save_figure). The ROI labels
+        are not drawn on thumbnails, where they would not be readable, by default
+        "full"
     """
+    if mode == "thumbnails":
+        labels = None
+
     fc_saveloc = get_bids_savename(
         filename, patterns=FIGURE_PATTERN, desc="heatmap", **FIGURE_FILLS, **kwargs
     )
     _, ax = plt.subplots(figsize=FC_FIGURE_SIZE)
 
-    plot_matrix(matrix, labels=list(labels), axes=ax, vmin=-1, vmax=1)  # type: ignore
+    plot_matrix(
+        matrix,
+        labels=None if labels is None else list(labels),
+        axes=ax,
+        vmin=-1,
+        vmax=1,
+    )  # type: ignore
     ax.tick_params(labelsize=LABELSIZE)
 
     # Update the size of the colorbar labels
@@ -380,9 +607,7 @@ def visual_report_fc(
 
     logging.debug("Saving functional connectivity matrices visual report at:")
     logging.debug(f"\t{op.join(output, fc_saveloc)}")
-
-    plt.savefig(op.join(output, fc_saveloc))
-    plt.close()
+    save_figure(op.join(output, fc_saveloc), mode=mode)
 
 
 def group_report_censoring(good_timepoints_df, output) -> None:
@@ -468,27 +693,64 @@ def group_report_fc_dist(
 ) -> None:
     """Plot and save the functional connectivity density distributions.
 
+    Alias of group_reportlet_fc_dist.
+    """
+    group_reportlet_fc_dist(fc_matrices, output)
+
+
+def group_reportlet_fc_dist(
+    fc_matrices: list[np.ndarray],
+    output: str,
+    kind: str = "kde",
+) -> None:
+    """Plot and save the functional connectivity density distributions.
+
+    The densities of all the sessions are estimated in a single vectorized pass (see
+    fcdist.py) and drawn in one figure, on top of the quantile bands of the group.
+
     Parameters
     ----------
     fc_matrices : list[np.ndarray]
         List of functional connectivity matrices
     output : str
         Path to the output directory
+    kind : str, optional
+        Either "kde" for kernel density estimates or "hist" for histograms, by
+        default "kde"
     """
-
-    _, ax = plt.subplots(figsize=FC_FIGURE_SIZE)
-
-    for fc_matrix in fc_matrices:
-        sns.displot(
-            fc_matrix,
-            kind="kde",
-            fill=True,
-            linewidth=0.5,
-            legend=False,
-            palette="ch:s=.25,rot=-.25",
+    if kind not in ("kde", "hist"):
+        raise ValueError(f"Unknown kind of distribution: {kind}.")
+
+    logging.debug("Compute the distribution of the edges of each session.")
+    edges = get_upper_triangles(fc_matrices, dtype=np.float32)
+    centers, densities = get_fc_densities(edges, kde=kind == "kde")
+    del edges
+
+    fig, ax = plt.subplots(figsize=FC_FIGURE_SIZE)
+
+    # One curve per session, drawn as a single collection
+    curves = np.stack([np.broadcast_to(centers, densities.shape), densities], axis=-1)
+    ax.add_collection(
+        LineCollection(
+            curves,
+            colors="gray",
+            linewidths=1,
+            alpha=max(0.05, min(0.5, 10 / len(densities))),
+            label="Sessions",
         )
+    )
+
+    # Quantile bands of the group
+    low, q1, median, q3, high = np.nanpercentile(densities, FC_DIST_PERCENTILES, axis=0)
+    ax.fill_between(centers, low, high, color="C0", alpha=0.2, label="5-95th pct.")
+    ax.fill_between(centers, q1, q3, color="C0", alpha=0.4, label="25-75th pct.")
+    ax.plot(centers, median, color="C0", linewidth=4, label="Median")
 
+    ax.autoscale_view()
+    ax.set_xlabel("Functional connectivity", fontsize=LABELSIZE + 2)
+    ax.set_ylabel("Density", fontsize=LABELSIZE + 2)
     ax.tick_params(labelsize=LABELSIZE)
+    ax.legend(fontsize=LABELSIZE)
 
     # Ensure the labels are within the figure
     plt.tight_layout()
@@ -499,56 +761,55 @@ def group_report_fc_dist(
     logging.debug(f"\t{op.join(output, savename)}")
 
     plt.savefig(op.join(output, savename))
-    plt.close()
+    plt.close(fig)
 
 
-def group_reportlet_fc_dist(
-    fc_matrices: list[np.ndarray],
-    output: str,
-) -> None:
-    """Plot and save the functional connectivity density distributions.
+def get_group_qc_fc(
+    fc_matrices: list[np.ndarray], iqms_df: pd.DataFrame
+) -> tuple[np.ndarray, np.ndarray]:
+    """Correlate the edges of the functional connectivity matrices with the IQMs.
 
     Parameters
     ----------
     fc_matrices : list[np.ndarray]
         List of functional connectivity matrices
-    output : str
-        Path to the output directory
-    """
+    iqms_df : pd.Dataframe
+        Dataframe containing the image quality metrics to correlate with
 
-    _, ax = plt.subplots(figsize=FC_FIGURE_SIZE)
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Edges of each session (edges x sessions), and QC-FC correlations of each edge
+        with each IQM (edges x IQMs).
+    """
+    # Keep only upper triangle as the matrix is symmetric, with one row per edge
+    edges = get_upper_triangles(fc_matrices).T
 
-    for fc_matrix in fc_matrices:
-        sns.displot(
-            fc_matrix,
-            kind="kde",
-            fill=True,
-            linewidth=0.5,
-            legend=False,
-            palette="ch:s=.25,rot=-.25",
+    if edges.shape[1] != iqms_df.shape[0]:
+        raise ValueError(
+            "The number of functional connectivity matrices and IQMs do not match."
         )
 
-    ax.tick_params(labelsize=LABELSIZE)
-
-    # Ensure the labels are within the figure
-    plt.tight_layout()
-
-    savename = op.join("reportlets", "group_desc-fcdist_bold.svg")
-
-    logging.debug("Saving functional connectivity distribution visual report at:")
-    logging.debug(f"\t{op.join(output, savename)}")
+    if edges.shape[1] == 1:
+        raise ValueError(
+            "We need at least two functional connectivity matrices to be able to compute its correlation with IQMs."
+        )
 
-    plt.savefig(op.join(output, savename))
-    plt.close()
+    logging.debug("Compute QC-FC correlation for each edge.")
+    return edges, compute_qc_fc(edges, iqms_df.to_numpy(dtype=float).T)
 
 
 def group_reportlet_qc_fc(
     fc_matrices: list[np.ndarray],
     iqms_df: pd.DataFrame,
     output: str,
+    n_jobs: int = 1,
 ) -> dict:
     """Plot and save the QC-FC distributions.
 
+    The QC-FC correlations of all the edges and their distribution under the null
+    hypothesis are computed with matrix products (see qcfc.py).
+
     Parameters
     ----------
     fc_matrices : list[np.ndarray]
@@ -557,38 +818,17 @@ def group_reportlet_qc_fc(
         Dataframe containing the image quality metrics to correlate with
     output : str
         Path to the output directory
+    n_jobs : int, optional
+        Number of threads computing the null distributions, by default 1
     """
-
-    # Stack the list of arrays into a 3D matrix
-    fc_matrices = np.stack(fc_matrices, axis=2)
-
-    # Keep only upper triangle as the matrix is symmetric
-    upper_triangle_indices = np.triu_indices(fc_matrices.shape[0], k=1)
-    fc_matrices = fc_matrices[upper_triangle_indices]
-
-    if fc_matrices.shape[1] != iqms_df.shape[0]:
-        raise ValueError(
-            "The number of functional connectivity matrices and IQMs do not match."
-        )
-
-    if fc_matrices.shape[1] == 1:
-        raise ValueError(
-            "We need at least two functional connectivity matrices to be able to compute its correlation with IQMs."
-        )
+    fc_matrices, qc_fc_all = get_group_qc_fc(fc_matrices, iqms_df)
 
     fig, axs = plt.subplots(1, 3, figsize=FC_FIGURE_SIZE)
 
     # Iterate over each IQM
     qc_fc_dict = dict()
     for i, iqm_column in enumerate(iqms_df.columns):
-        # Create an empty list to store correlations for each edge
-        qc_fcs = []
-
-        # Iterate over each edge
-        logging.debug("Compute QC-FC correlation for each edge.")
-        for e in range(fc_matrices.shape[0]):
-            qc_fc = np.corrcoef(fc_matrices[e, :], iqms_df[iqm_column])[0, 1]
-            qc_fcs.append(qc_fc)
+        qc_fcs = qc_fc_all[:, i]
 
         # Create a density distribution plot for the current IQM
         logging.debug("Create the density distribution plot.")
@@ -601,20 +841,19 @@ def group_reportlet_qc_fc(
 
         ## Permutation analyses
         logging.debug("Compute QC-FC distribution under the null hypothesis.")
-        correlations_null = []
-        for e in range(fc_matrices.shape[0]):
-            for _ in range(N_PERMUTATION):
-                permuted_fc = fc_matrices[
-                    e, np.random.default_rng(seed=42).permutation(fc_matrices.shape[1])
-                ]
-                # Correlation under null hypothesis
-                correlation = np.corrcoef(permuted_fc, iqms_df[iqm_column])[0, 1]
-                correlations_null.append(correlation)
+        null_counts = get_null_histogram(
+            fc_matrices,
+            iqms_df[iqm_column].to_numpy(dtype=float),
+            N_PERMUTATION,
+            seed=42,
+            n_jobs=n_jobs,
+        )
 
         # Create a density distribution plot for null distribution
         logging.debug("Create the density distribution plot for the null distribution.")
         sns.kdeplot(
-            correlations_null,
+            x=get_bin_centers(),
+            weights=null_counts,
             fill=False,
             color="red",
             label="Dist under null hypothesis",
@@ -626,7 +865,7 @@ def group_reportlet_qc_fc(
 
         # Compute percent match between the two distributions
         logging.debug("Compute percent match between the two distributions.")
-        ks_statistic, _ = ks_2samp(qc_fcs, correlations_null)
+        ks_statistic = ks_statistic_binned(qc_fcs, null_counts)
         percent_match_ks = (1 - ks_statistic) * 100
 
         # Plot the box in red if the correlation is significant
@@ -670,24 +909,13 @@ def compute_distance(atlas_path: str) -> np.array:
     Returns
     -------
     np.array
-        Distance matrix
+        Distances (in mm) between each pair of regions, as the upper triangle of the
+        distance matrix
     """
-    from scipy.ndimage.measurements import center_of_mass
-
-    logging.debug("Compute distance matrix from atlas centers of mass")
-
-    atlas_img = nib.load(atlas_path)
-    atlas_data = atlas_img.get_fdata()
-    # Array to store the center of mass of each region
-    centroids = np.zeros((atlas_data.shape[3], 3), dtype=float)
-    for r in range(atlas_data.shape[3]):
-        centroids[r, ...] = np.array(center_of_mass(atlas_data[..., r]))
+    logging.debug("Load distances between atlas centers of mass")
 
-    # Compute Euclidean distance matrix using broadcasting
-    diff = centroids[:, np.newaxis, :] - centroids
-    distance_matrix = np.sqrt(np.sum(diff**2, axis=-1))
-
-    return distance_matrix
+    # The distances are computed once per atlas and then cached (see atlases.py)
+    return np.asarray(get_atlas_distances(atlas_path))
 
 
 def group_reportlet_qc_fc_euclidean(
@@ -705,10 +933,8 @@ def group_reportlet_qc_fc_euclidean(
     output : str
         Path to the output directory
     """
+    # Upper triangle of the distance matrix, in the same order as the edges
     d = compute_distance(atlas_path)
-    # Keep only upper triangle as the matrix is symmetric
-    upper_triangle_indices = np.triu_indices(d.shape[0], k=1)
-    d = d[upper_triangle_indices]
 
     # Iterate over the IQMs
     fig, axs = plt.subplots(1, 3, figsize=FC_FIGURE_SIZE)
@@ -757,20 +983,168 @@ def group_reportlet_qc_fc_euclidean(
     plt.close()
 
 
+def _load_manifest(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}, "reportlets": {}}
+
+
+def _content_hash(paths: list[str], known_files: dict) -> str:
+    """Hash the content of files, reusing the digests of the known files whose size
+    and modification time did not change (known_files is updated in place)."""
+    digests = []
+    for path in paths:
+        abspath, *stat = file_fingerprint(path)
+        known = known_files.get(abspath)
+        if known is None or known[:2] != stat:
+            known = stat + [file_digest(abspath)]
+            known_files[abspath] = known
+        digests.append(known[2])
+    return hash_key(*digests)
+
+
+def _render_group_reportlets(
+    names: tuple, inputs: dict, output: str, n_jobs: int
+) -> None:
+    """Render reportlets of the group report on the Agg backend, reading their input
+    files in the worker rather than receiving their content."""
+    plt.switch_backend("Agg")
+    if "fc" in inputs:
+        fc_matrices = [load_array(filename) for filename in inputs["fc"]]
+
+    qc_fc_dict = None
+    for name in names:
+        logging.info(f"Rendering the {name} reportlet ...")
+        if name == "censoring":
+            group_report_censoring(pd.read_csv(inputs["durations"]), output)
+        elif name == "fcdist":
+            group_reportlet_fc_dist(fc_matrices, output)
+        elif name == "qcfc":
+            qc_fc_dict = group_reportlet_qc_fc(
+                fc_matrices, inputs["iqms"], output, n_jobs=n_jobs
+            )
+        elif name == "qcfcvseuclidean":
+            if qc_fc_dict is None:
+                _, qc_fc = get_group_qc_fc(fc_matrices, inputs["iqms"])
+                qc_fc_dict = dict(zip(inputs["iqms"].columns, qc_fc.T))
+            group_reportlet_qc_fc_euclidean(qc_fc_dict, inputs["atlas"], output)
+
+
 def group_report(
-    good_timepoints_df: pd.DataFrame,
-    fc_matrices: list[np.ndarray],
+    fc_filenames: list[str],
     iqms_df: pd.DataFrame,
     atlas_filename: str,
     output: str,
+    durations_filename: Optional[str] = None,
+    n_jobs: int = 1,
+    only: Optional[list[str]] = None,
 ) -> None:
-    """Generate a group report."""
+    """Generate a group report, rendering only the reportlets whose inputs changed.
 
-    # Generate each reportlets
-    group_report_censoring(good_timepoints_df, output)
-    group_reportlet_fc_dist(fc_matrices, output)
-    qc_fc_dict = group_reportlet_qc_fc(fc_matrices, iqms_df, output)
-    group_reportlet_qc_fc_euclidean(qc_fc_dict, atlas_filename, output)
+    Each reportlet declares its inputs (see GROUP_REPORTLETS), whose content hashes
+    are recorded in a manifest next to the report when the reportlet is rendered.
+    The reportlets whose inputs did not change since then are not rendered again,
+    and the others are rendered in parallel before the HTML report is reassembled.
+
+    Parameters
+    ----------
+    fc_filenames : list[str]
+        Paths to the functional connectivity matrices
+    iqms_df : pd.Dataframe
+        Dataframe containing the image quality metrics to correlate with
+    atlas_filename : str
+        Path to the atlas Nifti
+    output : str
+        Path to the output directory
+    durations_filename : Optional[str], optional
+        Path to the table of fMRI durations after censoring, by default
+        "fMRI_duration_after_censoring.csv" in the output directory
+    n_jobs : int, optional
+        Number of processes rendering the reportlets (the remaining ones are given to
+        the QC-FC null distributions), by default 1
+    only : Optional[list[str]], optional
+        Reportlets to render regardless of their inputs, the others being left as
+        they are, by default None (all the reportlets whose inputs changed)
+    """
+    if durations_filename is None:
+        durations_filename = op.join(output, "fMRI_duration_after_censoring.csv")
+    if only is not None and set(only) - set(GROUP_REPORTLETS):
+        raise ValueError(
+            f"Unknown reportlets {', '.join(sorted(set(only) - set(GROUP_REPORTLETS)))}"
+            f". Choose among {', '.join(GROUP_REPORTLETS)}."
+        )
+
+    manifest_filename = op.join(output, GROUP_MANIFEST_FILENAME)
+    manifest = _load_manifest(manifest_filename)
+    input_hashes = {
+        "fc": _content_hash(fc_filenames, manifest["files"]),
+        "durations": _content_hash([durations_filename], manifest["files"]),
+        "atlas": _content_hash([atlas_filename], manifest["files"]),
+        "iqms": hash_key(
+            list(iqms_df.columns), pd.util.hash_pandas_object(iqms_df).tolist()
+        ),
+    }
+    reportlet_hashes = {
+        name: hash_key(*(input_hashes[key] for key in reportlet["inputs"]))
+        for name, reportlet in GROUP_REPORTLETS.items()
+    }
+
+    if only is None:
+        stale = [
+            name
+            for name, reportlet in GROUP_REPORTLETS.items()
+            if manifest["reportlets"].get(name) != reportlet_hashes[name]
+            or not op.exists(op.join(output, "reportlets", reportlet["filename"]))
+        ]
+    else:
+        stale = [name for name in GROUP_REPORTLETS if name in only]
+
+    report_filename = op.join(output, "group_report.html")
+    if not stale and op.exists(report_filename):
+        logging.info("The group report is up to date.")
+        return
+    logging.info(
+        f"Rendering {len(stale)} reportlet(s) out of {len(GROUP_REPORTLETS)}: "
+        f"{', '.join(stale) or 'none'}"
+    )
+
+    # The QC-FC correlations are computed once for both the reportlets plotting
+    # them, which are thus rendered by the same worker (first, being the longest)
+    qc_fc_names = tuple(name for name in QC_FC_REPORTLETS if name in stale)
+    tasks = [qc_fc_names] if qc_fc_names else []
+    tasks += [(name,) for name in stale if name not in QC_FC_REPORTLETS]
+
+    # The workers read the input files themselves, only the paths are sent to them
+    inputs = {
+        "fc": fc_filenames,
+        "durations": durations_filename,
+        "atlas": atlas_filename,
+        "iqms": iqms_df,
+    }
+
+    os.makedirs(op.join(output, "reportlets"), exist_ok=True)
+    n_workers = max(1, min(n_jobs, len(tasks)))
+    Parallel(n_jobs=n_workers)(
+        delayed(_render_group_reportlets)(
+            names,
+            {
+                key: inputs[key]
+                for name in names
+                for key in GROUP_REPORTLETS[name]["inputs"]
+            },
+            output,
+            max(1, n_jobs - n_workers + 1),
+        )
+        for names in tasks
+    )
+
+    manifest["reportlets"].update({name: reportlet_hashes[name] for name in stale})
+    tmp_filename = op.join(output, f".tmp-{uuid4()}.json")
+    with open(tmp_filename, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_filename, manifest_filename)
 
     # Assemble reportlets into a single HTML report
     logging.debug("Assemble the group report into a single HTML report.")
@@ -0,0 +1,5 @@
+import os.path as op
+import sys
+
+# The scripts of this folder import each other as top-level modules
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
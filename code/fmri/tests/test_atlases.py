@@ -0,0 +1,77 @@
+import numpy as np
+import nibabel as nib
+import pandas as pd
+import fmri.atlases as fa
+import fmri.load_save as fl
+
+from scipy.ndimage import center_of_mass
+
+
+def make_atlas(tmp_path, n_regions=3):
+    rng = np.random.default_rng(0)
+    maps = rng.random((5, 6, 7, n_regions)).astype(np.float32)
+    maps_filename = str(tmp_path / "atlas.nii.gz")
+    nib.Nifti1Image(maps, np.eye(4)).to_filename(maps_filename)
+    labels = pd.DataFrame(
+        {
+            "component": np.arange(1, n_regions + 1),
+            "difumo_names": [f"Region {i + 1}" for i in range(n_regions)],
+            "yeo_networks7": ["Network 1"] * n_regions,
+        }
+    )
+    return maps, maps_filename, labels
+
+
+def test_register_atlas(tmp_path):
+    maps, maps_filename, labels = make_atlas(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    assert fa.load_atlas("DiFuMo3-2mm", cache_dir=cache_dir) is None
+
+    fa.register_atlas("DiFuMo3-2mm", maps_filename, labels, cache_dir=cache_dir)
+    atlas = fa.load_atlas("DiFuMo3-2mm", cache_dir=cache_dir)
+
+    assert atlas.maps.endswith(".nii")
+    assert np.allclose(nib.load(atlas.maps).get_fdata(), maps)
+    pd.testing.assert_frame_equal(atlas.labels, labels)
+    expected = [center_of_mass(maps[..., r]) for r in range(maps.shape[3])]
+    assert np.allclose(atlas.centroids, expected)
+    assert np.allclose(fa.get_atlas_centroids(atlas.maps), expected)
+    expected_distances = [
+        np.linalg.norm(np.subtract(expected[i], expected[j]))
+        for i, j in zip(*np.triu_indices(maps.shape[3], k=1))
+    ]
+    assert np.allclose(fa.get_atlas_distances(atlas.maps), expected_distances)
+
+
+def test_get_atlas_centroids_cache(tmp_path):
+    maps, maps_filename, _ = make_atlas(tmp_path)
+    affine = np.diag([2.0, 2.0, 2.0, 1.0])
+    affine[:3, 3] = [-10, -20, -30]
+    nib.Nifti1Image(maps, affine).to_filename(maps_filename)
+    cache_dir = str(tmp_path / "cache")
+
+    voxel_centroids = [center_of_mass(maps[..., r]) for r in range(maps.shape[3])]
+    expected = nib.affines.apply_affine(affine, voxel_centroids)
+    assert np.allclose(fa.get_atlas_centroids(maps_filename, cache_dir), expected)
+    # The second call reads the centroids and distances back from the cache
+    cached = list((tmp_path / "cache" / "centroids").glob("*/*.npy"))
+    assert [f.name for f in cached] == [fa.CENTROIDS_FILENAME]
+    assert np.allclose(fa.get_atlas_centroids(maps_filename, cache_dir), expected)
+    distances = fa.get_atlas_distances(maps_filename, cache_dir)
+    assert distances.shape == (3,)
+    assert np.isclose(distances[0], np.linalg.norm(expected[0] - expected[1]))
+
+
+def test_get_atlas_data_offline(tmp_path, monkeypatch):
+    _, maps_filename, labels = make_atlas(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    fa.register_atlas(
+        fa.get_atlas_name("DiFuMo", 64), maps_filename, labels, cache_dir=cache_dir
+    )
+
+    def fail(*args, **kwargs):
+        raise AssertionError("A registered atlas was fetched.")
+
+    monkeypatch.setattr("nilearn.datasets.fetch_atlas_difumo", fail)
+    atlas = fl.get_atlas_data(dimension=64, cache_dir=cache_dir)
+    assert atlas.labels["difumo_names"].tolist() == labels["difumo_names"].tolist()
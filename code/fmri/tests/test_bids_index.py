@@ -0,0 +1,95 @@
+import json
+import os
+import pytest
+import numpy as np
+import nibabel as nb
+import fmri.bids_index as fb
+
+
+@pytest.fixture
+def bids_tree(tmp_path):
+    root = tmp_path / "derivatives" / "fmriprep"
+    root.mkdir(parents=True)
+    with open(root / "task-rest_bold.json", "w") as f:
+        json.dump({"RepetitionTime": 2.0, "TaskName": "rest"}, f)
+
+    func_dir = root / "sub-001" / "ses-001" / "func"
+    func_dir.mkdir(parents=True)
+    for run in [1, 2]:
+        prefix = f"sub-001_ses-001_task-rest_run-{run}"
+        (func_dir / f"{prefix}_space-MNI_desc-preproc_bold.nii.gz").touch()
+        (func_dir / f"{prefix}_desc-confounds_timeseries.tsv").touch()
+    with open(func_dir / "sub-001_ses-001_task-rest_run-2_bold.json", "w") as f:
+        json.dump({"RepetitionTime": 1.6}, f)
+
+    # Ignored folder of the dataset
+    (root / "sourcedata" / "func").mkdir(parents=True)
+    (root / "sourcedata" / "func" / "sub-001_task-rest_bold.nii.gz").touch()
+    return root
+
+
+def test_find_func_files(bids_tree):
+    func_files = fb.find_func_files(bids_tree, base_dir=bids_tree.parent)
+
+    assert [os.path.basename(path) for path, _ in func_files] == [
+        "sub-001_ses-001_task-rest_run-1_space-MNI_desc-preproc_bold.nii.gz",
+        "sub-001_ses-001_task-rest_run-2_space-MNI_desc-preproc_bold.nii.gz",
+    ]
+    # The most specific sidecar overrides the inherited metadata
+    assert [metadata["RepetitionTime"] for _, metadata in func_files] == [2.0, 1.6]
+    assert func_files[1][1]["TaskName"] == "rest"
+    assert (bids_tree.parent / fb.INDEX_FILENAME).exists()
+
+    filtered = fb.find_func_files(bids_tree, run=["2"], session=["001"], task=[])
+    assert len(filtered) == 1 and "run-2" in filtered[0][0]
+    assert not fb.find_func_files(bids_tree, task=["motor"])
+
+
+def test_find_func_files_refresh(bids_tree, monkeypatch):
+    expected = fb.find_func_files(bids_tree)
+
+    # Unmodified directories and sidecars are served from the index
+    def fail(*args, **kwargs):
+        raise AssertionError("An unmodified directory was parsed again.")
+
+    monkeypatch.setattr("bids.layout.parse_file_entities", fail)
+    assert fb.find_func_files(bids_tree) == expected
+    monkeypatch.undo()
+
+    # A new run is found, and the sidecar modification is picked up
+    func_dir = bids_tree / "sub-001" / "ses-001" / "func"
+    (func_dir / "sub-001_ses-001_task-rest_run-3_bold.nii.gz").touch()
+    with open(bids_tree / "task-rest_bold.json", "w") as f:
+        json.dump({"RepetitionTime": 2.5}, f)
+
+    func_files = fb.find_func_files(bids_tree)
+    assert len(func_files) == 3
+    assert [metadata["RepetitionTime"] for _, metadata in func_files] == [
+        2.5,
+        1.6,
+        2.5,
+    ]
+
+
+def test_find_func_files_outside_base(bids_tree, tmp_path):
+    with pytest.raises(ValueError):
+        fb.find_func_files(tmp_path, base_dir=bids_tree)
+
+
+def test_scan_headers(bids_tree, monkeypatch):
+    func_files = [path for path, _ in fb.find_func_files(bids_tree)]
+    affine = np.diag([2.0, 2.0, 2.0, 1.0])
+    for shape, path in zip([(4, 5, 6, 10), (4, 5, 6, 12)], func_files):
+        nb.Nifti1Image(np.zeros(shape, dtype=np.float32), affine).to_filename(path)
+
+    headers = fb.scan_headers(func_files, base_dir=bids_tree, n_jobs=2)
+    assert np.allclose(headers[func_files[0]]["affine"], affine)
+    assert [headers[path]["shape"][-1] for path in func_files] == [10, 12]
+    assert headers[func_files[1]]["dtype"] == "float32"
+
+    # Unmodified files are served from the index
+    def fail(*args, **kwargs):
+        raise AssertionError("An unmodified header was read again.")
+
+    monkeypatch.setattr(fb, "read_nifti_header", fail)
+    assert fb.scan_headers(func_files, base_dir=bids_tree) == headers
@@ -0,0 +1,64 @@
+import pytest
+import numpy as np
+import fmri.covariance as fc
+
+from sklearn.covariance import GraphicalLassoCV, LedoitWolf
+
+N_REGIONS: int = 12
+
+
+@pytest.fixture
+def time_series():
+    rng = np.random.default_rng(seed=42)
+    # Sessions of a subject share a sparse precision structure
+    precision = np.eye(N_REGIONS) + np.diag(np.full(N_REGIONS - 1, 0.4), k=1)
+    precision += precision.T - np.eye(N_REGIONS)
+    covariance = np.linalg.inv(precision)
+    return [
+        rng.multivariate_normal(np.zeros(N_REGIONS), covariance, size=150)
+        for _ in range(3)
+    ]
+
+
+def test_shared_matches_graphical_lasso_cv(time_series):
+    alphas = fc.get_alpha_grid(time_series, n_alphas=5)
+    estimator = fc.SharedGraphicalLassoCV(alphas=alphas, warm_start=False)
+    expected = GraphicalLassoCV(alphas=alphas, max_iter=1000)
+
+    for ts in time_series:
+        estimator.fit(ts)
+        expected.fit(ts)
+        assert estimator.alpha_ == expected.alpha_
+        np.testing.assert_allclose(estimator.precision_, expected.precision_)
+
+
+def test_warm_start(time_series):
+    estimator = fc.prepare_estimator(fc.SharedGraphicalLassoCV(), time_series)
+    cold_estimator = fc.prepare_estimator(
+        fc.SharedGraphicalLassoCV(warm_start=False), time_series
+    )
+
+    for ts in time_series:
+        estimator.fit(ts)
+        cold_estimator.fit(ts)
+        assert estimator.alpha_ == cold_estimator.alpha_
+        np.testing.assert_allclose(
+            estimator.precision_, cold_estimator.precision_, atol=1e-2
+        )
+
+
+def test_prepare_estimator(time_series):
+    estimator = fc.SharedGraphicalLassoCV(alphas=4)
+    shared_estimator = fc.prepare_estimator(estimator, time_series)
+    assert shared_estimator is not estimator
+    assert len(shared_estimator.alphas) == 4
+    assert np.all(np.diff(shared_estimator.alphas) < 0)
+
+    group_estimator = fc.prepare_estimator(
+        fc.SharedGraphicalLassoCV(alphas=4, group_alpha=True), time_series
+    )
+    assert len(group_estimator.alphas) == 1
+    assert group_estimator.alphas[0] in shared_estimator.alphas
+
+    ledoit_wolf = LedoitWolf()
+    assert fc.prepare_estimator(ledoit_wolf, time_series) is ledoit_wolf
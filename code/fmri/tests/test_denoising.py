@@ -0,0 +1,109 @@
+import inspect
+import pytest
+import numpy as np
+import pandas as pd
+import fmri.denoising as fd
+
+from nilearn.signal import _handle_scrubbed_volumes, clean
+from scipy.interpolate import CubicSpline
+
+N_REGIONS: int = 12
+T_R: float = 1.6
+# NiLearn >= 0.11 makes the extrapolation of the censored edges explicit (default)
+SCRUB_KWARGS: dict = (
+    {"extrapolate": True}
+    if "extrapolate" in inspect.signature(_handle_scrubbed_volumes).parameters
+    else {}
+)
+
+
+def legacy_interpolate_and_clean(signals, confounds, sample_mask, low_pass):
+    """Per-run implementation the batched engine replaces."""
+    denoised = []
+    for sig, conf, sm in zip(signals, confounds, sample_mask):
+        # NiLearn >= 0.11 also returns the sample mask
+        inter_sig, inter_conf = _handle_scrubbed_volumes(
+            signals=sig.copy(),
+            confounds=None if conf is None else conf.to_numpy(copy=True),
+            sample_mask=sm,
+            filter_type="butterworth",
+            t_r=T_R,
+            **SCRUB_KWARGS,
+        )[:2]
+        denoised.append(
+            clean(
+                inter_sig,
+                standardize="zscore_sample",
+                confounds=inter_conf,
+                low_pass=low_pass,
+                t_r=T_R,
+            )
+        )
+    return denoised
+
+
+@pytest.mark.parametrize("low_pass", [None, 0.15])
+@pytest.mark.parametrize("boolean_mask", [False, True])
+def test_interpolate_and_clean(low_pass, boolean_mask):
+    rng = np.random.default_rng(seed=42)
+    lengths = [80, 80, 64]
+    censored = [[5, 6, 40], [], [10, 11, 12]]
+
+    signals = [rng.standard_normal((length, N_REGIONS)) for length in lengths]
+    confounds = [
+        pd.DataFrame(rng.standard_normal((length, 4)), columns=list("abcd"))
+        for length in lengths
+    ]
+    confounds[1] = None
+    sample_mask = []
+    for length, volumes in zip(lengths, censored):
+        mask = np.ones(length, dtype=bool)
+        mask[volumes] = False
+        sample_mask.append(mask if boolean_mask else np.flatnonzero(mask))
+
+    expected = legacy_interpolate_and_clean(signals, confounds, sample_mask, low_pass)
+    denoised, interpolated, interpolated_confounds = fd.interpolate_and_clean(
+        signals, confounds, sample_mask, T_R, low_pass=low_pass
+    )
+
+    for sig, expected_sig in zip(denoised, expected):
+        np.testing.assert_allclose(sig, expected_sig, atol=1e-10)
+
+    # Kept volumes are untouched by the interpolation
+    for sig, inter_sig, mask in zip(signals, interpolated, sample_mask):
+        np.testing.assert_array_equal(inter_sig[mask], sig[mask])
+    assert interpolated_confounds[1] is None
+    assert interpolated_confounds[0].shape == (lengths[0], 4)
+
+
+@pytest.mark.parametrize("censored", [[10, 69], [0, 1, 78, 79]])
+def test_interpolate_and_clean_index_mask(censored):
+    # NiLearn negates integer sample masks bitwise, so that it interpolates the
+    # volumes L-1-c instead of the censored ones when both are censored. Index
+    # masks (as returned by load_confounds) select the kept volumes here.
+    rng = np.random.default_rng(seed=42)
+    length = 80
+    signals = [rng.standard_normal((length, N_REGIONS))]
+    confounds = [pd.DataFrame(rng.standard_normal((length, 4)))]
+    kept = np.delete(np.arange(length), censored)
+    boolean_mask = np.ones(length, dtype=bool)
+    boolean_mask[censored] = False
+
+    denoised, interpolated, _ = fd.interpolate_and_clean(
+        signals, confounds, [kept], T_R
+    )
+    expected, expected_interpolated, _ = fd.interpolate_and_clean(
+        signals, confounds, [boolean_mask], T_R
+    )
+    np.testing.assert_allclose(denoised[0], expected[0])
+    np.testing.assert_allclose(interpolated[0], expected_interpolated[0])
+
+    # The censored volumes are interpolated from the kept ones
+    frame_times = np.arange(length) * T_R
+    spline = CubicSpline(frame_times[kept], signals[0][kept])
+    np.testing.assert_allclose(interpolated[0][censored], spline(frame_times[censored]))
+    np.testing.assert_array_equal(interpolated[0][kept], signals[0][kept])
+
+    # Deliberate change from NiLearn's handling of integer masks
+    legacy = legacy_interpolate_and_clean(signals, confounds, [kept], None)
+    assert not np.allclose(denoised[0], legacy[0])
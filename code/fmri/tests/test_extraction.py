@@ -0,0 +1,233 @@
+import pytest
+import numpy as np
+import nibabel as nib
+import fmri.extraction as fe
+
+from nilearn.maskers import MultiNiftiMapsMasker
+
+SHAPE: tuple = (9, 10, 8)
+N_TIMEPOINTS: int = 40
+N_REGIONS: int = 5
+
+
+@pytest.fixture
+def synthetic_data(tmp_path):
+    rng = np.random.default_rng(seed=42)
+    affine = np.diag([3.0, 3.0, 3.0, 1.0])
+
+    # Sparse non-negative maps, as in a probabilistic atlas
+    maps = rng.random(SHAPE + (N_REGIONS,))
+    maps[maps < 0.6] = 0
+    maps_filename = str(tmp_path / "atlas.nii.gz")
+    nib.Nifti1Image(maps, affine).to_filename(maps_filename)
+
+    func_filenames = []
+    for i in range(2):
+        bold = rng.standard_normal(SHAPE + (N_TIMEPOINTS,)) + 100
+        func_filename = str(tmp_path / f"sub-{i}_task-rest_bold.nii.gz")
+        nib.Nifti1Image(bold, affine).to_filename(func_filename)
+        func_filenames.append(func_filename)
+
+    confounds = [rng.standard_normal((N_TIMEPOINTS, 3)) for _ in func_filenames]
+    sample_mask = [
+        np.delete(np.arange(N_TIMEPOINTS), [3, 4, 20]),
+        np.arange(2, N_TIMEPOINTS),
+    ]
+
+    return func_filenames, maps_filename, confounds, sample_mask
+
+
+@pytest.mark.parametrize("mem_gb", [1.0, 1e-5])
+def test_fit_transform_chunked(synthetic_data, mem_gb):
+    func_filenames, maps_filename, confounds, sample_mask = synthetic_data
+    kwargs = {"standardize": "zscore_sample", "low_pass": 0.15, "t_r": 2.0}
+
+    masker = MultiNiftiMapsMasker(maps_img=maps_filename, **kwargs)
+    expected = masker.fit_transform(
+        func_filenames, confounds=confounds, sample_mask=sample_mask
+    )
+    time_series = fe.fit_transform_chunked(
+        func_filenames,
+        maps_filename,
+        confounds=confounds,
+        sample_mask=sample_mask,
+        mem_gb=mem_gb,
+        **kwargs,
+    )
+
+    assert len(time_series) == len(expected)
+    for ts, expected_ts in zip(time_series, expected):
+        assert ts.shape == expected_ts.shape
+        np.testing.assert_allclose(ts, expected_ts, atol=1e-8)
+
+
+@pytest.mark.parametrize("extension", [".nii", ".nii.gz"])
+def test_iter_volume_chunks(tmp_path, extension):
+    rng = np.random.default_rng(seed=42)
+    data = rng.integers(-1000, 1000, SHAPE + (N_TIMEPOINTS,)).astype(np.int16)
+    img = nib.Nifti1Image(data, np.eye(4))
+    img.header.set_slope_inter(0.5, 10)
+    filename = str(tmp_path / f"bold{extension}")
+    img.to_filename(filename)
+
+    img = nib.load(filename)
+    chunks = list(fe.iter_volume_chunks(img, 7))
+
+    assert [(start, stop) for start, stop, _ in chunks][-1] == (35, N_TIMEPOINTS)
+    np.testing.assert_allclose(
+        np.concatenate([chunk for _, _, chunk in chunks], axis=-1), img.get_fdata()
+    )
+
+    # Masked chunks only hold the voxels of the mask
+    voxel_mask = rng.random(SHAPE) > 0.5
+    masked_chunks = list(fe.iter_volume_chunks(img, 7, voxel_mask=voxel_mask))
+    np.testing.assert_allclose(
+        np.concatenate([chunk for _, _, chunk in masked_chunks], axis=-1),
+        img.get_fdata()[voxel_mask],
+    )
+
+
+def test_get_projection_operator_resampling(synthetic_data):
+    _, maps_filename, _, _ = synthetic_data
+    maps_img = nib.load(maps_filename)
+    target_affine = np.diag([4.0, 4.0, 4.0, 1.0])
+    target_shape = (7, 7, 6)
+
+    voxel_mask, maps, gram_pinv = fe.get_projection_operator(
+        maps_img, target_affine, target_shape
+    )
+
+    assert voxel_mask.shape == target_shape
+    assert maps.shape == (voxel_mask.sum(), N_REGIONS)
+    assert gram_pinv.shape == (N_REGIONS, N_REGIONS)
+
+
+@pytest.mark.parametrize(
+    ("mem_gb", "itemsize", "expected_length"),
+    [(1.0, 8, (1024**3 - 88) // 8328), (1.0, 2, (1024**3 - 88) // 2268), (1e-9, 8, 1)],
+)
+def test_get_chunk_length(mem_gb, itemsize, expected_length):
+    chunk_length = fe.get_chunk_length(1000, 10, 1, mem_gb=mem_gb, itemsize=itemsize)
+    assert chunk_length == expected_length
+
+
+def test_load_projection_operator(synthetic_data, tmp_path, monkeypatch):
+    func_filenames, maps_filename, _, _ = synthetic_data
+    maps_img = nib.load(maps_filename)
+    func_img = nib.load(func_filenames[0])
+    cache_dir = tmp_path / "cache"
+
+    expected = fe.get_projection_operator(maps_img, func_img.affine, func_img.shape[:3])
+    first = fe.load_projection_operator(
+        maps_img, func_img.affine, func_img.shape[:3], "atlas", cache_dir=cache_dir
+    )
+
+    # The second call must be served from the cache, without resampling
+    def fail(*args, **kwargs):
+        raise AssertionError("The projection operator was recomputed.")
+
+    monkeypatch.setattr(fe, "get_projection_operator", fail)
+    second = fe.load_projection_operator(
+        maps_img, func_img.affine, func_img.shape[:3], "atlas", cache_dir=cache_dir
+    )
+
+    for expected_array, first_array, second_array in zip(expected, first, second):
+        np.testing.assert_array_equal(first_array, expected_array)
+        np.testing.assert_array_equal(second_array, expected_array)
+    assert len(list((cache_dir / "operators").iterdir())) == 1
+
+    # Evicting everything leaves an empty cache
+    monkeypatch.undo()
+    fe.load_projection_operator(
+        maps_img,
+        np.diag([4.0, 4.0, 4.0, 1.0]),
+        (7, 7, 6),
+        "atlas",
+        cache_dir=cache_dir,
+        cache_max_gb=0,
+    )
+    assert not list((cache_dir / "operators").iterdir())
+
+
+@pytest.mark.parametrize("mem_gb", [1.0, 1e-5])
+def test_fit_transform_atlases(synthetic_data, tmp_path, mem_gb):
+    func_filenames, maps_filename, _, _ = synthetic_data
+
+    # A second atlas covering fewer voxels than the first one
+    maps_img = nib.load(maps_filename)
+    other_filename = str(tmp_path / "other_atlas.nii.gz")
+    nib.Nifti1Image(maps_img.get_fdata()[..., :2], maps_img.affine).to_filename(
+        other_filename
+    )
+
+    time_series = fe.fit_transform_atlases(
+        func_filenames, [maps_filename, other_filename], mem_gb=mem_gb
+    )
+
+    assert len(time_series) == 2
+    for atlas_filename, atlas_ts in zip([maps_filename, other_filename], time_series):
+        expected = fe.fit_transform_chunked(func_filenames, atlas_filename)
+        assert len(atlas_ts) == len(func_filenames)
+        for ts, expected_ts in zip(atlas_ts, expected):
+            np.testing.assert_allclose(ts, expected_ts, atol=1e-8)
+
+
+@pytest.mark.parametrize("sparse_threshold", [0.0, 0.8])
+def test_fit_transform_chunked_sparse(synthetic_data, tmp_path, sparse_threshold):
+    func_filenames, maps_filename, _, _ = synthetic_data
+    maps_img = nib.load(maps_filename)
+    func_img = nib.load(func_filenames[0])
+
+    dense_operator = fe.get_projection_operator(
+        maps_img, func_img.affine, func_img.shape[:3]
+    )
+    sparse_operator = fe.load_projection_operator(
+        maps_img,
+        func_img.affine,
+        func_img.shape[:3],
+        "atlas",
+        cache_dir=tmp_path / "cache",
+        sparse_threshold=sparse_threshold,
+    )
+    n_dense = np.count_nonzero(dense_operator[1])
+    error = fe.get_sparse_projection_error(dense_operator, sparse_operator)
+
+    expected = fe.fit_transform_chunked(func_filenames, maps_filename)
+    time_series = fe.fit_transform_chunked(
+        func_filenames,
+        maps_filename,
+        atlas_name="atlas",
+        cache_dir=tmp_path / "cache",
+        sparse_threshold=sparse_threshold,
+    )
+
+    if sparse_threshold == 0:
+        assert sparse_operator[1].nnz == n_dense
+        for ts, expected_ts in zip(time_series, expected):
+            np.testing.assert_allclose(ts, expected_ts, atol=1e-8)
+        return
+
+    # Pruning the maps approximates the region signals
+    assert sparse_operator[1].nnz < n_dense
+    assert 1e-3 < error < 1
+
+    # The error of the operator bounds the absolute error of the raw signals
+    voxel_mask, maps, gram_pinv = dense_operator
+    voxels = func_img.get_fdata()[voxel_mask].T
+    raw_expected = fe.project_timeseries(func_filenames[0], *dense_operator)
+    raw_sparse = fe.project_timeseries(func_filenames[0], *sparse_operator)
+    raw_error = np.linalg.norm(raw_sparse - raw_expected)
+    assert 0 < raw_error
+    assert raw_error <= (
+        error * np.linalg.norm(maps @ gram_pinv) * np.linalg.norm(voxels) + 1e-8
+    )
+
+    # The signal error is measured on the first chunk (here, the whole run)
+    signal_error = fe.get_sparse_signal_error(
+        func_filenames[0], dense_operator, sparse_operator
+    )
+    np.testing.assert_allclose(
+        signal_error, raw_error / np.linalg.norm(raw_expected), rtol=1e-6
+    )
+    for ts, expected_ts in zip(time_series, expected):
+        assert not np.allclose(ts, expected_ts)
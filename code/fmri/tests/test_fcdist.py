@@ -0,0 +1,45 @@
+import pytest
+import numpy as np
+import fmri.fcdist as fd
+
+from scipy.stats import gaussian_kde
+
+
+def test_get_upper_triangles():
+    rng = np.random.default_rng(seed=42)
+    fc_matrices = [rng.standard_normal((6, 6)) for _ in range(3)]
+
+    edges = fd.get_upper_triangles(fc_matrices)
+
+    upper_triangle_indices = np.triu_indices(6, k=1)
+    expected = np.stack([m[upper_triangle_indices] for m in fc_matrices])
+    np.testing.assert_array_equal(edges, expected)
+
+
+@pytest.mark.parametrize("mem_gb", [1.0, 1e-6])
+def test_histogram_rows(mem_gb):
+    rng = np.random.default_rng(seed=42)
+    edges = rng.standard_normal((4, 200))
+    edges[0, :10] = np.nan
+    bin_edges = np.linspace(-2, 2, 21)
+
+    counts = fd.histogram_rows(edges, bin_edges, mem_gb=mem_gb)
+
+    expected = [np.histogram(row[np.isfinite(row)], bins=bin_edges)[0] for row in edges]
+    np.testing.assert_array_equal(counts, expected)
+
+
+@pytest.mark.parametrize("kde", [True, False])
+def test_get_fc_densities(kde):
+    rng = np.random.default_rng(seed=42)
+    edges = rng.normal(0.2, 0.1, (5, 2000))
+
+    centers, densities = fd.get_fc_densities(edges, kde=kde)
+
+    assert densities.shape == (5, fd.N_BINS)
+    bin_width = centers[1] - centers[0]
+    np.testing.assert_allclose(densities.sum(axis=1) * bin_width, 1, rtol=1e-6)
+    if kde:
+        # Binning approximates the exact kernel density estimate
+        expected = gaussian_kde(edges[0])(centers)
+        np.testing.assert_allclose(densities[0], expected, atol=0.05 * expected.max())
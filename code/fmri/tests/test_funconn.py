@@ -0,0 +1,194 @@
+import pytest
+import numpy as np
+import pandas as pd
+import fmri.funconn as ff
+
+from nilearn.connectome import ConnectivityMeasure, vec_to_sym_matrix
+
+
+@pytest.mark.parametrize(
+    ("run_mem_gb", "n_procs", "mem_gb", "expected"),
+    [
+        ([1.0] * 10, 4, None, 4),
+        ([1.0] * 2, 4, None, 2),
+        ([1.0] * 10, 8, 3.5, 3),
+        ([1.0, 6.0], 8, 12.0, 2),
+        ([20.0] * 4, 8, 10.0, 1),
+        ([], 8, 10.0, 1),
+    ],
+)
+def test_get_n_workers(run_mem_gb, n_procs, mem_gb, expected):
+    assert ff.get_n_workers(run_mem_gb, n_procs=n_procs, mem_gb=mem_gb) == expected
+
+
+@pytest.mark.parametrize("strategy", ["correlation", "covariance"])
+def test_iter_connectivity(strategy):
+    rng = np.random.default_rng(seed=42)
+    time_series = [rng.standard_normal((100, 6)) for _ in range(3)]
+    estimator, kind, _ = ff.get_fc_strategy(strategy)
+
+    connectivity_measure = ConnectivityMeasure(
+        cov_estimator=estimator, kind=kind, vectorize=True, discard_diagonal=True
+    )
+    expected = vec_to_sym_matrix(
+        connectivity_measure.fit_transform(time_series), diagonal=np.zeros((3, 6))
+    )
+
+    fc_matrices = list(
+        ff.iter_connectivity(time_series, estimator=estimator, connectivity_kind=kind)
+    )
+    assert len(fc_matrices) == len(time_series)
+    np.testing.assert_allclose(np.stack(fc_matrices), expected)
+
+
+def test_load_run_confounds_cache(tmp_path, monkeypatch):
+    func_filenames = [
+        str(tmp_path / f"sub-1_task-rest_run-{run}_desc-preproc_bold.nii.gz")
+        for run in [1, 2]
+    ]
+    loaded = []
+
+    def load_confounds_files(func_filename, **kwargs):
+        loaded.extend(func_filename)
+        return [pd.DataFrame({"trans_x": [0.0, 1.0]})], [np.array([1])]
+
+    monkeypatch.setattr(ff, "_load_confounds_files", load_confounds_files)
+    kwargs = {"denoising_strategy": ("motion",), "cache_dir": str(tmp_path)}
+
+    confounds, sample_mask = ff.load_run_confounds(func_filenames, **kwargs)
+    assert loaded == func_filenames
+    assert len(confounds) == len(sample_mask) == 2
+
+    # The confounds are then read from the cache
+    cached_confounds, cached_mask = ff.load_run_confounds(func_filenames, **kwargs)
+    assert len(loaded) == 2
+    pd.testing.assert_frame_equal(cached_confounds[1], confounds[1])
+    assert np.array_equal(cached_mask[0], sample_mask[0])
+
+
+def test_get_work_plan():
+    func_filenames = [
+        ["/data/sub-1_task-rest_bold.nii.gz", "/data/sub-2_task-rest_bold.nii.gz"],
+        ["/data/sub-3_task-rest_bold.nii.gz"],
+    ]
+    headers = {
+        filename: {"shape": [10, 10, 10, 100]}
+        for filename in func_filenames[0] + func_filenames[1]
+    }
+
+    plan = ff.get_work_plan(
+        func_filenames,
+        [2.0, 1.6],
+        missing_ts=func_filenames[0],
+        missing_only_fc=func_filenames[1],
+        output="/output",
+        n_regions=64,
+        headers=headers,
+        n_procs=4,
+    )
+    assert "FoV/TR group 1 (TR = 2.0 s): 2 run(s), 2 to extract" in plan
+    assert "sub-3_task-rest_bold.nii.gz: FC only" in plan
+    assert "2 run(s) to extract with 2 worker(s)" in plan
+    assert "3 FC matrices to estimate" in plan
+
+
+def test_prepare_projection_operators(tmp_path, monkeypatch):
+    import nibabel as nib
+    import fmri.extraction as fe
+
+    rng = np.random.default_rng(seed=42)
+    affine = np.diag([3.0, 3.0, 3.0, 1.0])
+    maps = rng.random((6, 7, 5, 4))
+    maps[maps < 0.6] = 0
+    maps_filename = str(tmp_path / "atlas.nii.gz")
+    nib.Nifti1Image(maps, affine).to_filename(maps_filename)
+    func_filenames = []
+    for run in [1, 2]:
+        func_filenames.append(str(tmp_path / f"sub-1_run-{run}_bold.nii.gz"))
+        nib.Nifti1Image(rng.standard_normal((6, 7, 5, 10)), affine).to_filename(
+            func_filenames[-1]
+        )
+    engine_kwargs = {"atlas_name": "atlas", "cache_dir": str(tmp_path)}
+
+    operator_gb = ff.prepare_projection_operators(
+        func_filenames, maps_filename, engine_kwargs=engine_kwargs
+    )
+    voxel_mask = np.any(maps != 0, axis=-1)
+    expected_nbytes = voxel_mask.nbytes + 8 * (voxel_mask.sum() * 4 + 4**2)
+    assert operator_gb == pytest.approx([expected_nbytes / 1024**3] * 2)
+
+    # The workers then read the operators from the cache
+    def fail(*args, **kwargs):
+        raise AssertionError("The projection operator was recomputed.")
+
+    monkeypatch.setattr(fe, "get_projection_operator", fail)
+    fe.get_file_operators(
+        func_filenames, maps_filename, atlas_name="atlas", cache_dir=str(tmp_path)
+    )
+
+    # The chunked engine is budgeted with the memory held by the operators
+    run_mem_gb = ff.estimate_run_mem_gb(
+        func_filenames[0],
+        4,
+        engine="chunked",
+        engine_kwargs={"mem_gb": 1e-6},
+        operator_gb=operator_gb[0],
+    )
+    assert run_mem_gb == pytest.approx(operator_gb[0] + 40 * 6 * 7 * 5 / 1024**3)
+
+
+def test_extract_raw_timeseries_cache(tmp_path, monkeypatch):
+    func_filenames = [
+        str(tmp_path / f"sub-1_task-rest_run-{run}_desc-preproc_bold.nii.gz")
+        for run in [1, 2]
+    ]
+    rng = np.random.default_rng(seed=42)
+    extracted = []
+
+    def fit_transform_patched(func_filename, atlas_filename, **kwargs):
+        assert kwargs["standardize"] is False
+        extracted.extend(func_filename)
+        return [rng.standard_normal((50, 4)) for _ in func_filename]
+
+    monkeypatch.setattr(ff, "fit_transform_patched", fit_transform_patched)
+    engine_kwargs = {"cache_dir": str(tmp_path)}
+
+    # Without other denoising configurations, the signals are not cached
+    ff.extract_raw_timeseries(
+        func_filenames, "atlas.nii.gz", engine_kwargs=engine_kwargs, cache_signals=False
+    )
+    assert extracted == func_filenames
+    assert not list((tmp_path / "signals").iterdir())
+    extracted.clear()
+
+    time_series = ff.extract_raw_timeseries(
+        func_filenames, "atlas.nii.gz", engine_kwargs=engine_kwargs
+    )
+    assert extracted == func_filenames
+
+    # Denoising with another strategy reads the raw timeseries back from the cache
+    cached = ff.extract_raw_timeseries(
+        func_filenames, "atlas.nii.gz", engine_kwargs=engine_kwargs
+    )
+    assert len(extracted) == 2
+    np.testing.assert_array_equal(np.stack(cached), np.stack(time_series))
+
+
+def test_get_denoising_configurations(tmp_path):
+    defaults = {"low_pass": 0.15, "denoising_strategy": ("motion",), "no_censor": False}
+    assert ff.get_denoising_configurations(None, defaults) == [{"name": "", **defaults}]
+
+    configs_file = tmp_path / "configs.json"
+    configs_file.write_text(
+        '[{"name": "gsr", "denoising_strategy": ["motion", "global_signal"]},'
+        ' {"low_pass": null}]'
+    )
+    configurations = ff.get_denoising_configurations(str(configs_file), defaults)
+    assert configurations[0]["denoising_strategy"] == ("motion", "global_signal")
+    assert configurations[0]["low_pass"] == 0.15
+    assert configurations[1]["name"] == "config2"
+    assert configurations[1]["low_pass"] is None
+
+    configs_file.write_text('[{"low_pas": 0.1}]')
+    with pytest.raises(ValueError, match="low_pas"):
+        ff.get_denoising_configurations(str(configs_file), defaults)
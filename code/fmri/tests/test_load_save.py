@@ -1,6 +1,7 @@
 import pytest
 import os
 import random
+import numpy as np
 import pandas as pd
 import os.path as op
 import fmri.load_save as fl
@@ -23,6 +24,19 @@ def test_find_derivative(path, expected_path):
     assert der_path == expected_path
 
 
+@pytest.mark.parametrize(
+    ("path", "expected_path"),
+    [
+        ("/data/derivatives/fmriprep", "/data/derivatives"),
+        ("/data/derivatives/fmriprep/sub-001", "/data/derivatives"),
+        ("/data/my-derivatives-old/fmriprep", "/data/my-derivatives-old/fmriprep"),
+        ("/data/fmriprep", "/data/fmriprep"),
+    ],
+)
+def test_get_bids_index_dir(path, expected_path):
+    assert fl.get_bids_index_dir(path) == expected_path
+
+
 @pytest.mark.parametrize(
     "derivative_path", ["/home/derivatives", "/home/hcph-derivatives"]
 )
@@ -108,6 +122,47 @@ def test_find_atlas_dimension(path, expected_dim):
             fl.find_atlas_dimension(path)
 
 
+@pytest.mark.parametrize(
+    "filename",
+    [
+        "sub-001_ses-001_task-rest_run-2_space-MNI_desc-preproc_bold.nii.gz",
+        "sub-001_task-qct_bold.nii.gz",
+        "sub-001_bold.nii.gz",
+    ],
+)
+@pytest.mark.parametrize(
+    ("patterns", "fills"),
+    [
+        (fl.FC_PATTERN, {**fl.FC_FILLS, "meas": "correlation"}),
+        (fl.TIMESERIES_PATTERN, fl.TIMESERIES_FILLS),
+        (fl.CONFOUND_PATTERN, fl.CONFOUND_FILLS),
+    ],
+)
+def test_get_bids_savename(filename, patterns, fills):
+    from bids.layout import parse_file_entities
+    from bids.layout.writing import build_path
+
+    # The compiled patterns give the same paths as PyBIDS
+    entity = parse_file_entities(filename)
+    entity.update(fills)
+    expected = str(build_path(entity, patterns))
+
+    assert fl.get_bids_savename(filename, patterns=patterns, **fills) == expected
+    assert fl.get_bids_savename(filename, patterns=patterns, **fills) == expected
+
+
+def test_index_output(tmp_path):
+    (tmp_path / "sub-1" / "func").mkdir(parents=True)
+    (tmp_path / "sub-1" / "func" / "sub-1_connectivity.tsv").write_text("")
+    (tmp_path / "sub-1" / "func" / "sub-1_timeseries.zarr" / "0").mkdir(parents=True)
+
+    assert fl.index_output(str(tmp_path)) == {
+        op.join("sub-1", "func", "sub-1_connectivity.tsv"),
+        op.join("sub-1", "func", "sub-1_timeseries.zarr"),
+    }
+    assert fl.index_output(str(tmp_path / "missing")) == set()
+
+
 @pytest.mark.parametrize("return_existing", [False, True])
 @pytest.mark.parametrize("return_output", [False, True])
 @pytest.mark.parametrize("fc_label", ["sparse inverse covariance", "correlation"])
@@ -181,3 +236,152 @@ def test_check_existing_output(return_existing, return_output, fc_label, tmp_pat
     for file in existing_filenames:
         (tmp_path / file).unlink()
     tmp_path.rmdir()
+
+
+def test_check_existing_output_cache_keys(tmp_path):
+    func_filenames = [
+        str(
+            tmp_path
+            / "fmriprep"
+            / "sub-001"
+            / "func"
+            / f"sub-001_task-{task}_bold.nii.gz"
+        )
+        for task in ["rest", "qct"]
+    ]
+    output = str(tmp_path / "output")
+    parameters = {"low_pass": None, "fd_threshold": 0.4}
+    cache_keys = {
+        filename: fl.get_output_key(filename, parameters) for filename in func_filenames
+    }
+    kwargs = {"patterns": fl.TIMESERIES_PATTERN, **fl.TIMESERIES_FILLS}
+
+    fl.save_output(
+        [[[0.0, 1.0]]] * 2,
+        func_filenames,
+        output,
+        cache_keys=cache_keys,
+        parameters=parameters,
+        **kwargs,
+    )
+    assert not fl.check_existing_output(
+        output, func_filenames, cache_keys=cache_keys, **kwargs
+    )
+
+    # Changing a parameter invalidates the outputs computed with the previous value
+    new_keys = {
+        filename: fl.get_output_key(filename, {**parameters, "fd_threshold": 0.5})
+        for filename in func_filenames
+    }
+    assert all(
+        new_keys[filename] != cache_keys[filename] for filename in func_filenames
+    )
+    assert (
+        fl.check_existing_output(output, func_filenames, cache_keys=new_keys, **kwargs)
+        == func_filenames
+    )
+
+    # Outputs without a manifest are only reused when no key is requested
+    os.remove(
+        fl.get_manifest_filename(
+            op.join(output, fl.get_bids_savename(func_filenames[0], **kwargs))
+        )
+    )
+    assert (
+        fl.check_existing_output(
+            output, func_filenames, cache_keys=cache_keys, **kwargs
+        )
+        == func_filenames[:1]
+    )
+    assert not fl.check_existing_output(output, func_filenames, **kwargs)
+
+
+@pytest.mark.parametrize("storage", ["tsv", "npy", "hdf5", "zarr"])
+@pytest.mark.parametrize("dtype", ["float64", "float32"])
+def test_save_load_array(tmp_path, storage, dtype):
+    if storage == "hdf5":
+        pytest.importorskip("h5py")
+    elif storage == "zarr":
+        pytest.importorskip("zarr")
+
+    data = np.random.default_rng(seed=0).standard_normal((20, 7))
+    extension = fl.get_storage_fills(fl.FC_FILLS, storage)["extension"]
+    path = str(tmp_path / f"sub-001_connectivity{extension}")
+
+    fl.save_array(path, data, dtype=dtype)
+    loaded = fl.load_array(path)
+
+    assert loaded.shape == data.shape
+    if storage != "tsv":
+        assert loaded.dtype == np.dtype(dtype)
+    np.testing.assert_array_equal(np.asarray(loaded, dtype=dtype), data.astype(dtype))
+
+
+@pytest.mark.parametrize("has_sample_mask", [False, True])
+def test_cached_confounds(tmp_path, has_sample_mask):
+    func_filename = str(tmp_path / "sub-1_task-rest_desc-preproc_bold.nii.gz")
+    confounds_file = fl.get_confounds_filename(func_filename)
+    with open(confounds_file, "w") as f:
+        f.write("trans_x\ttrans_y\n0\t1\n")
+
+    parameters = {"denoising_strategy": ["motion"], "fd_threshold": 0.4}
+    path = fl.get_confounds_cache_filename(
+        func_filename, parameters, cache_dir=str(tmp_path / "cache")
+    )
+    assert fl.read_cached_confounds(path) is None
+
+    confounds = pd.DataFrame({"trans_x": [0.0, 0.5], "rot_z": [1.0, 2.0]})
+    sample_mask = np.array([0, 1]) if has_sample_mask else None
+    fl.write_cached_confounds(path, confounds, sample_mask)
+
+    cached_confounds, cached_mask = fl.read_cached_confounds(path)
+    pd.testing.assert_frame_equal(cached_confounds, confounds)
+    if has_sample_mask:
+        assert np.array_equal(cached_mask, sample_mask)
+    else:
+        assert cached_mask is None
+
+    # Other parameters or a modified confounds file use another entry
+    assert path != fl.get_confounds_cache_filename(
+        func_filename, {**parameters, "fd_threshold": 0.5}, str(tmp_path / "cache")
+    )
+    with open(confounds_file, "a") as f:
+        f.write("1\t2\n")
+    assert path != fl.get_confounds_cache_filename(
+        func_filename, parameters, str(tmp_path / "cache")
+    )
+
+
+@pytest.mark.parametrize("multi_echo", [False, True])
+def test_load_iqms(tmp_path, multi_echo):
+    mriqc_path = tmp_path / "mriqc"
+    mriqc_path.mkdir()
+    bids_names = [
+        f"sub-{sub}_ses-1_task-rest{echo}_bold"
+        for sub in [1, 2]
+        for echo in (["_echo-1", "_echo-2"] if multi_echo else [""])
+    ]
+    pd.DataFrame(
+        {
+            "bids_name": bids_names,
+            "fd_mean": np.arange(len(bids_names), dtype=float),
+            "dvars_std": np.ones(len(bids_names)),
+        }
+    ).to_csv(mriqc_path / "group_bold.tsv", sep="\t", index=False)
+    fc_paths = [
+        f"/data/sub-{sub}_ses-1_task-rest_meas-correlation_connectivity.tsv"
+        for sub in [2, 1, 3]
+    ]
+
+    for _ in range(2):
+        # The second call reads the store from the cache
+        iqms_df = fl.load_iqms(
+            str(tmp_path),
+            fc_paths,
+            mriqc_path=str(mriqc_path),
+            iqms_name=["fd_mean"],
+            cache_dir=str(tmp_path / "cache"),
+        )
+        assert iqms_df.columns.tolist() == ["fd_mean"]
+        expected = [3.0, 1.0] if multi_echo else [1.0, 0.0]
+        assert iqms_df["fd_mean"].tolist() == expected
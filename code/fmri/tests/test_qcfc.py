@@ -0,0 +1,41 @@
+import pytest
+import numpy as np
+import fmri.qcfc as fq
+
+from scipy.stats import ks_2samp
+
+
+def test_compute_qc_fc():
+    rng = np.random.default_rng(seed=42)
+    edges = rng.standard_normal((30, 12))
+    iqms = rng.standard_normal((3, 12))
+
+    qc_fc = fq.compute_qc_fc(edges, iqms)
+
+    expected = np.corrcoef(edges, iqms)[: len(edges), len(edges) :]
+    np.testing.assert_allclose(qc_fc, expected)
+
+
+@pytest.mark.parametrize("mem_gb", [1.0, 1e-6])
+def test_get_null_histogram(mem_gb):
+    rng = np.random.default_rng(seed=42)
+    edges = rng.standard_normal((50, 20))
+    iqm = rng.standard_normal(20)
+
+    counts = fq.get_null_histogram(edges, iqm, 100, mem_gb=mem_gb, n_jobs=2)
+    assert counts.sum() == 50 * 100
+
+    # Batches have their own seeds, so the number of jobs does not change the null
+    np.testing.assert_array_equal(
+        fq.get_null_histogram(edges, iqm, 100, mem_gb=mem_gb), counts
+    )
+
+
+def test_ks_statistic_binned():
+    rng = np.random.default_rng(seed=42)
+    values = rng.uniform(-0.5, 0.5, 1000)
+    null = rng.normal(0, 0.3, 5000)
+    counts = np.histogram(null, bins=fq.BIN_EDGES)[0]
+
+    expected = ks_2samp(values, null).statistic
+    assert fq.ks_statistic_binned(values, counts) == pytest.approx(expected, abs=1e-2)
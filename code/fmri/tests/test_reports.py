@@ -0,0 +1,109 @@
+import pytest
+import numpy as np
+import pandas as pd
+import matplotlib.image as mpimg
+import fmri.load_save as fl
+import fmri.reports as fr
+
+from fmri.options import GROUP_REPORTLET_NAMES
+
+
+@pytest.mark.parametrize("mode", ["none", "thumbnails"])
+def test_render_reports(tmp_path, mode):
+    output = str(tmp_path)
+    filename = "/data/sub-001/ses-001/func/sub-001_ses-001_task-rest_bold.nii.gz"
+    matrix_path = str(tmp_path / "sub-001_ses-001_task-rest_connectivity.npy")
+    fl.save_array(matrix_path, np.random.default_rng(seed=0).random((10, 10)))
+
+    report_tasks = [
+        (
+            fr.visual_report_fc,
+            {"matrix": matrix_path, "filename": filename, "output": output},
+        )
+    ]
+    fr.render_reports(report_tasks, mode=mode)
+
+    figures = list((tmp_path / "sub-001" / "figures").glob("*.png"))
+    if mode == "none":
+        assert not figures
+    else:
+        assert len(figures) == 1
+        height, width = mpimg.imread(figures[0]).shape[:2]
+        assert max(height, width) <= fr.THUMBNAIL_MAX_PIXELS
+
+
+def test_render_reports_mode():
+    with pytest.raises(ValueError):
+        fr.render_reports([], mode="pdf")
+
+
+def test_group_report_incremental(tmp_path, monkeypatch):
+    output = str(tmp_path)
+    rng = np.random.default_rng(seed=0)
+    fc_filenames = []
+    for i in range(3):
+        fc_filenames.append(str(tmp_path / f"sub-00{i}_connectivity.npy"))
+        fl.save_array(fc_filenames[-1], rng.random((5, 5)))
+    (tmp_path / "fMRI_duration_after_censoring.csv").write_text("filename,duration\n")
+    atlas_filename = tmp_path / "atlas.nii"
+    atlas_filename.write_bytes(b"atlas")
+    iqms_df = pd.DataFrame({"fd_mean": rng.random(3)})
+
+    rendered, tasks = [], []
+
+    def render(names, inputs, output, n_jobs):
+        # The workers receive the paths of the FC matrices
+        assert inputs.get("fc", fc_filenames) == fc_filenames
+        tasks.append(names)
+        for name in names:
+            rendered.append(name)
+            filename = fr.GROUP_REPORTLETS[name]["filename"]
+            (tmp_path / "reportlets" / filename).write_text(name)
+
+    monkeypatch.setattr(fr, "_render_group_reportlets", render)
+    monkeypatch.setattr(fr.Report, "generate_report", lambda self: None)
+    monkeypatch.setattr(fr.Report, "__init__", lambda self, *args, **kwargs: None)
+
+    def build(**kwargs):
+        rendered.clear()
+        fr.group_report(fc_filenames, iqms_df, str(atlas_filename), output, **kwargs)
+        return sorted(rendered)
+
+    assert build() == sorted(GROUP_REPORTLET_NAMES)
+    # Both the QC-FC reportlets are rendered by the same worker
+    assert fr.QC_FC_REPORTLETS in tasks
+    assert build() == []
+
+    # Only the reportlets depending on the modified input are rendered again
+    iqms_df.loc[0, "fd_mean"] = 2.0
+    assert build() == ["qcfc", "qcfcvseuclidean"]
+    atlas_filename.write_bytes(b"other atlas")
+    assert build() == ["qcfcvseuclidean"]
+    assert build(only=["fcdist"]) == ["fcdist"]
+    with pytest.raises(ValueError):
+        build(only=["carpet"])
+
+
+def test_decimate_minmax():
+    rng = np.random.default_rng(seed=0)
+    timeseries = rng.standard_normal((1000, 4))
+
+    x, envelope = fr.decimate_minmax(timeseries, 100)
+
+    assert x.shape == (200,) and envelope.shape == (200, 4)
+    np.testing.assert_array_equal(envelope[0::2], timeseries.reshape(100, 10, 4).min(1))
+    np.testing.assert_array_equal(envelope[1::2], timeseries.reshape(100, 10, 4).max(1))
+    np.testing.assert_array_equal(x[:4], [0, 9, 10, 19])
+
+    x, envelope = fr.decimate_minmax(timeseries, 500)
+    np.testing.assert_array_equal(envelope, timeseries)
+
+
+def test_downsample_image():
+    image = np.arange(24, dtype=float).reshape(4, 6)
+
+    np.testing.assert_allclose(
+        fr.downsample_image(image, (2, 3)),
+        image.reshape(2, 2, 3, 2).mean(axis=(1, 3)),
+    )
+    np.testing.assert_array_equal(fr.downsample_image(image, (10, 10)), image)